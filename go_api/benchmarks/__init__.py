@@ -0,0 +1,8 @@
+"""
+Benchmarks for the toolkit.
+
+Each benchmark module can be run as a script and writes its results as
+JSON, so that results from different versions can be compared, e.g.::
+
+    python -m go_api.benchmarks.load --output results.json
+"""
@@ -0,0 +1,91 @@
+"""
+Helpers shared by the benchmark modules.
+"""
+
+import gc
+import json
+import math
+import platform
+import resource
+import sys
+import timeit
+
+import go_api
+
+
+def percentile(values, p):
+    """
+    Return the ``p``-th percentile of ``values`` using the nearest-rank
+    method, or ``None`` if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def best_time(f, repeat):
+    """
+    Call ``f`` ``repeat`` times with garbage collection disabled and return
+    the shortest time taken, in seconds.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = []
+        for _ in xrange(repeat):
+            start = timeit.default_timer()
+            f()
+            times.append(timeit.default_timer() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return min(times)
+
+
+def peak_rss_kb():
+    """
+    Return the peak resident set size of this process so far, in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes rather than kilobytes.
+        rss //= 1024
+    return rss
+
+
+def benchmark_report(name, settings, results):
+    """
+    Build a machine-readable benchmark report.
+
+    :param str name:
+        The name of the benchmark.
+    :param dict settings:
+        The settings the benchmark was run with.
+    :param list results:
+        A list of result dicts, one per measurement.
+    """
+    return {
+        "benchmark": name,
+        "go_api_version": go_api.__version__,
+        "python_version": platform.python_version(),
+        "python_implementation": platform.python_implementation(),
+        "settings": settings,
+        "results": results,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def write_report(report, output=None):
+    """
+    Write a benchmark report as JSON to the file named ``output``, or to
+    stdout if ``output`` is ``None`` or ``"-"``.
+    """
+    data = json.dumps(
+        report, indent=2, sort_keys=True, separators=(",", ": "))
+    if output is None or output == "-":
+        sys.stdout.write(data + "\n")
+    else:
+        with open(output, "w") as f:
+            f.write(data + "\n")
@@ -0,0 +1,286 @@
+"""
+Load-testing benchmark for :class:`ApiApplication`.
+
+Starts an :class:`ApiApplication` serving an :class:`InMemoryCollection` on
+localhost and drives concurrent traffic at it, one scenario at a time. For
+each scenario it reports requests per second, median and 99th percentile
+latency and the peak resident set size of the process so far.
+
+The HTTP clients run in the same process and reactor as the server, so the
+numbers include client overhead. They are meant for comparing versions of
+the toolkit on the same machine, not as absolute capacity figures.
+
+Run it with::
+
+    python -m go_api.benchmarks.load --collection-size 1000 \\
+        --concurrency 10 --requests 1000 --output results.json
+"""
+
+import argparse
+import json
+import time
+
+import treq
+from twisted.internet.defer import (
+    gatherResults, inlineCallbacks, returnValue)
+from twisted.internet.task import react
+from twisted.web.client import HTTPConnectionPool
+
+from go_api.collections import InMemoryCollection
+from go_api.cyclone.handlers import ApiApplication
+
+from .common import benchmark_report, peak_rss_kb, percentile, write_report
+
+
+SCENARIOS = ("get", "page", "stream", "post", "put", "delete")
+
+
+def make_object(i):
+    """
+    Return the data for a benchmark object.
+    """
+    return {
+        "name": "Object %d" % (i,),
+        "value": i,
+        "tags": ["benchmark", "tag-%d" % (i % 10,)],
+        "address": {"street": "%d Main Road" % (i,), "city": "Cape Town"},
+    }
+
+
+def make_app(collection, compression_level=0):
+    """
+    Return an :class:`ApiApplication` that serves ``collection`` at
+    ``/store/``. If ``compression_level`` isn't ``0``, responses of every
+    size are compressed.
+    """
+    class BenchmarkApp(ApiApplication):
+        collections = (('/store', lambda handler: collection),)
+        factory_preprocessor = None
+
+    BenchmarkApp.compression_level = compression_level
+    if compression_level > 0:
+        BenchmarkApp.compression_min_size = 0
+    return BenchmarkApp()
+
+
+def summarize(scenario, latencies, errors, duration):
+    """
+    Return a result dict for a scenario.
+
+    :param list latencies:
+        The latency of each request, in seconds.
+    :param int errors:
+        The number of requests that failed.
+    :param float duration:
+        The time taken to run the whole scenario, in seconds.
+    """
+    def ms(seconds):
+        return None if seconds is None else seconds * 1000.0
+    return {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_seconds": duration,
+        "requests_per_second": len(latencies) / duration if duration else None,
+        "latency_p50_ms": ms(percentile(latencies, 50)),
+        "latency_p99_ms": ms(percentile(latencies, 99)),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+@inlineCallbacks
+def run_scenario(scenario, make_request, requests, concurrency):
+    """
+    Make ``requests`` requests, ``concurrency`` at a time, and return a
+    result dict.
+
+    :param func make_request:
+        A function that takes the request number and returns a deferred
+        that fires with a :mod:`treq` response.
+    """
+    latencies = []
+    errors = [0]
+    # The workers share the iterator, so each request is made exactly once.
+    request_numbers = iter(xrange(requests))
+
+    @inlineCallbacks
+    def worker():
+        for i in request_numbers:
+            start = time.time()
+            try:
+                resp = yield make_request(i)
+                yield resp.content()
+                ok = 200 <= resp.code < 300
+            except Exception:
+                ok = False
+            latencies.append(time.time() - start)
+            if not ok:
+                errors[0] += 1
+
+    start = time.time()
+    yield gatherResults([worker() for _ in xrange(concurrency)])
+    returnValue(summarize(scenario, latencies, errors[0], time.time() - start))
+
+
+class LoadBenchmark(object):
+    """
+    Runs the load benchmark scenarios against a collection.
+
+    :param int collection_size:
+        The number of objects to put in the collection.
+    :param int concurrency:
+        The number of requests to make at the same time.
+    :param int requests:
+        The number of requests to make for each scenario.
+    :param int page_size:
+        The ``max_results`` to use for page requests.
+    :param dict collection_kw:
+        Extra arguments for the :class:`InMemoryCollection`.
+    :param int compression_level:
+        The application's compression level. Defaults to no compression.
+    """
+
+    def __init__(self, collection_size=1000, concurrency=10, requests=1000,
+                 page_size=50, collection_kw=None, compression_level=0):
+        self.collection_size = collection_size
+        self.concurrency = concurrency
+        self.requests = requests
+        self.page_size = page_size
+        self.collection = InMemoryCollection(**(collection_kw or {}))
+        self.object_ids = ["obj-%06d" % (i,) for i in xrange(collection_size)]
+        for i, object_id in enumerate(self.object_ids):
+            self.collection._set_data(object_id, make_object(i))
+        self.app = make_app(self.collection, compression_level)
+
+    def _url(self, path):
+        return "http://127.0.0.1:%d/store/%s" % (
+            self.port.getHost().port, path)
+
+    def _object_id(self, i):
+        return self.object_ids[i % len(self.object_ids)]
+
+    def _request(self, method, path, data=None):
+        kw = {"pool": self.pool}
+        if data is not None:
+            kw["data"] = json.dumps(data)
+        return treq.request(method, self._url(path), **kw)
+
+    def req_get(self, i):
+        return self._request("GET", self._object_id(i))
+
+    def req_page(self, i):
+        return self._request("GET", "?max_results=%d" % (self.page_size,))
+
+    def req_stream(self, i):
+        return self._request("GET", "?stream=true")
+
+    def req_post(self, i):
+        return self._request("POST", "", make_object(i))
+
+    def req_put(self, i):
+        return self._request("PUT", self._object_id(i), make_object(i))
+
+    def setup_delete(self):
+        for i in xrange(self.requests):
+            self.collection._set_data("delete-%06d" % (i,), make_object(i))
+
+    def req_delete(self, i):
+        return self._request("DELETE", "delete-%06d" % (i,))
+
+    @inlineCallbacks
+    def run(self, scenarios=SCENARIOS):
+        """
+        Run the given scenarios in order and return a list of result dicts.
+        """
+        from twisted.internet import reactor
+        self.port = reactor.listenTCP(0, self.app, interface="127.0.0.1")
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.concurrency
+        results = []
+        try:
+            for scenario in scenarios:
+                setup = getattr(self, "setup_" + scenario, None)
+                if setup is not None:
+                    setup()
+                result = yield run_scenario(
+                    scenario, getattr(self, "req_" + scenario),
+                    self.requests, self.concurrency)
+                results.append(result)
+        finally:
+            yield self.pool.closeCachedConnections()
+            yield self.port.stopListening()
+        returnValue(results)
+
+    def settings(self):
+        return {
+            "collection_size": self.collection_size,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "page_size": self.page_size,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--collection-size", type=int, default=1000,
+        help="Number of objects in the collection (default: %(default)s).")
+    parser.add_argument(
+        "--concurrency", type=int, default=10,
+        help="Number of concurrent requests (default: %(default)s).")
+    parser.add_argument(
+        "--requests", type=int, default=1000,
+        help="Number of requests per scenario (default: %(default)s).")
+    parser.add_argument(
+        "--page-size", type=int, default=50,
+        help="max_results for page requests (default: %(default)s).")
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS),
+        help="Comma-separated scenarios to run (default: %(default)s).")
+    parser.add_argument(
+        "--keyset-cursors", action="store_true",
+        help="Use keyset cursors in the collection.")
+    parser.add_argument(
+        "--frozen-rows", action="store_true",
+        help="Store frozen rows in the collection.")
+    parser.add_argument(
+        "--compression-level", type=int, default=0,
+        help="Response compression level, 0 to disable (default: "
+             "%(default)s).")
+    parser.add_argument(
+        "--output", default=None,
+        help="File to write JSON results to (default: stdout).")
+    args = parser.parse_args(argv)
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("Unknown scenario: %s" % (scenario,))
+    return args
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parse_args(list(argv) or None)
+    benchmark = LoadBenchmark(
+        collection_size=args.collection_size,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        page_size=args.page_size,
+        collection_kw={
+            "keyset_cursors": args.keyset_cursors,
+            "frozen_rows": args.frozen_rows,
+        },
+        compression_level=args.compression_level)
+    results = yield benchmark.run(args.scenarios)
+    settings = benchmark.settings()
+    settings.update({
+        "keyset_cursors": args.keyset_cursors,
+        "frozen_rows": args.frozen_rows,
+        "compression_level": args.compression_level,
+    })
+    write_report(benchmark_report("load", settings, results), args.output)
+
+
+if __name__ == "__main__":
+    import sys
+    react(main, sys.argv[1:])
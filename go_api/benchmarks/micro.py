@@ -0,0 +1,286 @@
+"""
+Microbenchmarks for :class:`PausingDeferredQueue`, :func:`simulate_async`
+and :func:`defer_async`.
+
+The queue benchmarks measure items per second for put/get under several
+``size``/``backlog`` settings, with Twisted's :class:`DeferredQueue` as a
+baseline. Each scenario moves items through the queue ``depth`` at a time:
+
+``put_then_get``
+    Put ``depth`` items, then get them, so gets are answered from the
+    queue.
+``get_then_put``
+    Make ``depth`` gets, then put ``depth`` items, so puts are handed to
+    waiting gets.
+``batch``
+    Use ``put_many`` and ``get_many`` to move ``depth`` items at a time.
+    Only :class:`PausingDeferredQueue` supports this.
+
+The async benchmarks measure the cost per call of :func:`defer_async` and
+of a function wrapped with :func:`simulate_async`, including the reactor
+turn each call waits for. Calls are made ``batch`` at a time. The
+``_batched`` variants use a :class:`BatchingScheduler`, so each batch needs
+only one reactor call. A function returning :func:`succeed` is the
+synchronous baseline.
+
+Python 2 has no allocation tracer, so allocations are reported as the
+number of :class:`Deferred` instances created per item or call, counted in
+a separate untimed run. These are the bulk of the per-item allocations.
+
+Run it with::
+
+    python -m go_api.benchmarks.micro --items 100000 --output results.json
+"""
+
+import argparse
+import timeit
+
+from twisted.internet.defer import (
+    Deferred, DeferredQueue, inlineCallbacks, returnValue, succeed)
+from twisted.internet.task import Clock, react
+
+from go_api.queue import PausingDeferredQueue
+from go_api.utils import BatchingScheduler, defer_async, simulate_async
+
+from .common import benchmark_report, best_time, write_report
+
+
+QUEUES = (
+    ("pausing", PausingDeferredQueue),
+    ("twisted", DeferredQueue),
+)
+
+# (size, backlog) pairs.
+QUEUE_SETTINGS = ((None, None), (1, 1), (1000, 1000))
+
+DEPTHS = (1, 100)
+
+BENCHMARKS = ("queue", "async")
+
+
+def _sink(result):
+    return result
+
+
+def put_then_get(q, items, depth):
+    put, get = q.put, q.get
+    for _ in xrange(items // depth):
+        for i in xrange(depth):
+            put(i)
+        for _ in xrange(depth):
+            get().addCallback(_sink)
+
+
+def get_then_put(q, items, depth):
+    put, get = q.put, q.get
+    for _ in xrange(items // depth):
+        for _ in xrange(depth):
+            get().addCallback(_sink)
+        for i in xrange(depth):
+            put(i)
+
+
+def batch(q, items, depth):
+    objs = range(depth)
+    for _ in xrange(items // depth):
+        q.put_many(objs)
+        q.get_many(depth).addCallback(_sink)
+
+
+QUEUE_SCENARIOS = (
+    ("put_then_get", put_then_get),
+    ("get_then_put", get_then_put),
+    ("batch", batch),
+)
+
+
+def count_deferreds(f, *args, **kw):
+    """
+    Call ``f`` and return the number of :class:`Deferred` instances created
+    while it ran.
+    """
+    created = [0]
+    original_init = Deferred.__init__
+
+    def counting_init(self, *args, **kw):
+        created[0] += 1
+        original_init(self, *args, **kw)
+
+    Deferred.__init__ = counting_init
+    try:
+        f(*args, **kw)
+    finally:
+        Deferred.__init__ = original_init
+    return created[0]
+
+
+def queue_cases(items):
+    """
+    Yield ``(queue_name, queue_cls, scenario, func, size, backlog, depth)``
+    for each queue benchmark that makes sense to run.
+    """
+    for queue_name, queue_cls in QUEUES:
+        for scenario, func in QUEUE_SCENARIOS:
+            if scenario == "batch" and not hasattr(queue_cls, "put_many"):
+                continue
+            for size, backlog in QUEUE_SETTINGS:
+                for depth in DEPTHS:
+                    limit = backlog if scenario == "get_then_put" else size
+                    if depth > items or (limit is not None and depth > limit):
+                        continue
+                    yield (queue_name, queue_cls, scenario, func, size,
+                           backlog, depth)
+
+
+def run_queue_benchmarks(items, repeat):
+    """
+    Run the queue benchmarks and return a list of result dicts.
+    """
+    results = []
+    for (queue_name, queue_cls, scenario, func, size, backlog,
+         depth) in queue_cases(items):
+        def run(items=items):
+            func(queue_cls(size=size, backlog=backlog), items, depth)
+        count = (items // depth) * depth
+        seconds = best_time(run, repeat)
+        deferreds = count_deferreds(run, items=depth)
+        results.append({
+            "benchmark": "queue",
+            "queue": queue_name,
+            "scenario": scenario,
+            "size": size,
+            "backlog": backlog,
+            "depth": depth,
+            "items": count,
+            "seconds": seconds,
+            "items_per_second": count / seconds if seconds else None,
+            "deferreds_per_item": deferreds / float(depth),
+        })
+    return results
+
+
+def async_cases(reactor):
+    """
+    Return ``(name, make_call)`` pairs for the async benchmarks.
+    """
+    def returns_none():
+        return None
+
+    def returns_succeed():
+        return succeed(None)
+
+    scheduler = BatchingScheduler(reactor)
+    return (
+        ("succeed", returns_succeed),
+        ("defer_async", lambda: defer_async(None, reactor=reactor)),
+        ("defer_async_batched", lambda: defer_async(None, reactor=scheduler)),
+        ("simulate_async", simulate_async(returns_none, reactor=reactor)),
+        ("simulate_async_batched",
+         simulate_async(returns_none, reactor=scheduler)),
+        ("simulate_async_deferred",
+         simulate_async(returns_succeed, reactor=reactor)),
+    )
+
+
+@inlineCallbacks
+def time_async_calls(make_call, calls, batch):
+    """
+    Make ``calls`` calls to ``make_call``, ``batch`` at a time, waiting for
+    the deferreds each batch returns. Returns the time taken, in seconds.
+    """
+    start = timeit.default_timer()
+    for _ in xrange(calls // batch):
+        ds = [make_call() for _ in xrange(batch)]
+        # The calls fire in the order they were made, so when the last one
+        # has fired the whole batch has.
+        yield ds[-1]
+    returnValue(timeit.default_timer() - start)
+
+
+@inlineCallbacks
+def run_async_benchmarks(reactor, calls, batch, repeat):
+    """
+    Run the async benchmarks and return a list of result dicts.
+    """
+    results = []
+    batch = max(1, min(batch, calls))
+    count = (calls // batch) * batch
+    for name, make_call in async_cases(reactor):
+        times = []
+        for _ in xrange(repeat):
+            seconds = yield time_async_calls(make_call, calls, batch)
+            times.append(seconds)
+        seconds = min(times)
+
+        # Count on a clock, so the counting run doesn't leave calls
+        # pending on the real reactor.
+        clock = Clock()
+        counted_call = dict(async_cases(clock))[name]
+        deferreds = count_deferreds(counted_call)
+        clock.advance(0)
+
+        results.append({
+            "benchmark": "async",
+            "function": name,
+            "calls": count,
+            "batch": batch,
+            "seconds": seconds,
+            "calls_per_second": count / seconds if seconds else None,
+            "us_per_call": seconds * 1e6 / count if count else None,
+            "deferreds_per_call": deferreds,
+        })
+    returnValue(results)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--items", type=int, default=100000,
+        help="Items per queue benchmark (default: %(default)s).")
+    parser.add_argument(
+        "--calls", type=int, default=100000,
+        help="Calls per async benchmark (default: %(default)s).")
+    parser.add_argument(
+        "--batch", type=int, default=100,
+        help="Async calls made before waiting for them (default: "
+             "%(default)s).")
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Times to repeat each measurement; the best time is reported "
+             "(default: %(default)s).")
+    parser.add_argument(
+        "--benchmarks", default=",".join(BENCHMARKS),
+        help="Comma-separated benchmarks to run (default: %(default)s).")
+    parser.add_argument(
+        "--output", default=None,
+        help="File to write JSON results to (default: stdout).")
+    args = parser.parse_args(argv)
+    args.benchmarks = [b for b in args.benchmarks.split(",") if b]
+    for benchmark in args.benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error("Unknown benchmark: %s" % (benchmark,))
+    return args
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parse_args(list(argv) or None)
+    results = []
+    if "queue" in args.benchmarks:
+        results.extend(run_queue_benchmarks(args.items, args.repeat))
+    if "async" in args.benchmarks:
+        async_results = yield run_async_benchmarks(
+            reactor, args.calls, args.batch, args.repeat)
+        results.extend(async_results)
+    settings = {
+        "items": args.items,
+        "calls": args.calls,
+        "batch": args.batch,
+        "repeat": args.repeat,
+    }
+    write_report(benchmark_report("micro", settings, results), args.output)
+
+
+if __name__ == "__main__":
+    import sys
+    react(main, sys.argv[1:])
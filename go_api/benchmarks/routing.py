@@ -0,0 +1,144 @@
+"""
+Route-matching benchmark for :class:`ApiApplication`.
+
+Builds the route table of an application with many collections and
+measures how long it takes to match request paths against it, both by
+trying each route's regex in turn (as Cyclone does) and with a
+:class:`RouteTrie`. Paths that match the first, middle and last collection
+are measured, as well as a path that matches no route.
+
+Run it with::
+
+    python -m go_api.benchmarks.routing --collections 10,100,1000 \\
+        --output results.json
+"""
+
+import argparse
+
+from go_api.cyclone.handlers import ApiApplication
+from go_api.cyclone.router import RouteTrie, match_args
+
+from .common import benchmark_report, best_time, write_report
+
+
+ROUTERS = ("regex", "trie")
+
+
+def make_routes(collections):
+    """
+    Return the route table of an application with ``collections``
+    collections.
+    """
+    class BenchmarkApp(ApiApplication):
+        factory_preprocessor = None
+
+    BenchmarkApp.collections = tuple(
+        ("/:owner_id/collection-%d" % (i,), lambda handler: None)
+        for i in xrange(collections))
+    return BenchmarkApp().handlers[0][1]
+
+
+def regex_match(specs, path):
+    """
+    Match ``path`` the way Cyclone does, by trying each route's regex in
+    turn.
+    """
+    for spec in specs:
+        match = spec.regex.match(path)
+        if match is not None:
+            args, kwargs = match_args(spec, match)
+            return spec, args, kwargs
+    return None
+
+
+def target_paths(collections):
+    """
+    Return ``(target, path)`` pairs for the paths to match.
+    """
+    return (
+        ("first", "/owner-1/collection-0/obj-1"),
+        ("middle", "/owner-1/collection-%d/obj-1" % (collections // 2,)),
+        ("last", "/owner-1/collection-%d/obj-1" % (collections - 1,)),
+        ("missing", "/owner-1/missing/obj-1"),
+    )
+
+
+def run_benchmarks(collections, lookups, repeat):
+    """
+    Run the benchmark for each number of collections and return a list of
+    result dicts.
+    """
+    results = []
+    for count in collections:
+        specs = make_routes(count)
+        trie = RouteTrie(specs)
+        matchers = {
+            "regex": lambda path: regex_match(specs, path),
+            "trie": trie.match,
+        }
+        for target, path in target_paths(count):
+            if regex_match(specs, path) != trie.match(path):
+                raise AssertionError(
+                    "Routers disagree about %r" % (path,))
+            for router in ROUTERS:
+                match = matchers[router]
+
+                def run():
+                    for _ in xrange(lookups):
+                        match(path)
+
+                seconds = best_time(run, repeat)
+                results.append({
+                    "collections": count,
+                    "routes": len(specs),
+                    "target": target,
+                    "router": router,
+                    "lookups": lookups,
+                    "seconds": seconds,
+                    "lookups_per_second": (
+                        lookups / seconds if seconds else None),
+                    "us_per_lookup": seconds * 1e6 / lookups,
+                })
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--collections", default="10,100,1000",
+        help="Comma-separated numbers of collections in the route table "
+             "(default: %(default)s).")
+    parser.add_argument(
+        "--lookups", type=int, default=10000,
+        help="Paths to match per measurement (default: %(default)s).")
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Times to repeat each measurement; the best time is reported "
+             "(default: %(default)s).")
+    parser.add_argument(
+        "--output", default=None,
+        help="File to write JSON results to (default: stdout).")
+    args = parser.parse_args(argv)
+    try:
+        args.collections = [int(c) for c in args.collections.split(",") if c]
+    except ValueError:
+        parser.error("Invalid collections: %s" % (args.collections,))
+    if not all(c > 0 for c in args.collections):
+        parser.error("Collections must be positive.")
+    return args
+
+
+def main(*argv):
+    args = parse_args(list(argv) or None)
+    results = run_benchmarks(args.collections, args.lookups, args.repeat)
+    settings = {
+        "collections": args.collections,
+        "lookups": args.lookups,
+        "repeat": args.repeat,
+    }
+    write_report(benchmark_report("routing", settings, results), args.output)
+
+
+if __name__ == "__main__":
+    import sys
+    main(*sys.argv[1:])
@@ -0,0 +1,63 @@
+import gc
+import json
+import sys
+from StringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+
+import go_api
+from go_api.benchmarks.common import (
+    benchmark_report, best_time, peak_rss_kb, percentile, write_report)
+
+
+class TestPercentile(TestCase):
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), None)
+
+    def test_single(self):
+        self.assertEqual(percentile([3], 50), 3)
+        self.assertEqual(percentile([3], 0), 3)
+
+    def test_nearest_rank(self):
+        values = range(100, 0, -1)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+
+
+class TestReports(TestCase):
+    def test_peak_rss_kb(self):
+        self.assertTrue(peak_rss_kb() > 0)
+
+    def test_benchmark_report(self):
+        report = benchmark_report("foo", {"size": 1}, [{"a": 1}])
+        self.assertEqual(report["benchmark"], "foo")
+        self.assertEqual(report["go_api_version"], go_api.__version__)
+        self.assertEqual(report["settings"], {"size": 1})
+        self.assertEqual(report["results"], [{"a": 1}])
+        self.assertTrue(report["peak_rss_kb"] > 0)
+
+    def test_write_report_stdout(self):
+        self.patch(sys, "stdout", StringIO())
+        write_report({"a": [1]})
+        self.assertEqual(json.loads(sys.stdout.getvalue()), {"a": [1]})
+
+    def test_write_report_file(self):
+        path = self.mktemp()
+        write_report({"a": [1]}, path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), {"a": [1]})
+
+
+class TestBestTime(TestCase):
+    def test_best_time(self):
+        calls = []
+        seconds = best_time(lambda: calls.append(None), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(seconds >= 0)
+
+    def test_gc_restored(self):
+        self.assertTrue(gc.isenabled())
+        best_time(lambda: self.assertFalse(gc.isenabled()), 1)
+        self.assertTrue(gc.isenabled())
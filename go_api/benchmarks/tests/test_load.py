@@ -0,0 +1,83 @@
+import sys
+from StringIO import StringIO
+
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.trial.unittest import TestCase
+
+from go_api.benchmarks.load import (
+    SCENARIOS, LoadBenchmark, make_app, parse_args, run_scenario, summarize)
+from go_api.collections import InMemoryCollection
+from go_api.cyclone.compression import CompressionTransform
+
+
+class DummyResponse(object):
+    def __init__(self, code):
+        self.code = code
+
+    def content(self):
+        return succeed("")
+
+
+class TestLoad(TestCase):
+    def test_summarize(self):
+        result = summarize("get", [0.001, 0.002, 0.003], 1, 0.5)
+        self.assertEqual(result["scenario"], "get")
+        self.assertEqual(result["requests"], 3)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["requests_per_second"], 6.0)
+        self.assertEqual(result["latency_p50_ms"], 2.0)
+        self.assertEqual(result["latency_p99_ms"], 3.0)
+
+    @inlineCallbacks
+    def test_run_scenario(self):
+        made = []
+
+        def make_request(i):
+            made.append(i)
+            if i == 3:
+                raise ValueError("Oops")
+            return succeed(DummyResponse(500 if i == 4 else 200))
+
+        result = yield run_scenario("get", make_request, 10, 3)
+        self.assertEqual(sorted(made), range(10))
+        self.assertEqual(result["requests"], 10)
+        self.assertEqual(result["errors"], 2)
+
+    @inlineCallbacks
+    def test_run(self):
+        benchmark = LoadBenchmark(
+            collection_size=5, concurrency=2, requests=4, page_size=2)
+        results = yield benchmark.run()
+        self.assertEqual(
+            [r["scenario"] for r in results], list(SCENARIOS))
+        for result in results:
+            self.assertEqual(result["requests"], 4)
+            self.assertEqual(result["errors"], 0)
+        # The deleted objects are gone, and the posted ones were added.
+        keys = yield benchmark.collection.all_keys()
+        self.assertEqual(len(keys), 5 + 4)
+
+    def test_make_app_compression(self):
+        def compression_transforms(app):
+            return [t for t in app.transforms
+                    if issubclass(t, CompressionTransform)]
+
+        app = make_app(InMemoryCollection())
+        self.assertEqual(compression_transforms(app), [])
+        # Responses of every size are compressed, as the benchmark objects
+        # are small.
+        app = make_app(InMemoryCollection(), compression_level=6)
+        [transform] = compression_transforms(app)
+        self.assertEqual((transform.min_size, transform.level), (0, 6))
+
+    def test_parse_args(self):
+        args = parse_args([])
+        self.assertEqual(args.scenarios, list(SCENARIOS))
+        self.assertEqual(args.collection_size, 1000)
+        args = parse_args(["--scenarios", "get,put", "--concurrency", "3"])
+        self.assertEqual(args.scenarios, ["get", "put"])
+        self.assertEqual(args.concurrency, 3)
+
+    def test_parse_args_unknown_scenario(self):
+        self.patch(sys, "stderr", StringIO())
+        self.assertRaises(SystemExit, parse_args, ["--scenarios", "foo"])
@@ -0,0 +1,87 @@
+import sys
+from StringIO import StringIO
+
+from twisted.internet.defer import Deferred, DeferredQueue, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from go_api.benchmarks.micro import (
+    BENCHMARKS, async_cases, batch, count_deferreds, get_then_put,
+    parse_args, put_then_get, queue_cases, run_async_benchmarks,
+    run_queue_benchmarks)
+from go_api.queue import PausingDeferredQueue
+
+
+class TestQueueBenchmarks(TestCase):
+    def assert_moves_items(self, func, q, items, depth):
+        func(q, items, depth)
+        self.assertEqual(len(q.pending), 0)
+        self.assertEqual(len(q.waiting), 0)
+
+    def test_scenarios(self):
+        for queue_cls in (PausingDeferredQueue, DeferredQueue):
+            self.assert_moves_items(put_then_get, queue_cls(), 10, 5)
+            self.assert_moves_items(get_then_put, queue_cls(), 10, 5)
+        self.assert_moves_items(batch, PausingDeferredQueue(), 10, 5)
+
+    def test_count_deferreds(self):
+        self.assertEqual(count_deferreds(lambda: [Deferred()] * 2), 1)
+        self.assertEqual(
+            count_deferreds(put_then_get, PausingDeferredQueue(), 3, 1), 6)
+        self.assertEqual(
+            count_deferreds(batch, PausingDeferredQueue(), 10, 10), 2)
+        # The original __init__ is restored afterwards.
+        self.assertEqual(count_deferreds(lambda: None), 0)
+        self.assertEqual(Deferred().callbacks, [])
+
+    def test_queue_cases_respect_limits(self):
+        for (name, queue_cls, scenario, _, size, backlog,
+             depth) in queue_cases(100):
+            limit = backlog if scenario == "get_then_put" else size
+            self.assertTrue(limit is None or depth <= limit)
+            if scenario == "batch":
+                self.assertEqual(name, "pausing")
+
+    def test_run_queue_benchmarks(self):
+        results = run_queue_benchmarks(items=10, repeat=1)
+        self.assertEqual(
+            sorted(set(r["queue"] for r in results)), ["pausing", "twisted"])
+        for result in results:
+            self.assertEqual(result["items"], 10)
+            self.assertTrue(result["deferreds_per_item"] > 0)
+
+
+class TestAsyncBenchmarks(TestCase):
+    def test_async_cases_fire(self):
+        clock = Clock()
+        fired = []
+        for name, make_call in async_cases(clock):
+            make_call().addCallback(lambda _, name=name: fired.append(name))
+        self.assertEqual(fired, ["succeed"])
+        clock.advance(0)
+        self.assertEqual(
+            sorted(fired), sorted(name for name, _ in async_cases(clock)))
+
+    @inlineCallbacks
+    def test_run_async_benchmarks(self):
+        from twisted.internet import reactor
+        results = yield run_async_benchmarks(
+            reactor, calls=10, batch=4, repeat=1)
+        self.assertEqual(
+            [(r["function"], r["calls"], r["deferreds_per_call"])
+             for r in results],
+            [("succeed", 8, 1), ("defer_async", 8, 1),
+             ("defer_async_batched", 8, 1), ("simulate_async", 8, 2),
+             ("simulate_async_batched", 8, 2),
+             ("simulate_async_deferred", 8, 2)])
+
+
+class TestParseArgs(TestCase):
+    def test_defaults(self):
+        args = parse_args([])
+        self.assertEqual(args.benchmarks, list(BENCHMARKS))
+        self.assertEqual(args.items, 100000)
+
+    def test_unknown_benchmark(self):
+        self.patch(sys, "stderr", StringIO())
+        self.assertRaises(SystemExit, parse_args, ["--benchmarks", "foo"])
@@ -0,0 +1,50 @@
+import sys
+from StringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+
+from go_api.benchmarks.routing import (
+    make_routes, parse_args, regex_match, run_benchmarks, target_paths)
+from go_api.cyclone.handlers import CollectionHandler, ElementHandler
+
+
+class TestRouting(TestCase):
+    def test_make_routes(self):
+        specs = make_routes(3)
+        self.assertEqual(len(specs), 7)
+        self.assertEqual(
+            [spec.handler_class for spec in specs[1:]],
+            [CollectionHandler] * 3 + [ElementHandler] * 3)
+
+    def test_targets(self):
+        specs = make_routes(4)
+        matched = dict(
+            (target, regex_match(specs, path))
+            for target, path in target_paths(4))
+        self.assertEqual(matched["first"][0], specs[5])
+        self.assertEqual(matched["middle"][0], specs[7])
+        self.assertEqual(matched["last"][0], specs[8])
+        self.assertEqual(matched["missing"], None)
+        self.assertEqual(
+            matched["last"][2],
+            {"owner_id": "owner-1", "elem_id": "obj-1"})
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks([1, 5], lookups=2, repeat=1)
+        self.assertEqual(len(results), 2 * 4 * 2)
+        self.assertEqual(
+            set((r["collections"], r["routes"]) for r in results),
+            set([(1, 3), (5, 11)]))
+        self.assertEqual(
+            set(r["router"] for r in results), set(["regex", "trie"]))
+
+    def test_parse_args(self):
+        args = parse_args([])
+        self.assertEqual(args.collections, [10, 100, 1000])
+        args = parse_args(["--collections", "5,50"])
+        self.assertEqual(args.collections, [5, 50])
+
+    def test_parse_args_invalid(self):
+        self.patch(sys, "stderr", StringIO())
+        self.assertRaises(SystemExit, parse_args, ["--collections", "x"])
+        self.assertRaises(SystemExit, parse_args, ["--collections", "0"])
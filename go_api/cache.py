@@ -0,0 +1,106 @@
+"""
+A bounded in-memory cache with LRU eviction and optional expiry.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A cache that holds at most ``max_size`` entries, evicting the least
+    recently used entry when it is full. Entries may also expire after a
+    number of seconds.
+
+    :param int max_size:
+        The maximum number of entries to hold.
+    :param float ttl:
+        The default number of seconds an entry lives for, or ``None`` if
+        entries don't expire.
+    :param clock:
+        An object with a ``seconds()`` method, such as the reactor or a
+        :class:`twisted.internet.task.Clock`. Defaults to the reactor.
+
+    The ``hits``, ``misses`` and ``evictions`` attributes count cache hits,
+    cache misses and entries evicted to make space for new ones.
+    """
+
+    def __init__(self, max_size, ttl=None, clock=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, _ = entry
+        if expires is not None and expires <= self.clock.seconds():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key``, or ``default`` if there is no entry
+        for ``key`` or it has expired.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        # Move the entry to the most recently used end.
+        del self._entries[key]
+        self._entries[key] = entry
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """
+        Store ``value`` for ``key``, evicting the least recently used entry
+        if the cache is full.
+
+        :param float ttl:
+            The number of seconds the entry lives for. Defaults to the
+            cache's ``ttl``.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else self.clock.seconds() + ttl
+        self._entries.pop(key, None)
+        while len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._entries[key] = (expires, value)
+
+    def pop(self, key, default=None):
+        """
+        Remove the entry for ``key`` and return its value, or ``default`` if
+        there is no entry for ``key``.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            return default
+        del self._entries[key]
+        return entry[1]
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries.clear()
@@ -5,9 +5,13 @@ Available implementations are imported from subpackages.
 """
 
 from .interfaces import ICollection
+from .caching import CachingCollection
 from .inmemory import InMemoryCollection
+from .appendlog import AppendLogCollection
 
 __all__ = [
     'ICollection',
+    'CachingCollection',
     'InMemoryCollection',
+    'AppendLogCollection',
 ]
@@ -0,0 +1,634 @@
+"""
+A durable ICollection implementation backed by an append-only log file.
+"""
+
+from __future__ import absolute_import
+
+import json
+import mmap
+import os
+from collections import MutableMapping
+
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+from twisted.python.failure import Failure
+
+from .frozen import freeze
+from .inmemory import InMemoryCollection
+
+
+class AppendLog(MutableMapping):
+    """
+    A mapping of string keys to JSON-serializable rows, stored in an
+    append-only log file.
+
+    Each write appends a record to the file. An index of keys to record
+    offsets is kept in memory and rows are decoded from a memory map of the
+    file when they're read. Reads return new objects each time, so they may
+    be modified freely. JSON strings are read back as unicode.
+
+    Records appended since the file was last mapped are also kept in a
+    buffer, and the file is only mapped again once ``remap_size`` bytes have
+    been appended, so that reading new records doesn't remap the file after
+    every write.
+
+    Records are lines of the form ``<header>\\t<row>`` for writes and
+    ``<header>`` for deletions, where the header is a short JSON list
+    holding the operation and key. Rebuilding the index when the file is
+    opened only decodes the headers. An incomplete record at the end of the
+    file (left by a crash during a write) is truncated. Invalid records
+    elsewhere are logged and skipped.
+
+    Writes are flushed to disk with ``fsync`` in groups: the first write
+    after a flush schedules the next flush ``sync_interval`` seconds later,
+    and :meth:`wait_for_sync` returns a deferred that fires once all writes
+    so far are on disk. ``fsync`` is called in the reactor's thread pool, so
+    reads and writes carry on while it runs.
+
+    Records that have been overwritten or deleted are removed by
+    :meth:`compact`, which copies the live records to a new file a batch at
+    a time, giving the reactor a chance to run between batches. Writes made
+    while the copy is in progress are copied over at the end. The new file
+    is flushed and renamed over the old one in the reactor's thread pool,
+    and flushes of later writes wait until it is in place. Compaction
+    starts automatically when more than ``compact_ratio`` of a file of at
+    least ``compact_min_size`` bytes is garbage.
+
+    :param str path:
+        The path of the log file. It is created if it doesn't exist.
+    :param float sync_interval:
+        The number of seconds to wait after a write before calling
+        ``fsync``, or ``None`` to leave flushing to the operating system.
+    :param float compact_ratio:
+        The fraction of the file that must be garbage before it is
+        compacted automatically, or ``None`` to disable automatic
+        compaction.
+    :param int compact_min_size:
+        The minimum file size, in bytes, for automatic compaction.
+    :param int compact_batch_size:
+        The number of records to copy before giving the reactor a chance
+        to run during compaction.
+    :param int remap_size:
+        The number of bytes to append before mapping the file again.
+    :param clock:
+        An object with ``callLater`` and ``seconds`` methods, such as the
+        reactor or a :class:`twisted.internet.task.Clock`. Defaults to the
+        reactor.
+    """
+
+    def __init__(self, path, sync_interval=0, compact_ratio=0.5,
+                 compact_min_size=1024 * 1024, compact_batch_size=1000,
+                 remap_size=1024 * 1024, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        self.compact_batch_size = compact_batch_size
+        self.remap_size = remap_size
+        self.clock = clock
+        self.compactions = 0
+        self._sync_call = None
+        self._sync_waiters = []
+        # The waiters for the flush that is running, if there is one.
+        self._syncing = None
+        self._sync_again = False
+        self._dirty = False
+        self._compacting = None
+        # Whether compaction is replacing the file, which holds back syncs.
+        self._swapping = False
+        self._fd = None
+        self._map = None
+        self._open()
+
+    # File handling
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND)
+        self._size = os.fstat(self._fd).st_size
+        self._remap()
+        self._load()
+
+    def _remap(self):
+        """
+        Map the whole file into memory, replacing any previous map and
+        emptying the buffer of appended records.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._size:
+            self._map = mmap.mmap(
+                self._fd, self._size, access=mmap.ACCESS_READ)
+        self._mapped_size = self._size
+        self._tail = bytearray()
+
+    def _read(self, start, end):
+        """
+        Return the bytes of the file between ``start`` and ``end``.
+        """
+        mapped = self._mapped_size
+        if end <= mapped:
+            return self._map[start:end] if self._map is not None else ""
+        tail = str(self._tail[max(start - mapped, 0):end - mapped])
+        if start >= mapped:
+            return tail
+        return self._map[start:mapped] + tail
+
+    def _load(self):
+        """
+        Build the index from the records in the file, truncating any
+        incomplete record at the end. Complete records whose headers can't
+        be parsed are skipped, and left for compaction to remove.
+        """
+        self._index = {}
+        pos = 0
+        while pos < self._size:
+            record = _parse_record(self._map, pos, self._size)
+            if record is not None:
+                self._apply(self._index, record)
+                pos = record[-1]
+                continue
+            newline = self._map.find("\n", pos, self._size)
+            if newline == -1:
+                break
+            log.msg("Skipping %d bytes of invalid records at offset %d in %s"
+                    % (newline + 1 - pos, pos, self.path))
+            pos = newline + 1
+        if pos < self._size:
+            log.msg("Truncating %d bytes of incomplete records from %s" % (
+                self._size - pos, self.path))
+            os.ftruncate(self._fd, pos)
+            self._size = pos
+            self._remap()
+        self._live_bytes = sum(
+            next_pos - start
+            for _, _, start, next_pos in self._index.itervalues())
+
+    def _apply(self, index, record):
+        """
+        Apply a parsed record to ``index``.
+        """
+        op, key, value_start, value_end, start, next_pos = record
+        if op == 's':
+            index[key] = (value_start, value_end, start, next_pos)
+        else:
+            index.pop(key, None)
+
+    def _append(self, data):
+        """
+        Append ``data`` to the file and return the offset it was written
+        at.
+        """
+        offset = self._size
+        _write_all(self._fd, data)
+        self._size += len(data)
+        self._tail += data
+        if len(self._tail) >= self.remap_size:
+            self._remap()
+        self._schedule_sync()
+        return offset
+
+    def _write_record(self, op, key, value=None):
+        header = _encode_header(op, key)
+        if value is None:
+            data = header + "\n"
+        else:
+            data = "%s\t%s\n" % (header, value)
+        start = self._append(data)
+        old = self._index.get(key)
+        if old is not None:
+            self._live_bytes -= old[3] - old[2]
+        if value is None:
+            record = (op, key, None, None, start, start + len(data))
+        else:
+            self._live_bytes += len(data)
+            record = (op, key, start + len(header) + 1,
+                      start + len(data) - 1, start, start + len(data))
+        self._apply(self._index, record)
+        self._maybe_compact()
+
+    # Mapping interface
+
+    def __getitem__(self, key):
+        value_start, value_end, _, _ = self._index[key]
+        return json.loads(self._read(value_start, value_end))
+
+    def __setitem__(self, key, row):
+        value = json.dumps(row, separators=(',', ':'))
+        self._write_record('s', key, value)
+
+    def __delitem__(self, key):
+        if key not in self._index:
+            raise KeyError(key)
+        self._write_record('d', key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size(self):
+        """
+        The size of the log file, in bytes.
+        """
+        return self._size
+
+    @property
+    def garbage_bytes(self):
+        """
+        The number of bytes in the log file taken up by records that have
+        been overwritten or deleted.
+        """
+        return self._size - self._live_bytes
+
+    # Syncing
+
+    def _schedule_sync(self):
+        self._dirty = True
+        if self.sync_interval is None or self._sync_call is not None:
+            return
+        self._sync_call = self.clock.callLater(self.sync_interval, self.sync)
+
+    def sync(self):
+        """
+        Start flushing all writes to disk now, and fire any deferreds
+        returned by :meth:`wait_for_sync` once they're on disk. If a flush
+        is already running, another one starts when it finishes.
+        """
+        if self._sync_call is not None and self._sync_call.active():
+            self._sync_call.cancel()
+        self._sync_call = None
+        if self._syncing is not None or self._swapping:
+            self._sync_again = True
+            return
+        waiters, self._sync_waiters = self._sync_waiters, []
+        if not self._dirty or self._fd is None:
+            for d in waiters:
+                d.callback(None)
+            return
+        self._dirty = False
+        self._syncing = waiters
+        # The file descriptor is duplicated so that the log can be closed or
+        # compacted while the flush is running.
+        fd = os.dup(self._fd)
+        deferToThread(_fsync_and_close, fd).addBoth(self._synced)
+
+    def _synced(self, result):
+        waiters, self._syncing = self._syncing, None
+        if isinstance(result, Failure):
+            for d in waiters:
+                d.errback(result)
+            if not waiters:
+                log.err(result, "Error syncing %s" % (self.path,))
+        else:
+            for d in waiters:
+                d.callback(None)
+        if self._sync_again:
+            self._sync_again = False
+            self.sync()
+
+    def wait_for_sync(self):
+        """
+        Return a deferred that fires once all writes so far have been
+        flushed to disk. If ``sync_interval`` is ``None``, the deferred
+        fires immediately.
+        """
+        if self.sync_interval is None:
+            return succeed(None)
+        d = Deferred()
+        if self._dirty:
+            self._sync_waiters.append(d)
+        elif self._syncing is not None:
+            self._syncing.append(d)
+        else:
+            d.callback(None)
+        return d
+
+    # Compaction
+
+    def _maybe_compact(self):
+        if self.compact_ratio is None or self._compacting is not None:
+            return
+        if self._size < self.compact_min_size:
+            return
+        if self.garbage_bytes > self.compact_ratio * self._size:
+            self.compact().addErrback(
+                log.err, "Error compacting %s" % (self.path,))
+
+    def compact(self):
+        """
+        Rewrite the log file without its garbage records. Returns a
+        deferred that fires once the new file is in place. If a compaction
+        is already running, the deferred fires when it finishes.
+        """
+        d = Deferred()
+        if self._compacting is not None:
+            self._compacting.append(d)
+        else:
+            self._compacting = [d]
+            self._compact().addBoth(self._compacted)
+        return d
+
+    def _compacted(self, result):
+        waiters, self._compacting = self._compacting, None
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    @inlineCallbacks
+    def _compact(self):
+        tmp_path = self.path + ".compact"
+        tmp_fd = os.open(
+            tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND)
+        new_index = {}
+        new_size = [0]
+
+        def index(data):
+            # Index raw records at their offsets in the new file.
+            pos = 0
+            while pos < len(data):
+                record = _parse_record(data, pos, len(data))
+                self._apply(new_index, _shift_record(record, new_size[0]))
+                pos = record[-1]
+            new_size[0] += len(data)
+
+        def copy(data):
+            _write_all(tmp_fd, data)
+            index(data)
+
+        try:
+            snapshot_end = self._size
+            keys = list(self._index)
+            for i in xrange(0, len(keys), self.compact_batch_size):
+                if i:
+                    yield deferLater(self.clock, 0, lambda: None)
+                    if self._fd is None:
+                        raise RuntimeError("Log closed during compaction")
+                entries = []
+                for key in keys[i:i + self.compact_batch_size]:
+                    entry = self._index.get(key)
+                    # Rows written since the compaction started are copied
+                    # with the rest of the new records below.
+                    if entry is not None and entry[2] < snapshot_end:
+                        entries.append(entry)
+                copy("".join(
+                    self._read(start, next_pos)
+                    for _, _, start, next_pos in entries))
+
+            # Copy everything written since the compaction started, in
+            # order, so that the new file ends up in the same state. The
+            # new file is flushed and renamed in a thread. Flushes of the
+            # old file are held back until the new file replaces it, since
+            # they wouldn't cover records that are copied after that.
+            copied_end = self._size
+            data = self._read(snapshot_end, copied_end)
+            index(data)
+            self._swapping = True
+            yield deferToThread(
+                _write_fsync_and_rename, tmp_fd, data, tmp_path, self.path)
+        except Exception:
+            os.close(tmp_fd)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            self._swapped()
+            raise
+
+        # Records written while the new file was being flushed are copied
+        # now, and flushed by the next sync.
+        copy(self._read(copied_end, self._size))
+        old_fd = self._fd
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._fd = tmp_fd
+        os.close(old_fd)
+        self._size = new_size[0]
+        self._index = new_index
+        self._live_bytes = sum(
+            next_pos - start
+            for _, _, start, next_pos in new_index.itervalues())
+        self._remap()
+        self.compactions += 1
+        self._swapped()
+
+    def _swapped(self):
+        """
+        Start any flush that was held back while compaction swapped in the
+        new file.
+        """
+        self._swapping = False
+        if self._sync_again and self._syncing is None:
+            self._sync_again = False
+            self.sync()
+
+    def close(self):
+        """
+        Wait for any compaction to finish, flush all writes to disk and
+        close the log file.
+        """
+        d = self.compact() if self._compacting is not None else succeed(None)
+
+        def close(_):
+            if self._fd is None:
+                return
+            synced = Deferred()
+            self._sync_waiters.append(synced)
+            self.sync()
+            return synced.addBoth(close_fd)
+
+        def close_fd(result):
+            if self._fd is not None:
+                if self._map is not None:
+                    self._map.close()
+                    self._map = None
+                os.close(self._fd)
+                self._fd = None
+            return result
+        return d.addCallback(close)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _write_fsync_and_rename(fd, data, tmp_path, path):
+    """
+    Append ``data`` to the file at ``tmp_path``, which ``fd`` is open on,
+    flush it to disk and rename it to ``path``.
+    """
+    _write_all(fd, data)
+    os.fsync(fd)
+    os.rename(tmp_path, path)
+    _fsync_dir(path)
+
+
+def _fsync_and_close(fd):
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    """
+    Flush the directory containing ``path`` to disk, so that renames in it
+    are durable. Not all platforms support this, so errors are ignored.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _encode_header(op, key):
+    # Byte string keys are stored as latin-1 so that they can be told apart
+    # from unicode keys when they're read back.
+    if isinstance(key, unicode):
+        header = [op, 'u', key]
+    elif isinstance(key, str):
+        header = [op, 'b', key.decode('latin-1')]
+    else:
+        raise TypeError("Keys must be strings, not %r" % (key,))
+    return json.dumps(header, separators=(',', ':'))
+
+
+def _shift_record(record, offset):
+    """
+    Return a parsed record with its offsets moved ``offset`` bytes later.
+    """
+    op, key, value_start, value_end, start, next_pos = record
+    if value_start is not None:
+        value_start += offset
+        value_end += offset
+    return (op, key, value_start, value_end, start + offset, next_pos + offset)
+
+
+def _parse_record(buf, pos, end):
+    """
+    Parse the record that starts at ``pos`` in ``buf``. Returns
+    ``(op, key, value_start, value_end, pos, next_pos)``, or ``None`` if
+    there is no complete, valid record there.
+    """
+    newline = buf.find("\n", pos, end)
+    if newline == -1:
+        return None
+    tab = buf.find("\t", pos, newline)
+    header_end = newline if tab == -1 else tab
+    try:
+        op, key_type, key = json.loads(buf[pos:header_end])
+        if key_type == 'b':
+            key = key.encode('latin-1')
+        elif key_type != 'u':
+            return None
+    except (TypeError, ValueError):
+        return None
+    if op == 's' and tab != -1:
+        return (op, key, tab + 1, newline, pos, newline + 1)
+    if op == 'd' and tab == -1:
+        return (op, key, None, None, pos, newline + 1)
+    return None
+
+
+class AppendLogCollection(InMemoryCollection):
+    """
+    A durable Collection implementation that stores its objects in an
+    :class:`AppendLog` file.
+
+    It behaves exactly like :class:`InMemoryCollection`, including queries,
+    paging and streaming, except that objects survive restarts and must be
+    JSON serializable. The key and secondary indexes are rebuilt from the
+    log when the collection is created.
+
+    Writes wait for their records to be flushed to disk before their
+    deferreds fire. Writes made within ``sync_interval`` seconds of each
+    other share a single ``fsync``.
+
+    :param str path:
+        The path of the log file.
+    :param float sync_interval:
+        Passed to :class:`AppendLog`.
+    :param float compact_ratio:
+        Passed to :class:`AppendLog`.
+    :param int compact_min_size:
+        Passed to :class:`AppendLog`.
+    :param clock:
+        Passed to :class:`AppendLog`.
+
+    Other keyword arguments are passed to :class:`InMemoryCollection`.
+    """
+
+    def __init__(self, path, sync_interval=0, compact_ratio=0.5,
+                 compact_min_size=1024 * 1024, clock=None, **kw):
+        self.log = AppendLog(
+            path, sync_interval=sync_interval, compact_ratio=compact_ratio,
+            compact_min_size=compact_min_size, clock=clock)
+        super(AppendLogCollection, self).__init__(self.log, **kw)
+
+    def _get_data(self, object_id):
+        # Rows are decoded from the log on every read, so there's no need to
+        # copy them.
+        data = self._data.get(self._id_to_key(object_id), None)
+        if data is not None and self.frozen_rows:
+            data = freeze(data)
+        return data
+
+    def _synced(self, d):
+        """
+        Delay the result of a write until it has been flushed to disk.
+        """
+        def wait_for_sync(result):
+            d = self.log.wait_for_sync()
+            d.addCallback(lambda _: result)
+            return d
+        return d.addCallback(wait_for_sync)
+
+    def create(self, object_id, data):
+        return self._synced(
+            super(AppendLogCollection, self).create(object_id, data))
+
+    def update(self, object_id, data):
+        return self._synced(
+            super(AppendLogCollection, self).update(object_id, data))
+
+    def delete(self, object_id):
+        return self._synced(
+            super(AppendLogCollection, self).delete(object_id))
+
+    def create_many(self, items):
+        return self._synced(
+            super(AppendLogCollection, self).create_many(items))
+
+    def update_many(self, items):
+        return self._synced(
+            super(AppendLogCollection, self).update_many(items))
+
+    def delete_many(self, object_ids):
+        return self._synced(
+            super(AppendLogCollection, self).delete_many(object_ids))
+
+    def close(self):
+        """
+        Flush all writes to disk and close the log file. Returns a
+        deferred.
+        """
+        return self.log.close()
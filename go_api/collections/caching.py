@@ -0,0 +1,325 @@
+"""
+A read-through caching wrapper for ICollection implementations.
+"""
+
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, maybeDeferred, returnValue, succeed)
+from zope.interface import implementer
+
+from .interfaces import ICollection
+from .frozen import freeze
+from .query import fields_kwargs, project
+from ..cache import LRUCache
+
+
+_MISSING = object()
+
+# Optional methods that are only implemented if they can be answered from the
+# cache, and so mustn't be looked up on the wrapped collection.
+_VERSION_METHODS = frozenset([
+    'get_version', 'get_with_version', 'get_collection_version',
+    'page_with_version'])
+
+# The page cache key for the collection version.
+_COLLECTION_VERSION = object()
+
+
+@implementer(ICollection)
+class CachingCollection(object):
+    """
+    An ICollection that wraps another ICollection and caches the results of
+    :meth:`get` and :meth:`page` in bounded LRU caches.
+
+    Cached objects and pages are frozen (see :mod:`go_api.collections.frozen`)
+    and shared between callers. Callers that want to modify a returned
+    object must make a mutable copy with :func:`thaw` first.
+
+    Writes made through this wrapper remove the written objects from the
+    object cache and clear the page cache, since any page may contain the
+    written objects. Writes made directly to the wrapped collection aren't
+    seen until the cached entries expire.
+
+    Concurrent cache misses for the same object or page share a single call
+    to the wrapped collection.
+
+    Requests for specific ``fields`` are answered from the cached objects
+    and pages, which always hold whole objects, so they don't need separate
+    cache entries.
+
+    If the wrapped collection implements ``get_version``, each object is
+    cached along with the version it was fetched with, and this wrapper
+    implements ``get_version`` and ``get_with_version`` from the cache.
+    Likewise, if pages are cached and the wrapped collection implements
+    ``get_collection_version``, so does this wrapper, along with
+    ``page_with_version``. Data is always returned with the version it was
+    fetched with, so an ETag built from the version always matches the
+    data. Objects that :meth:`get_many` fetches from a versioned collection
+    aren't cached, since their versions aren't known.
+
+    Other attributes that aren't defined here are looked up on the wrapped
+    collection.
+
+    :param collection:
+        The ICollection to wrap.
+    :param int max_size:
+        The maximum number of objects to cache. The page cache holds up to
+        the same number of pages.
+    :param float ttl:
+        The number of seconds to cache objects and pages for, or ``None``
+        to cache them until they are evicted or invalidated.
+    :param bool cache_pages:
+        If ``False``, only :meth:`get` results are cached.
+    :param clock:
+        The clock to use for expiring entries. Defaults to the reactor.
+    """
+
+    def __init__(self, collection, max_size=1000, ttl=None, cache_pages=True,
+                 clock=None):
+        self.collection = collection
+        self.cache_pages = cache_pages
+        self.object_cache = LRUCache(max_size, ttl=ttl, clock=clock)
+        self.page_cache = LRUCache(max_size, ttl=ttl, clock=clock)
+        # Incremented on every write, so that fetches that were started
+        # before a write don't store stale results.
+        self._generation = 0
+        self._in_flight = {}
+        self._versioned = getattr(collection, 'get_version', None) is not None
+        self._pages_versioned = cache_pages and getattr(
+            collection, 'get_collection_version', None) is not None
+        if self._versioned:
+            self.get_version = self._get_version
+            self.get_with_version = self._get_with_version
+        if self._pages_versioned:
+            self.get_collection_version = self._get_collection_version
+            self.page_with_version = self._page_with_version
+
+    def __getattr__(self, name):
+        if name == 'collection' or name in _VERSION_METHODS:
+            raise AttributeError(name)
+        return getattr(self.collection, name)
+
+    @property
+    def hits(self):
+        return self.object_cache.hits + self.page_cache.hits
+
+    @property
+    def misses(self):
+        return self.object_cache.misses + self.page_cache.misses
+
+    @property
+    def evictions(self):
+        return self.object_cache.evictions + self.page_cache.evictions
+
+    def _store(self, value, cache, key, generation, prepare):
+        value = prepare(value)
+        if generation == self._generation:
+            cache.set(key, value)
+        return value
+
+    def _fire_waiters(self, result, flight_key, waiters):
+        if self._in_flight.get(flight_key) is waiters:
+            del self._in_flight[flight_key]
+        for d in waiters:
+            d.callback(result)
+
+    def _cached(self, cache, key, prepare, fetch, *args, **kw):
+        """
+        Return a deferred that fires with the cached value for ``key``, or
+        with the result of ``fetch(*args, **kw)`` after passing it through
+        ``prepare`` and storing it in ``cache``.
+        """
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return succeed(value)
+        d = Deferred()
+        flight_key = (id(cache), key)
+        waiters = self._in_flight.get(flight_key)
+        if waiters is not None:
+            waiters.append(d)
+            return d
+        self._in_flight[flight_key] = waiters = [d]
+        fetch_d = maybeDeferred(fetch, *args, **kw)
+        fetch_d.addCallback(
+            self._store, cache, key, self._generation, prepare)
+        fetch_d.addBoth(self._fire_waiters, flight_key, waiters)
+        return d
+
+    def _freeze_entry(self, entry):
+        version, data = entry
+        return (version, freeze(data))
+
+    def _freeze_page_entry(self, entry):
+        version, (cursor, data) = entry
+        return (version, (cursor, freeze(data)))
+
+    def _select(self, obj, fields):
+        if fields is None:
+            return obj
+        return freeze(project(obj, fields))
+
+    def _select_page(self, result, fields):
+        if fields is None:
+            return result
+        cursor, data = result
+        return (cursor, [self._select(obj, fields) for obj in data])
+
+    @inlineCallbacks
+    def _fetch_with_version(self, get_version, get_data):
+        # The version is fetched first, so that it's never newer than the
+        # data.
+        version = yield maybeDeferred(get_version)
+        data = yield maybeDeferred(get_data)
+        returnValue((version, data))
+
+    def _fetch_object(self, object_id):
+        """
+        Fetch a ``(version, data)`` entry for an object from the wrapped
+        collection. The version is ``None`` if the collection isn't
+        versioned.
+        """
+        if not self._versioned:
+            d = maybeDeferred(self.collection.get, object_id)
+            return d.addCallback(lambda data: (None, data))
+        get_with_version = getattr(self.collection, 'get_with_version', None)
+        if get_with_version is not None:
+            return maybeDeferred(get_with_version, object_id)
+        return self._fetch_with_version(
+            lambda: self.collection.get_version(object_id),
+            lambda: self.collection.get(object_id))
+
+    def _fetch_page(self, cursor, max_results, query):
+        """
+        Fetch a ``(version, page)`` entry from the wrapped collection. The
+        version is ``None`` if the collection isn't versioned.
+        """
+        if not self._pages_versioned:
+            d = maybeDeferred(self.collection.page, cursor, max_results, query)
+            return d.addCallback(lambda page: (None, page))
+        page_with_version = getattr(
+            self.collection, 'page_with_version', None)
+        if page_with_version is not None:
+            return maybeDeferred(
+                page_with_version, cursor, max_results, query)
+        return self._fetch_with_version(
+            self.collection.get_collection_version,
+            lambda: self.collection.page(cursor, max_results, query))
+
+    def _get_entry(self, object_id):
+        return self._cached(
+            self.object_cache, object_id, self._freeze_entry,
+            self._fetch_object, object_id)
+
+    def _get_page_entry(self, cursor, max_results, query):
+        return self._cached(
+            self.page_cache, (cursor, max_results, query),
+            self._freeze_page_entry, self._fetch_page, cursor, max_results,
+            query)
+
+    def invalidate(self, object_ids=()):
+        """
+        Remove the given objects and all pages from the cache.
+        """
+        self._generation += 1
+        for object_id in object_ids:
+            self.object_cache.pop(object_id)
+        self.page_cache.clear()
+        # Reads that start after a write mustn't share fetches that were
+        # started before it.
+        self._in_flight.clear()
+
+    def _write(self, object_ids, f, *args):
+        def invalidate(result):
+            self.invalidate(object_ids)
+            return result
+        # Writes that fail may still have changed something, so we
+        # invalidate either way.
+        return maybeDeferred(f, *args).addBoth(invalidate)
+
+    def all_keys(self):
+        return self.collection.all_keys()
+
+    def stream(self, query, fields=None):
+        # Wrapped collections that don't accept fields return whole objects,
+        # which callers project.
+        return self.collection.stream(
+            query, **fields_kwargs(self.collection.stream, fields))
+
+    def page(self, cursor, max_results, query, fields=None):
+        if not self.cache_pages:
+            return self.collection.page(
+                cursor, max_results, query,
+                **fields_kwargs(self.collection.page, fields))
+        d = self._get_page_entry(cursor, max_results, query)
+        return d.addCallback(
+            lambda entry: self._select_page(entry[1], fields))
+
+    def _page_with_version(self, cursor, max_results, query, fields=None):
+        d = self._get_page_entry(cursor, max_results, query)
+        return d.addCallback(
+            lambda entry: (entry[0], self._select_page(entry[1], fields)))
+
+    def _get_collection_version(self):
+        return self._cached(
+            self.page_cache, _COLLECTION_VERSION, lambda version: version,
+            self.collection.get_collection_version)
+
+    def get(self, object_id, fields=None):
+        d = self._get_entry(object_id)
+        return d.addCallback(lambda entry: self._select(entry[1], fields))
+
+    def _get_with_version(self, object_id, fields=None):
+        d = self._get_entry(object_id)
+        return d.addCallback(
+            lambda entry: (entry[0], self._select(entry[1], fields)))
+
+    def _get_version(self, object_id):
+        return self._get_entry(object_id).addCallback(lambda entry: entry[0])
+
+    def create(self, object_id, data):
+        object_ids = [] if object_id is None else [object_id]
+        return self._write(object_ids, self.collection.create, object_id, data)
+
+    def update(self, object_id, data):
+        return self._write(
+            [object_id], self.collection.update, object_id, data)
+
+    def delete(self, object_id):
+        return self._write([object_id], self.collection.delete, object_id)
+
+    @inlineCallbacks
+    def get_many(self, object_ids):
+        results = {}
+        missing = []
+        for i, object_id in enumerate(object_ids):
+            entry = self.object_cache.get(object_id, _MISSING)
+            if entry is _MISSING:
+                missing.append(i)
+            else:
+                results[i] = (True, entry[1])
+        if missing:
+            generation = self._generation
+            fetched = yield maybeDeferred(
+                self.collection.get_many, [object_ids[i] for i in missing])
+            for i, (success, value) in zip(missing, fetched):
+                if success and self._versioned:
+                    # We don't know the version, so we can't cache it.
+                    value = freeze(value)
+                elif success:
+                    _, value = self._store(
+                        (None, value), self.object_cache, object_ids[i],
+                        generation, self._freeze_entry)
+                results[i] = (success, value)
+        returnValue([results[i] for i in range(len(object_ids))])
+
+    def create_many(self, items):
+        object_ids = [
+            object_id for object_id, _ in items if object_id is not None]
+        return self._write(object_ids, self.collection.create_many, items)
+
+    def update_many(self, items):
+        object_ids = [object_id for object_id, _ in items]
+        return self._write(object_ids, self.collection.update_many, items)
+
+    def delete_many(self, object_ids):
+        return self._write(
+            list(object_ids), self.collection.delete_many, object_ids)
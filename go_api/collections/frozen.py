@@ -0,0 +1,82 @@
+"""
+Immutable dict and list types for sharing collection data without copying.
+"""
+
+
+def _immutable(self, *args, **kw):
+    raise TypeError(
+        "%r object is immutable, use thaw() to get a mutable copy" % (
+            type(self).__name__,))
+
+
+class FrozenDict(dict):
+    """
+    A :class:`dict` that can't be modified after it is created.
+
+    Since it is a real :class:`dict` subclass, it can be serialized with
+    :mod:`json` and compared to ordinary dicts. Copying a
+    :class:`FrozenDict` returns the same object. Use :func:`thaw` to get a
+    mutable copy.
+    """
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """
+    A :class:`list` that can't be modified after it is created.
+
+    Since it is a real :class:`list` subclass, it can be serialized with
+    :mod:`json` and compared to ordinary lists. Copying a
+    :class:`FrozenList` returns the same object. Use :func:`thaw` to get a
+    mutable copy.
+    """
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def freeze(value):
+    """
+    Return an immutable version of a JSON-like value. Dicts and lists are
+    copied into :class:`FrozenDict` and :class:`FrozenList` instances.
+    Values that are already frozen are shared rather than copied.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Return a mutable deep copy of a value returned by :func:`freeze`.
+    """
+    if isinstance(value, dict):
+        return dict((k, thaw(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
@@ -2,14 +2,20 @@
 An in-memory ICollection implementation.
 """
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 from uuid import uuid4
 
-from go_api.queue import PausingDeferredQueue, PausingQueueCloseMarker
-from twisted.internet.defer import inlineCallbacks
+from go_api.queue import (
+    PausingDeferredQueue, PausingQueueCancelled, PausingQueueCloseMarker)
+from twisted.internet.defer import inlineCallbacks, maybeDeferred
+from twisted.python.failure import Failure
 from zope.interface import implementer
 
 from .interfaces import ICollection
+from .frozen import FrozenDict, freeze
+from .query import INDEX_TYPES, fields_kwargs, parse_query, project
 from .errors import (
     CollectionObjectNotFound, CollectionObjectAlreadyExists,
     CollectionUsageError)
@@ -20,12 +26,69 @@ from ..utils import simulate_async
 class InMemoryCollection(object):
     """
     A Collection implementation backed by an in-memory dict.
+
+    A sorted index of object ids is built the first time it is needed and
+    is then kept up to date by :meth:`_set_data` and :meth:`_del_data`, so
+    paging and streaming don't need to sort the whole collection on every
+    request. Declared secondary indexes are maintained in the same way. The
+    indexes assume that this collection is the only writer of its keys in
+    the backing dict; call :meth:`_rebuild_key_index` if the dict is
+    modified by other means.
+
+    Each object has a version that changes whenever the object is written,
+    and the collection has a version that changes whenever any object is
+    written. Versions include a token that is unique to this collection
+    instance, so versions from different instances never match. Calling
+    :meth:`_rebuild_key_index` also starts a new set of versions.
+
+    :meth:`stream` and :meth:`page` accept queries in the language described
+    in :mod:`go_api.collections.query`. Conditions on indexed fields are
+    answered from the indexes, and only the rows they select are checked
+    against the remaining conditions.
+
+    :meth:`get`, :meth:`stream` and :meth:`page` only copy the requested
+    fields of each row when ``fields`` is given.
+
+    :param dict data:
+        The backing dict. Defaults to a new empty dict.
+    :param bool keyset_cursors:
+        If ``True``, :meth:`page` returns keyset cursors that encode the
+        last object id on the page instead of integer offsets. Keyset
+        cursors seek directly to the next page and aren't affected by
+        objects being created or deleted between requests.
+    :param bool frozen_rows:
+        If ``True``, rows are stored as :class:`FrozenDict` instances and
+        returned without copying. Callers that want to modify a returned
+        row must make a mutable copy with :func:`thaw` first. If ``False``,
+        rows are deep-copied on every read and write.
+    :param dict indexes:
+        A mapping of field names to index types. The index type may be
+        ``'hash'``, which supports ``=`` conditions, or ``'sorted'``,
+        which supports ``=``, range and prefix conditions.
+    :param bool allow_full_scans:
+        If ``False``, queries that can't use any index raise
+        :class:`CollectionUsageError` instead of scanning every row.
     """
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, keyset_cursors=False, frozen_rows=False,
+                 indexes=None, allow_full_scans=True):
         if data is None:
             data = {}
+        if indexes is None:
+            indexes = {}
+        for field, index_type in indexes.items():
+            if index_type not in INDEX_TYPES:
+                raise ValueError(
+                    "Unknown index type %r for field %r" % (index_type, field))
         self._data = data
+        self._sorted_keys = None
+        self._indexes = None
+        self.index_types = indexes
+        self.keyset_cursors = keyset_cursors
+        self.frozen_rows = frozen_rows
+        self.allow_full_scans = allow_full_scans
+        self._generation = 0
+        self._reset_versions()
 
     def _id_to_key(self, object_id):
         """
@@ -49,13 +112,180 @@ class InMemoryCollection(object):
         """
         return True
 
+    def _rebuild_key_index(self):
+        """
+        Discard the sorted key index and any secondary indexes. They will be
+        rebuilt from the datastore the next time they are needed.
+        """
+        self._sorted_keys = None
+        self._indexes = None
+        self._reset_versions()
+
+    def _reset_versions(self):
+        """
+        Forget all object versions and start a new set of versions that
+        can't match any previous ones.
+        """
+        self._version_token = uuid4().hex
+        self._versions = {}
+
+    def _bump_version(self, object_id):
+        """
+        Record a write to ``object_id``.
+        """
+        self._generation += 1
+        self._versions[object_id] = self._generation
+
+    def _drop_version(self, object_id):
+        """
+        Record the deletion of ``object_id``. Its version is forgotten, and
+        if it is created again it gets a version from a later generation.
+        """
+        self._generation += 1
+        self._versions.pop(object_id, None)
+
+    def _get_key_index(self):
+        """
+        Return the sorted list of object ids in this collection, building it
+        from the datastore if necessary. The returned list is owned by the
+        collection and must not be modified by the caller.
+        """
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self._get_keys())
+        return self._sorted_keys
+
+    def _get_indexes(self):
+        """
+        Return a dict of field names to secondary indexes, building the
+        indexes from the datastore if necessary.
+        """
+        if self._indexes is None:
+            indexes = {}
+            for field, index_type in self.index_types.items():
+                indexes[field] = INDEX_TYPES[index_type](field)
+            for object_id in self._get_key_index():
+                row = self._get_raw_data(object_id)
+                for index in indexes.itervalues():
+                    index.add(object_id, row)
+            self._indexes = indexes
+        return self._indexes
+
+    def _index_add(self, object_id, row):
+        keys = self._sorted_keys
+        if keys is not None:
+            i = bisect_left(keys, object_id)
+            if i == len(keys) or keys[i] != object_id:
+                keys.insert(i, object_id)
+        if self._indexes is not None:
+            for index in self._indexes.itervalues():
+                index.add(object_id, row)
+
+    def _index_remove(self, object_id, row):
+        keys = self._sorted_keys
+        if keys is not None:
+            i = bisect_left(keys, object_id)
+            if i < len(keys) and keys[i] == object_id:
+                del keys[i]
+        if self._indexes is not None and row is not None:
+            for index in self._indexes.itervalues():
+                index.remove(object_id, row)
+
+    def _encode_cursor(self, object_id):
+        """
+        Encode an object id as an opaque keyset cursor. The cursor records
+        whether the object id was a byte or unicode string so that it
+        decodes to a value that sorts the same way in the key index.
+        """
+        if isinstance(object_id, unicode):
+            raw = 'u' + object_id.encode('utf-8')
+        else:
+            raw = 'b' + object_id
+        return urlsafe_b64encode(raw).rstrip('=')
+
+    def _decode_cursor(self, cursor):
+        """
+        Decode a keyset cursor created by :meth:`_encode_cursor`.
+        """
+        try:
+            cursor = cursor.encode('ascii')
+            raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            if raw[:1] == 'u':
+                return raw[1:].decode('utf-8')
+            if raw[:1] == 'b':
+                return raw[1:]
+        except (AttributeError, UnicodeError, TypeError, ValueError):
+            pass
+        raise CollectionUsageError('Invalid cursor: %r' % (cursor,))
+
     def _set_data(self, object_id, data):
-        row_data = deepcopy(data)
-        row_data['id'] = object_id
-        self._data[self._id_to_key(object_id)] = row_data
+        if self.frozen_rows:
+            row_data = dict(data)
+            row_data['id'] = object_id
+            row_data = freeze(row_data)
+        else:
+            row_data = deepcopy(data)
+            row_data['id'] = object_id
+        key = self._id_to_key(object_id)
+        old_row = None
+        if self._indexes is not None:
+            # Only fetch the old row if there are indexes to remove it from,
+            # since reading it may be expensive for some backing dicts.
+            old_row = self._data.get(key, None)
+        # The backing dict may refuse the row, so the indexes are only
+        # changed once it has been stored.
+        self._data[key] = row_data
+        if old_row is not None:
+            for index in self._indexes.itervalues():
+                index.remove(object_id, old_row)
+        self._index_add(object_id, row_data)
+        self._bump_version(object_id)
+
+    def _del_data(self, object_id):
+        key = self._id_to_key(object_id)
+        if self._indexes is not None:
+            row = self._data.pop(key, None)
+        else:
+            row = None
+            if key in self._data:
+                del self._data[key]
+        self._index_remove(object_id, row)
+        self._drop_version(object_id)
+
+    def _get_raw_data(self, object_id):
+        """
+        Return the stored row for ``object_id`` without copying it. The row
+        must not be modified or handed out to callers.
+        """
+        return self._data.get(self._id_to_key(object_id), None)
 
     def _get_data(self, object_id):
-        data = self._data.get(self._id_to_key(object_id), None)
+        key = self._id_to_key(object_id)
+        data = self._data.get(key, None)
+        if not self.frozen_rows:
+            return deepcopy(data)
+        if data is not None and not isinstance(data, FrozenDict):
+            # Rows that were put into the datastore directly are frozen the
+            # first time they're read.
+            data = self._data[key] = freeze(data)
+        return data
+
+    def _get_fields(self, object_id, fields, conditions=None):
+        """
+        Return the data for ``object_id`` with only the given fields, or
+        ``None`` if the object doesn't exist or doesn't match
+        ``conditions``. Only the selected fields are copied.
+        """
+        if fields is None:
+            data = self._get_data(object_id)
+        else:
+            data = self._get_raw_data(object_id)
+        if data is None or not self._matches(data, conditions):
+            return None
+        if fields is None:
+            return data
+        data = project(data, fields)
+        if self.frozen_rows:
+            return freeze(data)
         return deepcopy(data)
 
     def _get_keys(self):
@@ -63,54 +293,146 @@ class InMemoryCollection(object):
             self._key_to_id(key) for key in self._data
             if self._is_my_key(key)]
 
+    def _parse_query(self, query):
+        """
+        Parse a query string, returning ``None`` if there is no query.
+        """
+        if query is None:
+            return None
+        return parse_query(query)
+
+    def _matches(self, row, conditions):
+        if conditions is None:
+            return True
+        return all(condition.matches(row) for condition in conditions)
+
+    def _find_keys(self, conditions):
+        """
+        Return a sorted list of the object ids that match ``conditions``.
+        The list must not be modified by the caller.
+
+        Each condition that an index supports narrows down the candidate
+        object ids, and the rows of the remaining candidates are checked
+        against the other conditions. If no index can be used, every row is
+        checked, or :class:`CollectionUsageError` is raised if full scans
+        aren't allowed.
+        """
+        if conditions is None:
+            return self._get_key_index()
+
+        indexes = self._get_indexes()
+        candidates = None
+        unindexed = []
+        for condition in conditions:
+            index = indexes.get(condition.field)
+            if index is None or condition.op not in index.ops:
+                unindexed.append(condition)
+                continue
+            ids = index.lookup(condition)
+            candidates = ids if candidates is None else candidates & ids
+
+        if candidates is not None:
+            candidates = sorted(candidates)
+        elif self.allow_full_scans:
+            candidates = self._get_key_index()
+        else:
+            raise CollectionUsageError(
+                'Query requires a full scan, please query an indexed field')
+
+        if not unindexed:
+            return candidates
+        return [
+            object_id for object_id in candidates
+            if self._matches(self._get_raw_data(object_id), unindexed)]
+
     @simulate_async
     def all_keys(self):
         return self._get_keys()
 
     @simulate_async
-    def stream(self, query):
-        if query is not None:
-            raise CollectionUsageError(
-                'query parameter not supported by InMemoryCollection')
+    def stream(self, query, fields=None):
+        conditions = self._parse_query(query)
+        matching_keys = self._find_keys(conditions)
 
         q = PausingDeferredQueue(backlog=1, size=3)
 
         @inlineCallbacks
         def fill_queue():
-            for object_id in sorted(self._get_keys()):
-                yield q.put(self._get_data(object_id))
-            yield q.put(PausingQueueCloseMarker())
+            # The index may change while we're waiting for the consumer, so
+            # we find our place again after each put rather than iterating
+            # over the index directly. Query results are fixed when the
+            # stream starts, but rows are checked again before they're sent
+            # in case they have changed since.
+            keys = matching_keys
+            i = 0
+            try:
+                while i < len(keys):
+                    object_id = keys[i]
+                    data = self._get_fields(object_id, fields, conditions)
+                    if data is not None:
+                        yield q.put(data)
+                    if conditions is None:
+                        keys = self._get_key_index()
+                    i = bisect_right(keys, object_id)
+                yield q.put(PausingQueueCloseMarker())
+            except PausingQueueCancelled:
+                # The consumer has stopped reading, so stop filling.
+                return
 
         q.fill_d = fill_queue()
         return q
 
     @simulate_async
-    def page(self, cursor, max_results, query):
-        if query is not None:
-            raise CollectionUsageError(
-                'query parameter not supported by InMemoryCollection')
+    def page(self, cursor, max_results, query, fields=None):
+        return self._page(cursor, max_results, query, fields)
+
+    def _page(self, cursor, max_results, query, fields):
         # Default value of 5 for max_results
         max_results = max_results or 5
-        # Default value of 0 for cursor
-        cursor = int(cursor) if cursor else 0
-        keys = sorted(self._get_keys())
-        next_cursor = cursor + max_results
-        groups = map(self._get_data, keys[cursor:next_cursor])
-        next_cursor = next_cursor if next_cursor < len(keys) else None
+        keys = self._find_keys(self._parse_query(query))
+        if self.keyset_cursors:
+            start = 0
+            if cursor:
+                start = bisect_right(keys, self._decode_cursor(cursor))
+        else:
+            # Default value of 0 for cursor
+            start = int(cursor) if cursor else 0
+        end = start + max_results
+        page_keys = keys[start:end]
+        groups = [
+            self._get_fields(object_id, fields) for object_id in page_keys]
+        if end >= len(keys):
+            next_cursor = None
+        elif self.keyset_cursors:
+            next_cursor = self._encode_cursor(page_keys[-1])
+        else:
+            next_cursor = end
         return (
             next_cursor,
             groups,
         )
 
-    @simulate_async
-    def get(self, object_id):
-        data = self._get_data(object_id)
+    def _get(self, object_id, fields=None):
+        data = self._get_fields(object_id, fields)
         if data is None:
             raise CollectionObjectNotFound(object_id)
         return data
 
-    @simulate_async
-    def create(self, object_id, data):
+    def _get_version(self, object_id):
+        if self._get_raw_data(object_id) is None:
+            raise CollectionObjectNotFound(object_id)
+        return self._current_version(object_id)
+
+    def _current_version(self, object_id):
+        # Objects that haven't been written since the versions were reset
+        # are all at version 0.
+        return "%s-%d" % (
+            self._version_token, self._versions.get(object_id, 0))
+
+    def _get_collection_version(self):
+        return "%s-%d" % (self._version_token, self._generation)
+
+    def _create(self, object_id, data):
         if object_id is None:
             object_id = uuid4().hex
         if self._get_data(object_id) is not None:
@@ -118,17 +440,88 @@ class InMemoryCollection(object):
         self._set_data(object_id, data)
         return (object_id, self._get_data(object_id))
 
-    @simulate_async
-    def update(self, object_id, data):
+    def _update(self, object_id, data):
         if not self._id_to_key(object_id) in self._data:
             raise CollectionObjectNotFound(object_id)
         self._set_data(object_id, data)
         return self._get_data(object_id)
 
-    @simulate_async
-    def delete(self, object_id):
+    def _delete(self, object_id):
         data = self._get_data(object_id)
         if data is None:
             raise CollectionObjectNotFound(object_id)
-        self._data.pop(self._id_to_key(object_id), None)
+        self._del_data(object_id)
         return data
+
+    def _many(self, f, args_list):
+        """
+        Call ``f`` with each tuple of arguments in ``args_list`` and return
+        a list of ``(success, result)`` tuples in the same format as
+        :class:`DeferredList`.
+        """
+        results = []
+        for args in args_list:
+            try:
+                results.append((True, f(*args)))
+            except Exception:
+                results.append((False, Failure()))
+        return results
+
+    @simulate_async
+    def get(self, object_id, fields=None):
+        return self._get(object_id, fields)
+
+    @simulate_async
+    def get_version(self, object_id):
+        return self._get_version(object_id)
+
+    @simulate_async
+    def get_collection_version(self):
+        return self._get_collection_version()
+
+    def get_with_version(self, object_id, fields=None):
+        # Built on get() rather than _get() so that subclasses that override
+        # get() are still used. The version is read first, so it is never
+        # newer than the data.
+        version = self._current_version(object_id)
+        d = maybeDeferred(
+            self.get, object_id, **fields_kwargs(self.get, fields))
+        return d.addCallback(lambda data: (version, data))
+
+    def page_with_version(self, cursor, max_results, query, fields=None):
+        # Built on page() for the same reason as get_with_version().
+        version = self._get_collection_version()
+        d = maybeDeferred(
+            self.page, cursor, max_results, query,
+            **fields_kwargs(self.page, fields))
+        return d.addCallback(lambda page: (version, page))
+
+    @simulate_async
+    def create(self, object_id, data):
+        return self._create(object_id, data)
+
+    @simulate_async
+    def update(self, object_id, data):
+        return self._update(object_id, data)
+
+    @simulate_async
+    def delete(self, object_id):
+        return self._delete(object_id)
+
+    @simulate_async
+    def get_many(self, object_ids):
+        return self._many(
+            self._get, [(object_id,) for object_id in object_ids])
+
+    @simulate_async
+    def create_many(self, items):
+        return self._many(self._create, items)
+
+    @simulate_async
+    def update_many(self, items):
+        return self._many(self._update, items)
+
+    @simulate_async
+    def delete_many(self, object_ids):
+        return self._many(
+            self._delete, [(object_id,) for object_id in object_ids])
@@ -12,49 +12,136 @@ class ICollection(Interface):
         deferred instead of the iterable.
         """
 
-    def stream(query):
+    def stream(query, fields=None):
         """
         Return a :class:`PausingDeferredQueue` of the objects in the
         collection. May return a deferred instead of the
         :class:`PausingDeferredQueue`. A queue item that is an instance of
         :class:`PausingQueueCloseMarker` indicates the end of the queue.
 
+        A consumer that stops reading early (e.g. because its client has
+        disconnected) cancels the queue with
+        :meth:`PausingDeferredQueue.cancel`. Implementations must then stop
+        filling it and release any resources held for the stream, such as
+        backend cursors. They find out when a ``put`` fails or raises
+        :class:`PausingQueueCancelled`, or from the queue's ``cancelled``
+        attribute.
+
         :param unicode query:
             Search term requested through the API. Defaults to ``None`` if no
             search term was requested.
+        :param tuple fields:
+            The fields requested through the API, as for :meth:`get`.
         """
 
-    def page(cursor, max_results, query):
+    def page(cursor, max_results, query, fields=None):
         """
         Generages a page which contains a subset of the objects in the
         collection.
 
         :param unicode cursor:
             Used to determine the start point of the page. Defaults to ``None``
-            if no cursor was supplied.
+            if no cursor was supplied. This is always a cursor previously
+            returned by :meth:`page`, passed back unchanged.
         :param int max_results:
             Used to limit the number of results presented in a page. Defaults
             to ``None`` if no limit was specified.
         :param unicode query:
             Search term requested through the API. Defaults to ``None`` if no
             search term was requested.
+        :param tuple fields:
+            The fields requested through the API, as for :meth:`get`.
 
         :return:
             (cursor, data). ``cursor`` is an opaque string that refers to the
             next page, and is ``None`` if this is the last page. ``data`` is a
             list of all the objects within the page.
         :rtype: tuple
+
+        Callers must treat cursors as opaque. Implementations are encouraged
+        to use keyset cursors, which encode the position of the last object
+        returned rather than an offset. A keyset cursor lets the next page
+        seek directly to its start point, and objects created or deleted
+        between requests don't cause other objects to be skipped or
+        repeated. Should raise :class:`CollectionUsageError` if ``cursor``
+        is not a valid cursor.
         """
 
-    def get(object_id):
+    def get(object_id, fields=None):
         """
         Return a single object from the collection. May return a deferred
         instead of the object.
 
+        :param tuple fields:
+            The names of the fields the caller needs, with ``.`` separating
+            the names of nested fields (see
+            :func:`go_api.collections.query.parse_fields`), or ``None`` if
+            the caller needs the whole object. Implementations may use this
+            to avoid loading unneeded data, and may return extra fields.
+            Handlers remove any extra fields with
+            :func:`go_api.collections.query.project` before serializing the
+            object, and only pass ``fields`` if the client asked for
+            specific fields and the method accepts a ``fields`` argument
+            (see :func:`go_api.collections.query.fields_kwargs`).
+
         Should raise :class:`CollectionObjectNotFound`` if ``object_id`` refers
         to an object that doesn't exist.
         """
 
+    def get_version(object_id):
+        """
+        Return the version of a single object as a string. May return a
+        deferred instead of the version.
+
+        The version must change whenever the object changes, and must never
+        be reused for different object data (including after the object is
+        deleted and recreated). It is used to build HTTP ETags, so it should
+        be cheap to look up without fetching the object.
+
+        Should raise :class:`CollectionObjectNotFound`` if ``object_id`` refers
+        to an object that doesn't exist.
+
+        This method is optional. Handlers only use it if it is implemented.
+        """
+
+    def get_collection_version():
+        """
+        Return the version of the collection as a whole as a string. May
+        return a deferred instead of the version.
+
+        The version must change whenever any object in the collection is
+        created, updated or deleted, and must never be reused for different
+        collection contents. It is used to build HTTP ETags for pages.
+
+        This method is optional. Handlers only use it if it is implemented.
+        """
+
+    def get_with_version(object_id, fields=None):
+        """
+        Return a ``(version, data)`` tuple for a single object, where
+        ``version`` is as for :meth:`get_version` and ``data`` is as for
+        :meth:`get`. May return a deferred instead of the tuple.
+
+        The version must not be newer than the data. Handlers use this to
+        fetch an object and its ETag in one call.
+
+        This method is optional, and only used if :meth:`get_version` is
+        also implemented.
+        """
+
+    def page_with_version(cursor, max_results, query, fields=None):
+        """
+        Return a ``(version, page)`` tuple, where ``version`` is as for
+        :meth:`get_collection_version` and ``page`` is as for :meth:`page`.
+        May return a deferred instead of the tuple.
+
+        The version must not be newer than the page. Handlers use this to
+        fetch a page and its ETag in one call.
+
+        This method is optional, and only used if
+        :meth:`get_collection_version` is also implemented.
+        """
+
     def create(object_id, data):
         """
         Create an object within the collection and return the new ``object_id``
@@ -89,3 +176,66 @@ class ICollection(Interface):
         Should raise :class:`CollectionObjectNotFound`` if ``object_id`` refers
         to an object that doesn't exist.
         """
+
+    def get_many(object_ids):
+        """
+        Return multiple objects from the collection. May return a deferred
+        instead of the results.
+
+        :param list object_ids:
+            The identifiers of the objects to return.
+
+        :return:
+            A list with one ``(success, result)`` tuple for each object id,
+            in the same order as ``object_ids``. If ``success`` is ``True``,
+            ``result`` is the object data, as returned by :meth:`get`.
+            Otherwise ``result`` is a :class:`Failure` wrapping the error
+            that :meth:`get` would have raised for that object, e.g.
+            :class:`CollectionObjectNotFound`. This is the same format that
+            :class:`DeferredList` uses, so implementations without native
+            batch support may simply call :meth:`get` for each object id
+            and gather the results with ``DeferredList(...,
+            consumeErrors=True)``.
+        """
+
+    def create_many(items):
+        """
+        Create multiple objects within the collection. May return a deferred
+        instead of the results.
+
+        :param list items:
+            A list of ``(object_id, data)`` tuples, with the same meanings
+            as the parameters to :meth:`create`.
+
+        :return:
+            A list of ``(success, result)`` tuples, as for :meth:`get_many`.
+            Successful results are ``(object_id, data)`` tuples, as returned
+            by :meth:`create`.
+        """
+
+    def update_many(items):
+        """
+        Update multiple objects. May return a deferred instead of the
+        results.
+
+        :param list items:
+            A list of ``(object_id, data)`` tuples, with the same meanings
+            as the parameters to :meth:`update`.
+
+        :return:
+            A list of ``(success, result)`` tuples, as for :meth:`get_many`.
+            Successful results are the updated object data.
+        """
+
+    def delete_many(object_ids):
+        """
+        Delete multiple objects. May return a deferred instead of the
+        results.
+
+        :param list object_ids:
+            The identifiers of the objects to delete.
+
+        :return:
+            A list of ``(success, result)`` tuples, as for :meth:`get_many`.
+            Successful results are the deleted object data.
+        """
@@ -0,0 +1,389 @@
+"""
+A simple query language and secondary indexes for in-memory collections.
+
+A query is one or more conditions joined by ``and``::
+
+    name="Jane" and age>=18 and address.city^="Cape"
+
+Each condition compares a field (with ``.`` separating the names of nested
+fields) to a value. The supported operators are ``=``, ``<``, ``<=``,
+``>``, ``>=`` and ``^=`` (string prefix). Values may be JSON strings,
+numbers, ``true``, ``false`` or ``null``. Unquoted values that aren't valid
+JSON are treated as strings.
+
+Comparisons only match values of the same kind, so ``age>=18`` doesn't
+match rows where ``age`` is a string, and ``flag=1`` doesn't match rows
+where ``flag`` is ``true``.
+
+Field lists, such as ``name,address.city``, select the fields to return
+from each row. :func:`parse_fields` parses them and :func:`project` applies
+them to a row. :func:`fields_kwargs` passes them on to collection methods
+that accept them.
+"""
+
+import inspect
+import json
+import re
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from numbers import Number
+
+from .errors import CollectionUsageError
+
+
+_CONDITION_RE = re.compile(r"""
+    \s*
+    (?P<field>[A-Za-z_][\w-]*(?:\.[A-Za-z_][\w-]*)*)
+    \s*
+    (?P<op><=|>=|\^=|=|<|>)
+    \s*
+    (?P<value>"(?:[^"\\]|\\.)*"|[^\s"]+)
+    \s*
+""", re.VERBOSE | re.UNICODE)
+
+_FIELD_RE = re.compile(
+    r"[A-Za-z_][\w-]*(?:\.[A-Za-z_][\w-]*)*$", re.UNICODE)
+
+_AND_RE = re.compile(r"and\b", re.IGNORECASE | re.UNICODE)
+
+RANGE_OPS = frozenset(['<', '<=', '>', '>='])
+
+# Whether functions accept a ``fields`` argument, so that each collection
+# method's signature is only inspected once.
+_ACCEPTS_FIELDS = weakref.WeakKeyDictionary()
+
+# Value kinds, in the order they sort in a SortedIndex.
+_NULL, _BOOL, _NUMBER, _STRING = range(4)
+
+
+def value_kind(value):
+    """
+    Return the kind of a value for comparison purposes, or ``None`` if the
+    value can't be compared by queries (e.g. lists and dicts).
+    """
+    if value is None:
+        return _NULL
+    if isinstance(value, bool):
+        return _BOOL
+    if isinstance(value, Number):
+        return _NUMBER
+    if isinstance(value, basestring):
+        return _STRING
+    return None
+
+
+def get_field(row, field):
+    """
+    Look up a possibly nested field in a row. Return ``(found, value)``.
+    """
+    value = row
+    for name in field.split('.'):
+        if not isinstance(value, dict) or name not in value:
+            return (False, None)
+        value = value[name]
+    return (True, value)
+
+
+def parse_fields(fields):
+    """
+    Parse a comma separated list of possibly nested field names into a
+    tuple of field names, in the order given and without duplicates.
+
+    :raises CollectionUsageError: if a field name is invalid.
+    """
+    names = []
+    for name in fields.split(','):
+        name = name.strip()
+        if _FIELD_RE.match(name) is None:
+            raise CollectionUsageError('Invalid fields: %r' % (fields,))
+        if name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+def project(row, fields):
+    """
+    Return a new dict containing only the given, possibly nested, fields of
+    a row. Fields that the row doesn't have are left out. Field values are
+    shared with the row rather than copied. If ``fields`` is ``None``, the
+    row is returned unchanged.
+    """
+    if fields is None:
+        return row
+    fields = set(fields)
+    result = {}
+    for field in fields:
+        names = field.split('.')
+        if any('.'.join(names[:i]) in fields for i in range(1, len(names))):
+            # A containing field is returned whole.
+            continue
+        found, value = get_field(row, field)
+        if not found:
+            continue
+        target = result
+        for name in names[:-1]:
+            target = target.setdefault(name, {})
+        target[names[-1]] = value
+    return result
+
+
+def _accepts_fields(method):
+    func = getattr(method, '__func__', method)
+    try:
+        return _ACCEPTS_FIELDS[func]
+    except (KeyError, TypeError):
+        pass
+    # Decorators such as simulate_async() record the function they wrap.
+    inner = func
+    while getattr(inner, '__wrapped__', None) is not None:
+        inner = inner.__wrapped__
+    try:
+        spec = inspect.getargspec(inner)
+    except TypeError:
+        # We can't tell, so we play it safe.
+        accepts = False
+    else:
+        if 'fields' in spec.args:
+            accepts = True
+        else:
+            # A bare ``(*args, **kw)`` is probably a wrapper around a
+            # function we can't see, so we play it safe.
+            bare = spec.varargs is not None and spec.args in ([], ['self'])
+            accepts = spec.keywords is not None and not bare
+    try:
+        _ACCEPTS_FIELDS[func] = accepts
+    except TypeError:
+        pass
+    return accepts
+
+
+def fields_kwargs(method, fields):
+    """
+    Return the keyword arguments that pass ``fields`` to a collection's
+    ``get``, ``page`` or ``stream`` method. They're empty if ``fields`` is
+    ``None`` or the method doesn't accept a ``fields`` argument, as methods
+    written before field selection was added don't. Callers should
+    :func:`project` the results either way.
+    """
+    if fields is None or not _accepts_fields(method):
+        return {}
+    return {'fields': fields}
+
+
+class Condition(namedtuple('Condition', ['field', 'op', 'value'])):
+    """
+    A single ``field op value`` query condition.
+    """
+
+    __slots__ = ()
+
+    def matches(self, row):
+        found, value = get_field(row, self.field)
+        if not found or value_kind(value) != value_kind(self.value):
+            return False
+        if self.op == '=':
+            return value == self.value
+        if self.op == '^=':
+            return value.startswith(self.value)
+        if self.op == '<':
+            return value < self.value
+        if self.op == '<=':
+            return value <= self.value
+        if self.op == '>':
+            return value > self.value
+        return value >= self.value
+
+
+def _parse_value(raw):
+    if raw.startswith('"'):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise CollectionUsageError('Invalid query value: %s' % (raw,))
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return raw
+    if value_kind(value) is None:
+        # Unquoted values that decode to lists or dicts are just strings.
+        return raw
+    return value
+
+
+def parse_query(query):
+    """
+    Parse a query string into a list of :class:`Condition` objects.
+
+    :raises CollectionUsageError: if the query is invalid.
+    """
+    conditions = []
+    pos = 0
+    while True:
+        match = _CONDITION_RE.match(query, pos)
+        if match is None:
+            raise CollectionUsageError('Invalid query: %r' % (query,))
+        op = match.group('op')
+        value = _parse_value(match.group('value'))
+        kind = value_kind(value)
+        if op in RANGE_OPS and kind not in (_NUMBER, _STRING):
+            raise CollectionUsageError(
+                'Range queries need a number or string: %r' % (query,))
+        if op == '^=' and kind != _STRING:
+            raise CollectionUsageError(
+                'Prefix queries need a string: %r' % (query,))
+        conditions.append(Condition(match.group('field'), op, value))
+        pos = match.end()
+        if pos == len(query):
+            return conditions
+        match = _AND_RE.match(query, pos)
+        if match is None:
+            raise CollectionUsageError('Invalid query: %r' % (query,))
+        pos = match.end()
+
+
+class _Bound(object):
+    """
+    A value that sorts before (``_Bound(-1)``) or after (``_Bound(1)``) any
+    object id. Used to build SortedIndex search keys.
+    """
+
+    def __init__(self, sign):
+        self.sign = sign
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __lt__(self, other):
+        return self.sign < 0
+
+    def __gt__(self, other):
+        return self.sign > 0
+
+    def __le__(self, other):
+        return self.sign < 0
+
+    def __ge__(self, other):
+        return self.sign > 0
+
+    __hash__ = object.__hash__
+
+
+_MIN = _Bound(-1)
+_MAX = _Bound(1)
+
+
+class HashIndex(object):
+    """
+    An index of object ids by field value that supports ``=`` conditions.
+    """
+
+    ops = frozenset(['='])
+
+    def __init__(self, field):
+        self.field = field
+        self._ids = {}
+
+    def _entry(self, row):
+        found, value = get_field(row, self.field)
+        kind = value_kind(value)
+        if not found or kind is None:
+            return None
+        return (kind, value)
+
+    def add(self, object_id, row):
+        entry = self._entry(row)
+        if entry is not None:
+            self._ids.setdefault(entry, set()).add(object_id)
+
+    def remove(self, object_id, row):
+        entry = self._entry(row)
+        ids = self._ids.get(entry)
+        if ids is not None:
+            ids.discard(object_id)
+            if not ids:
+                del self._ids[entry]
+
+    def lookup(self, condition):
+        """
+        Return the set of object ids that match ``condition``.
+        """
+        entry = (value_kind(condition.value), condition.value)
+        return set(self._ids.get(entry, ()))
+
+
+class SortedIndex(object):
+    """
+    An index of object ids ordered by field value that supports ``=``,
+    range and prefix conditions.
+    """
+
+    ops = frozenset(['=', '^=']) | RANGE_OPS
+
+    def __init__(self, field):
+        self.field = field
+        self._entries = []
+
+    def _entry(self, object_id, row):
+        found, value = get_field(row, self.field)
+        kind = value_kind(value)
+        if not found or kind is None:
+            return None
+        return (kind, value, object_id)
+
+    def add(self, object_id, row):
+        entry = self._entry(object_id, row)
+        if entry is not None:
+            i = bisect_left(self._entries, entry)
+            if i == len(self._entries) or self._entries[i] != entry:
+                self._entries.insert(i, entry)
+
+    def remove(self, object_id, row):
+        entry = self._entry(object_id, row)
+        if entry is not None:
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def _slice(self, lo, hi):
+        entries = self._entries
+        start = bisect_left(entries, lo)
+        end = bisect_right(entries, hi)
+        return set(entry[2] for entry in entries[start:end])
+
+    def lookup(self, condition):
+        """
+        Return the set of object ids that match ``condition``.
+        """
+        op, value = condition.op, condition.value
+        kind = value_kind(value)
+        if op == '=':
+            return self._slice((kind, value, _MIN), (kind, value, _MAX))
+        if op == '<':
+            return self._slice((kind, _MIN), (kind, value, _MIN))
+        if op == '<=':
+            return self._slice((kind, _MIN), (kind, value, _MAX))
+        if op == '>':
+            return self._slice((kind, value, _MAX), (kind, _MAX))
+        if op == '>=':
+            return self._slice((kind, value, _MIN), (kind, _MAX))
+        # Prefix match: walk forward from the first possible match.
+        entries = self._entries
+        ids = set()
+        i = bisect_left(entries, (kind, value, _MIN))
+        while i < len(entries):
+            entry = entries[i]
+            if entry[0] != kind or not entry[1].startswith(value):
+                break
+            ids.add(entry[2])
+            i += 1
+        return ids
+
+
+INDEX_TYPES = {
+    'hash': HashIndex,
+    'sorted': SortedIndex,
+}
@@ -0,0 +1,549 @@
+"""
+Tests for the append-only log collection.
+"""
+
+import os
+
+from twisted.trial.unittest import TestCase
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet import reactor
+from twisted.internet.task import Clock, deferLater
+from twisted.python.threadable import isInIOThread
+from zope.interface.verify import verifyObject
+
+from go_api.collections.appendlog import AppendLog, AppendLogCollection
+from go_api.collections.errors import CollectionObjectNotFound
+from go_api.collections.inmemory import InMemoryCollection
+from go_api.collections.interfaces import ICollection
+from go_api.queue.pausingdeferredqueue import PausingQueueCloseMarker
+
+
+class TestAppendLog(TestCase):
+    def mk_log(self, path=None, **kw):
+        if path is None:
+            path = self.mktemp()
+        kw.setdefault("clock", Clock())
+        log = AppendLog(path, **kw)
+        self.addCleanup(log.close)
+        return log
+
+    def test_set_get_delete(self):
+        log = self.mk_log()
+        self.assertEqual(len(log), 0)
+        log["a"] = {"x": 1, "y": [1, "two"]}
+        log[u"b"] = {}
+        self.assertEqual(log["a"], {"x": 1, "y": [1, u"two"]})
+        self.assertEqual(log[u"b"], {})
+        self.assertEqual(sorted(log), ["a", u"b"])
+        self.assertTrue("a" in log)
+        del log["a"]
+        self.assertFalse("a" in log)
+        self.assertRaises(KeyError, lambda: log["a"])
+        self.assertRaises(KeyError, log.__delitem__, "a")
+        self.assertEqual(list(log), [u"b"])
+
+    def test_reads_are_copies(self):
+        log = self.mk_log()
+        log["a"] = {"x": []}
+        log["a"]["x"].append(1)
+        self.assertEqual(log["a"], {"x": []})
+
+    def test_invalid_key(self):
+        log = self.mk_log()
+        self.assertRaises(TypeError, log.__setitem__, 1, {})
+        self.assertEqual(log.size, 0)
+
+    def test_unserializable_row(self):
+        log = self.mk_log()
+        self.assertRaises(TypeError, log.__setitem__, "a", {"x": object()})
+        self.assertEqual(log.size, 0)
+        self.assertEqual(len(log), 0)
+
+    @inlineCallbacks
+    def test_reopen(self):
+        path = self.mktemp()
+        log = self.mk_log(path)
+        log["a"] = {"x": 1}
+        log["b\xff"] = {"x": 2}
+        log[u"c\u1234"] = {"x": 3}
+        log["a"] = {"x": 4}
+        del log["b\xff"]
+        log["d\t\n"] = {"x": "\t\n"}
+        size = log.size
+        yield log.close()
+
+        log = self.mk_log(path)
+        self.assertEqual(log.size, size)
+        self.assertEqual(dict(log), {
+            "a": {"x": 4},
+            u"c\u1234": {"x": 3},
+            "d\t\n": {"x": "\t\n"},
+        })
+        self.assertEqual(
+            sorted(type(k) for k in log), [str, str, unicode])
+
+    @inlineCallbacks
+    def test_reopen_truncates_incomplete_record(self):
+        path = self.mktemp()
+        log = self.mk_log(path)
+        log["a"] = {"x": 1}
+        log["b"] = {"x": 2}
+        size = log.size
+        yield log.close()
+        with open(path, "ab") as f:
+            f.write('["s","u","c"]\t{"x":')
+
+        log = self.mk_log(path)
+        self.assertEqual(log.size, size)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(dict(log), {"a": {"x": 1}, "b": {"x": 2}})
+        log["c"] = {"x": 3}
+        yield log.close()
+
+        log = self.mk_log(path)
+        self.assertEqual(
+            dict(log), {"a": {"x": 1}, "b": {"x": 2}, "c": {"x": 3}})
+
+    @inlineCallbacks
+    def test_reopen_skips_invalid_record(self):
+        path = self.mktemp()
+        log = self.mk_log(path)
+        log["a"] = {"x": 1}
+        yield log.close()
+        with open(path, "ab") as f:
+            f.write('["s","u"\t{"x":2}\n')
+            f.write('["s","u","c"]\t{"x":3}\n')
+        size = os.path.getsize(path)
+
+        # The invalid record isn't at the end, so it isn't truncated, and
+        # the records after it are still loaded.
+        log = self.mk_log(path)
+        self.assertEqual(log.size, size)
+        self.assertEqual(dict(log), {"a": {"x": 1}, "c": {"x": 3}})
+        self.assertEqual(log.garbage_bytes, len('["s","u"\t{"x":2}\n'))
+        log["d"] = {"x": 4}
+        yield log.close()
+
+        log = self.mk_log(path)
+        self.assertEqual(
+            dict(log), {"a": {"x": 1}, "c": {"x": 3}, "d": {"x": 4}})
+        yield log.compact()
+        self.assertEqual(log.garbage_bytes, 0)
+        self.assertEqual(
+            dict(log), {"a": {"x": 1}, "c": {"x": 3}, "d": {"x": 4}})
+
+    def test_garbage_bytes(self):
+        log = self.mk_log()
+        log["a"] = {"x": 1}
+        self.assertEqual(log.garbage_bytes, 0)
+        size = log.size
+        log["a"] = {"x": 2}
+        self.assertEqual(log.garbage_bytes, size)
+        del log["a"]
+        self.assertEqual(log.garbage_bytes, log.size)
+
+    @inlineCallbacks
+    def test_garbage_bytes_reopen(self):
+        path = self.mktemp()
+        log = self.mk_log(path)
+        log["a"] = {"x": 1}
+        log["a"] = {"x": 2}
+        log["b"] = {"x": 2}
+        garbage = log.garbage_bytes
+        yield log.close()
+        self.assertEqual(self.mk_log(path).garbage_bytes, garbage)
+
+    def test_remap_in_steps(self):
+        log = self.mk_log(remap_size=100)
+        remaps = []
+        remap = log._remap
+        self.patch(log, "_remap", lambda: (remaps.append(log.size), remap()))
+        for i in range(10):
+            log["a%d" % (i,)] = {"x": i}
+            self.assertEqual(log["a%d" % (i,)], {"x": i})
+        # The file is only mapped again after every 100 bytes or so.
+        self.assertTrue(0 < len(remaps) < 10)
+        for size in remaps:
+            self.assertTrue(size >= 100)
+        with open(log.path, "rb") as f:
+            self.assertEqual(log._read(0, log.size), f.read())
+        self.assertEqual(
+            dict(log), dict(("a%d" % (i,), {"x": i}) for i in range(10)))
+
+    def record_fsyncs(self):
+        """
+        Replace ``os.fsync`` with a function that records whether it was
+        called in the reactor thread.
+        """
+        fsyncs = []
+        self.patch(os, "fsync", lambda fd: fsyncs.append(isInIOThread()))
+        return fsyncs
+
+    @inlineCallbacks
+    def test_sync_grouped(self):
+        clock = Clock()
+        log = self.mk_log(clock=clock, sync_interval=0.1)
+        fsyncs = self.record_fsyncs()
+
+        d1 = log.wait_for_sync()
+        self.assertTrue(d1.called)
+
+        log["a"] = {}
+        d1 = log.wait_for_sync()
+        log["b"] = {}
+        d2 = log.wait_for_sync()
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertFalse(d1.called)
+        self.assertFalse(d2.called)
+
+        clock.advance(0.1)
+        yield d1
+        yield d2
+        # fsync isn't called in the reactor thread.
+        self.assertEqual(fsyncs, [False])
+        self.assertTrue(log.wait_for_sync().called)
+
+        log["c"] = {}
+        d3 = log.wait_for_sync()
+        self.assertFalse(d3.called)
+        clock.advance(0.1)
+        yield d3
+        self.assertEqual(len(fsyncs), 2)
+
+    @inlineCallbacks
+    def test_sync_now(self):
+        clock = Clock()
+        log = self.mk_log(clock=clock, sync_interval=10)
+        log["a"] = {}
+        d = log.wait_for_sync()
+        log.sync()
+        self.assertEqual(clock.getDelayedCalls(), [])
+        yield d
+
+    @inlineCallbacks
+    def test_sync_during_sync(self):
+        clock = Clock()
+        log = self.mk_log(clock=clock, sync_interval=10)
+        fsyncs = self.record_fsyncs()
+        log["a"] = {}
+        d1 = log.wait_for_sync()
+        log.sync()
+        # Waiting without writing waits for the running flush.
+        d2 = log.wait_for_sync()
+        self.assertFalse(d2.called)
+        # Writes made while a flush is running wait for the next flush.
+        log["b"] = {}
+        d3 = log.wait_for_sync()
+        log.sync()
+        yield d1
+        yield d2
+        self.assertFalse(d3.called)
+        yield d3
+        self.assertEqual(fsyncs, [False, False])
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    @inlineCallbacks
+    def test_sync_error(self):
+        log = self.mk_log(sync_interval=0)
+        log["a"] = {}
+        d = log.wait_for_sync()
+
+        def fsync(fd):
+            raise OSError("Disk on fire")
+        self.patch(os, "fsync", fsync)
+        log.clock.advance(0)
+        yield self.assertFailure(d, OSError)
+
+    def test_sync_disabled(self):
+        clock = Clock()
+        log = self.mk_log(clock=clock, sync_interval=None)
+        log["a"] = {}
+        self.assertTrue(log.wait_for_sync().called)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    @inlineCallbacks
+    def test_compact(self):
+        path = self.mktemp()
+        log = self.mk_log(path, compact_ratio=None)
+        for i in range(10):
+            log["a"] = {"x": i}
+            log["b%d" % (i,)] = {"x": i}
+        for i in range(5):
+            del log["b%d" % (i,)]
+        expected = dict(log)
+        self.assertNotEqual(log.garbage_bytes, 0)
+
+        yield log.compact()
+        self.assertEqual(log.compactions, 1)
+        self.assertEqual(log.garbage_bytes, 0)
+        self.assertEqual(os.path.getsize(path), log.size)
+        self.assertFalse(os.path.exists(path + ".compact"))
+        self.assertEqual(dict(log), expected)
+
+        log["c"] = {"x": 1}
+        expected["c"] = {"x": 1}
+        self.assertEqual(dict(log), expected)
+        yield log.close()
+        self.assertEqual(dict(self.mk_log(path)), expected)
+
+    @inlineCallbacks
+    def test_compact_empty(self):
+        log = self.mk_log()
+        yield log.compact()
+        self.assertEqual(log.size, 0)
+        log["a"] = {}
+        self.assertEqual(log["a"], {})
+
+    @inlineCallbacks
+    def test_compact_concurrent_writes(self):
+        """
+        Writes made while a compaction is running end up in the compacted
+        file.
+        """
+        clock = Clock()
+        path = self.mktemp()
+        log = self.mk_log(
+            path, clock=clock, compact_ratio=None, compact_batch_size=2)
+        for key in "abcdef":
+            log[key] = {"v": 1}
+            log[key] = {"v": 2}
+
+        d = log.compact()
+        self.assertNoResult(d)
+        # The first batch has been copied.
+        log["a"] = {"v": 3}
+        del log["b"]
+        # The second batch hasn't.
+        log["c"] = {"v": 3}
+        del log["d"]
+        log["g"] = {"v": 1}
+        del log["g"]
+        log["h"] = {"v": 1}
+        d2 = log.compact()
+        while not d.called:
+            clock.advance(0)
+            # The new file is flushed in a thread.
+            yield deferLater(reactor, 0, lambda: None)
+        yield d
+        self.assertTrue(d2.called)
+
+        expected = {
+            "a": {"v": 3}, "c": {"v": 3}, "e": {"v": 2}, "f": {"v": 2},
+            "h": {"v": 1},
+        }
+        self.assertEqual(log.compactions, 1)
+        self.assertEqual(dict(log), expected)
+        self.assertNotEqual(log.garbage_bytes, 0)
+        garbage = log.garbage_bytes
+        yield log.close()
+        log = self.mk_log(path)
+        self.assertEqual(dict(log), expected)
+        self.assertEqual(log.garbage_bytes, garbage)
+
+    @inlineCallbacks
+    def test_compact_flushes_in_thread(self):
+        clock = Clock()
+        path = self.mktemp()
+        log = self.mk_log(path, clock=clock, compact_ratio=None)
+        log["a"] = {"v": 1}
+        log["a"] = {"v": 2}
+        fsyncs = self.record_fsyncs()
+        d = log.compact()
+        self.assertNoResult(d)
+
+        # Writes made while the new file is flushed are copied to it, and
+        # aren't flushed until it has replaced the old file.
+        log["b"] = {"v": 1}
+        synced = log.wait_for_sync()
+        clock.advance(0)
+        self.assertEqual(log._syncing, None)
+        yield d
+        yield synced
+        # The new file, its directory and then the new write.
+        self.assertEqual(fsyncs, [False, False, False])
+        self.assertEqual(log.compactions, 1)
+        self.assertEqual(dict(log), {"a": {"v": 2}, "b": {"v": 1}})
+        yield log.close()
+        self.assertEqual(
+            dict(self.mk_log(path)), {"a": {"v": 2}, "b": {"v": 1}})
+
+    @inlineCallbacks
+    def test_auto_compact(self):
+        log = self.mk_log(compact_ratio=0.5, compact_min_size=200)
+        log["a"] = {"x": 0}
+        record_size = log.size
+        while log.size + record_size < 200:
+            log["a"] = {"x": 0}
+        self.assertEqual(log._compacting, None)
+        log["a"] = {"x": 0}
+        self.assertNotEqual(log._compacting, None)
+        # This waits for the automatic compaction to finish.
+        yield log.compact()
+        self.assertEqual(log.compactions, 1)
+        self.assertEqual(log.size, record_size)
+        self.assertEqual(log["a"], {"x": 0})
+
+    def test_auto_compact_disabled(self):
+        log = self.mk_log(compact_ratio=None, compact_min_size=0)
+        for i in range(10):
+            log["a"] = {"x": i}
+        self.assertEqual(log.compactions, 0)
+
+    @inlineCallbacks
+    def test_close(self):
+        log = self.mk_log(sync_interval=10)
+        log["a"] = {}
+        d = log.wait_for_sync()
+        yield log.close()
+        self.assertTrue(d.called)
+        self.assertEqual(log.clock.getDelayedCalls(), [])
+        # Closing twice is fine.
+        yield log.close()
+
+
+class TestAppendLogCollection(TestCase):
+    def mk_collection(self, path=None, **kw):
+        if path is None:
+            path = self.mktemp()
+        collection = AppendLogCollection(path, **kw)
+        self.addCleanup(collection.close)
+        return collection
+
+    @inlineCallbacks
+    def stream_all(self, collection, query=None):
+        q = yield collection.stream(query=query)
+        objs = []
+        while True:
+            obj = yield q.get()
+            if isinstance(obj, PausingQueueCloseMarker):
+                break
+            objs.append(obj)
+        returnValue(objs)
+
+    @inlineCallbacks
+    def page_all(self, collection, max_results, query=None):
+        pages = []
+        cursor = None
+        while True:
+            cursor, page = yield collection.page(
+                cursor, max_results=max_results, query=query)
+            pages.append(page)
+            if cursor is None:
+                break
+        returnValue(pages)
+
+    def test_collection_provides_ICollection(self):
+        verifyObject(ICollection, self.mk_collection())
+
+    @inlineCallbacks
+    def test_crud(self):
+        collection = self.mk_collection()
+        key, data = yield collection.create(None, {"a": 1})
+        self.assertEqual(data, {"id": key, "a": 1})
+        obj = yield collection.get(key)
+        self.assertEqual(obj, data)
+        obj = yield collection.update(key, {"id": key, "a": 2})
+        self.assertEqual(obj, {"id": key, "a": 2})
+        obj = yield collection.delete(key)
+        self.assertEqual(obj, {"id": key, "a": 2})
+        yield self.assertFailure(
+            collection.get(key), CollectionObjectNotFound)
+
+    @inlineCallbacks
+    def test_writes_wait_for_sync(self):
+        clock = Clock()
+        collection = self.mk_collection(clock=clock, sync_interval=1)
+        d = collection.create("a", {})
+        yield deferLater(reactor, 0, lambda: None)
+        self.assertNoResult(d)
+        clock.advance(1)
+        result = yield d
+        self.assertEqual(result, ("a", {"id": "a"}))
+
+        d = collection.create_many([("b", {}), ("c", {})])
+        yield deferLater(reactor, 0, lambda: None)
+        self.assertNoResult(d)
+        clock.advance(1)
+        yield d
+
+    @inlineCallbacks
+    def test_persistent(self):
+        path = self.mktemp()
+        indexes = {"colour": "hash"}
+        collection = self.mk_collection(path, indexes=indexes)
+        yield collection.create("a", {"colour": "red"})
+        yield collection.create("b", {"colour": "blue"})
+        yield collection.create("c", {"colour": "red"})
+        yield collection.update("c", {"id": "c", "colour": "blue"})
+        yield collection.delete("a")
+        yield collection.close()
+
+        collection = self.mk_collection(
+            path, indexes=indexes, allow_full_scans=False)
+        keys = yield collection.all_keys()
+        self.assertEqual(sorted(keys), [u"b", u"c"])
+        objs = yield self.stream_all(collection, query="colour=blue")
+        self.assertEqual(objs, [
+            {"id": "b", "colour": "blue"}, {"id": "c", "colour": "blue"}])
+        objs = yield self.stream_all(collection, query="colour=red")
+        self.assertEqual(objs, [])
+
+    @inlineCallbacks
+    def test_failed_update_keeps_indexes(self):
+        collection = self.mk_collection(
+            indexes={"name": "hash"}, allow_full_scans=False)
+        yield collection.create("a", {"name": "x"})
+        # Build the indexes.
+        yield self.stream_all(collection, query='name="x"')
+        yield self.assertFailure(
+            collection.update("a", {"name": "y", "bad": object()}),
+            TypeError)
+        obj = yield collection.get("a")
+        self.assertEqual(obj, {"id": "a", "name": "x"})
+        objs = yield self.stream_all(collection, query='name="x"')
+        self.assertEqual(objs, [{"id": "a", "name": "x"}])
+        objs = yield self.stream_all(collection, query='name="y"')
+        self.assertEqual(objs, [])
+
+    @inlineCallbacks
+    def test_frozen_rows(self):
+        collection = self.mk_collection(frozen_rows=True)
+        yield collection.create("a", {"x": [1]})
+        obj = yield collection.get("a")
+        self.assertRaises(TypeError, obj.__setitem__, "x", 2)
+        self.assertEqual(obj, {"id": "a", "x": [1]})
+
+    @inlineCallbacks
+    def test_matches_inmemory(self):
+        """
+        Pages and streams match those of an InMemoryCollection with the same
+        contents, with both kinds of cursor.
+        """
+        for keyset_cursors in [False, True]:
+            kw = {
+                "indexes": {"n": "hash"},
+                "keyset_cursors": keyset_cursors,
+            }
+            inmemory = InMemoryCollection(**kw)
+            appendlog = self.mk_collection(
+                compact_ratio=0.1, compact_min_size=0, **kw)
+            for collection in [inmemory, appendlog]:
+                for i in range(20):
+                    yield collection.create(
+                        "obj-%02d" % (i,), {"n": i % 3, "s": "x" * i})
+                for i in range(0, 20, 4):
+                    yield collection.delete("obj-%02d" % (i,))
+                for i in range(1, 20, 4):
+                    yield collection.update(
+                        "obj-%02d" % (i,), {"id": "obj-%02d" % (i,), "n": 7})
+            self.assertNotEqual(appendlog.log.compactions, 0)
+
+            for query in [None, "n=1", "n=7"]:
+                expected = yield self.stream_all(inmemory, query)
+                objs = yield self.stream_all(appendlog, query)
+                self.assertEqual(objs, expected)
+                for max_results in [1, 3, 100]:
+                    expected = yield self.page_all(
+                        inmemory, max_results, query)
+                    pages = yield self.page_all(appendlog, max_results, query)
+                    self.assertEqual(pages, expected)
@@ -0,0 +1,374 @@
+"""
+Tests for go_api.collections.caching.
+"""
+
+from twisted.internet.defer import Deferred, gatherResults, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from zope.interface.verify import verifyObject
+
+from go_api.collections import CachingCollection, InMemoryCollection
+from go_api.collections.errors import CollectionObjectNotFound
+from go_api.collections.frozen import FrozenDict
+from go_api.collections.interfaces import ICollection
+
+
+class RecordingCollection(InMemoryCollection):
+    """
+    An InMemoryCollection that records the reads made from it.
+    """
+
+    def __init__(self, *args, **kw):
+        super(RecordingCollection, self).__init__(*args, **kw)
+        self.reads = []
+
+    def get(self, object_id, fields=None):
+        self.reads.append(('get', object_id))
+        return super(RecordingCollection, self).get(object_id, fields)
+
+    def page(self, cursor, max_results, query, fields=None):
+        self.reads.append(('page', cursor, max_results, query))
+        return super(RecordingCollection, self).page(
+            cursor, max_results, query, fields)
+
+    def get_many(self, object_ids):
+        self.reads.append(('get_many', list(object_ids)))
+        return super(RecordingCollection, self).get_many(object_ids)
+
+    def get_version(self, object_id):
+        self.reads.append(('get_version', object_id))
+        return super(RecordingCollection, self).get_version(object_id)
+
+    def get_collection_version(self):
+        self.reads.append(('get_collection_version',))
+        return super(RecordingCollection, self).get_collection_version()
+
+
+class UnversionedCollection(RecordingCollection):
+    """
+    A RecordingCollection that doesn't implement the optional version
+    methods.
+    """
+
+    get_version = None
+    get_collection_version = None
+    get_with_version = None
+    page_with_version = None
+
+
+class TestCachingCollection(TestCase):
+    def mk_collection(self, data=None, backend_cls=RecordingCollection,
+                      **kw):
+        if data is None:
+            data = {
+                'a': {'id': 'a', 'foo': 1},
+                'b': {'id': 'b', 'foo': 2},
+            }
+        backend = backend_cls(data)
+        kw.setdefault('clock', Clock())
+        return backend, CachingCollection(backend, **kw)
+
+    def test_provides_ICollection(self):
+        _, collection = self.mk_collection()
+        verifyObject(ICollection, collection)
+
+    @inlineCallbacks
+    def test_get_cached(self):
+        backend, collection = self.mk_collection()
+        obj = yield collection.get('a')
+        self.assertEqual(obj, {'id': 'a', 'foo': 1})
+        self.assertTrue(isinstance(obj, FrozenDict))
+        obj = yield collection.get('a')
+        self.assertEqual(obj, {'id': 'a', 'foo': 1})
+        self.assertEqual(backend.reads, [('get', 'a')])
+        self.assertEqual((collection.hits, collection.misses), (1, 1))
+
+    @inlineCallbacks
+    def test_get_missing_not_cached(self):
+        backend, collection = self.mk_collection()
+        yield self.assertFailure(
+            collection.get('missing'), CollectionObjectNotFound)
+        yield self.assertFailure(
+            collection.get('missing'), CollectionObjectNotFound)
+        self.assertEqual(backend.reads, [('get', 'missing')] * 2)
+
+    @inlineCallbacks
+    def test_get_ttl(self):
+        clock = Clock()
+        backend, collection = self.mk_collection(ttl=10, clock=clock)
+        yield collection.get('a')
+        clock.advance(10)
+        yield collection.get('a')
+        self.assertEqual(backend.reads, [('get', 'a')] * 2)
+
+    @inlineCallbacks
+    def test_get_evictions(self):
+        backend, collection = self.mk_collection(max_size=1)
+        yield collection.get('a')
+        yield collection.get('b')
+        yield collection.get('a')
+        self.assertEqual(
+            backend.reads, [('get', 'a'), ('get', 'b'), ('get', 'a')])
+        self.assertEqual(collection.evictions, 2)
+
+    @inlineCallbacks
+    def test_get_coalesced(self):
+        backend, collection = self.mk_collection()
+        objs = yield gatherResults([
+            collection.get('a'), collection.get('a'), collection.get('b')])
+        self.assertEqual(
+            objs,
+            [{'id': 'a', 'foo': 1}, {'id': 'a', 'foo': 1},
+             {'id': 'b', 'foo': 2}])
+        self.assertEqual(backend.reads, [('get', 'a'), ('get', 'b')])
+
+    @inlineCallbacks
+    def test_get_coalesced_failure(self):
+        backend, collection = self.mk_collection()
+        d1 = collection.get('missing')
+        d2 = collection.get('missing')
+        yield self.assertFailure(d1, CollectionObjectNotFound)
+        yield self.assertFailure(d2, CollectionObjectNotFound)
+        self.assertEqual(backend.reads, [('get', 'missing')])
+
+    @inlineCallbacks
+    def test_update_invalidates(self):
+        backend, collection = self.mk_collection()
+        yield collection.get('a')
+        yield collection.update('a', {'foo': 3})
+        obj = yield collection.get('a')
+        self.assertEqual(obj, {'id': 'a', 'foo': 3})
+        self.assertEqual(backend.reads, [('get', 'a')] * 2)
+
+    @inlineCallbacks
+    def test_delete_invalidates(self):
+        backend, collection = self.mk_collection()
+        yield collection.get('a')
+        yield collection.delete('a')
+        yield self.assertFailure(collection.get('a'), CollectionObjectNotFound)
+
+    @inlineCallbacks
+    def test_write_during_fetch_not_cached(self):
+        backend, collection = self.mk_collection()
+        d = collection.get('a')
+        # A write that finishes while the fetch is in flight means the fetch
+        # result might be stale, so it mustn't be cached.
+        collection.invalidate(['a'])
+        yield d
+        self.assertEqual(len(collection.object_cache), 0)
+        # New reads don't share the stale fetch either.
+        d1 = collection.get('a')
+        collection.invalidate(['a'])
+        d2 = collection.get('a')
+        yield gatherResults([d1, d2])
+        self.assertEqual(backend.reads, [('get', 'a')] * 3)
+
+    @inlineCallbacks
+    def test_page_cached(self):
+        backend, collection = self.mk_collection()
+        page1 = yield collection.page(None, 1, None)
+        page2 = yield collection.page(None, 1, None)
+        self.assertEqual(page1, page2)
+        cursor, data = page1
+        self.assertEqual(data, [{'id': 'a', 'foo': 1}])
+        self.assertEqual(backend.reads, [('page', None, 1, None)])
+
+        # Different arguments are cached separately.
+        yield collection.page(cursor, 1, None)
+        yield collection.page(None, 1, u'foo=1')
+        self.assertEqual(len(backend.reads), 3)
+
+    @inlineCallbacks
+    def test_get_fields_from_cache(self):
+        backend, collection = self.mk_collection()
+        obj = yield collection.get('a', fields=('foo',))
+        self.assertEqual(obj, {'foo': 1})
+        self.assertTrue(isinstance(obj, FrozenDict))
+        obj = yield collection.get('a')
+        self.assertEqual(obj, {'id': 'a', 'foo': 1})
+        self.assertEqual(backend.reads, [('get', 'a')])
+
+    @inlineCallbacks
+    def test_page_fields_from_cache(self):
+        backend, collection = self.mk_collection()
+        yield collection.page(None, None, None)
+        cursor, data = yield collection.page(None, None, None, fields=('id',))
+        self.assertEqual(cursor, None)
+        self.assertEqual(data, [{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(backend.reads, [('page', None, None, None)])
+
+    @inlineCallbacks
+    def test_fields_unsupported_by_backend(self):
+        class FieldlessCollection(object):
+            def __init__(self, collection):
+                self.collection = collection
+
+            def stream(self, query):
+                return self.collection.stream(query)
+
+            def page(self, cursor, max_results, query):
+                return self.collection.page(cursor, max_results, query)
+
+        backend, _ = self.mk_collection()
+        collection = CachingCollection(
+            FieldlessCollection(backend), cache_pages=False, clock=Clock())
+        # The backend returns whole objects, which callers project.
+        _, data = yield collection.page(None, 1, None, fields=('foo',))
+        self.assertEqual(data, [{'id': 'a', 'foo': 1}])
+        q = yield collection.stream(None, fields=('foo',))
+        obj = yield q.get()
+        self.assertEqual(obj, {'id': 'a', 'foo': 1})
+
+    @inlineCallbacks
+    def test_page_invalidated_by_writes(self):
+        backend, collection = self.mk_collection()
+        yield collection.page(None, None, None)
+        yield collection.create('c', {})
+        _, data = yield collection.page(None, None, None)
+        self.assertEqual([obj['id'] for obj in data], ['a', 'b', 'c'])
+        self.assertEqual(backend.reads, [('page', None, None, None)] * 2)
+
+    @inlineCallbacks
+    def test_page_not_cached(self):
+        backend, collection = self.mk_collection(cache_pages=False)
+        yield collection.page(None, None, None)
+        yield collection.page(None, None, None)
+        self.assertEqual(backend.reads, [('page', None, None, None)] * 2)
+
+    @inlineCallbacks
+    def test_get_many(self):
+        backend, collection = self.mk_collection(
+            backend_cls=UnversionedCollection)
+        yield collection.get('a')
+        results = yield collection.get_many(['b', 'a', 'missing'])
+        [(s1, r1), (s2, r2), (s3, r3)] = results
+        self.assertEqual((s1, r1), (True, {'id': 'b', 'foo': 2}))
+        self.assertEqual((s2, r2), (True, {'id': 'a', 'foo': 1}))
+        self.assertEqual(s3, False)
+        self.assertTrue(r3.check(CollectionObjectNotFound))
+        # Only the objects that weren't cached were fetched.
+        self.assertEqual(
+            backend.reads, [('get', 'a'), ('get_many', ['b', 'missing'])])
+        yield collection.get('b')
+        self.assertEqual(len(backend.reads), 2)
+
+    @inlineCallbacks
+    def test_get_many_versioned_not_cached(self):
+        backend, collection = self.mk_collection()
+        results = yield collection.get_many(['a'])
+        self.assertEqual(results, [(True, {'id': 'a', 'foo': 1})])
+        # We don't know which version get_many fetched, so it isn't cached.
+        yield collection.get('a')
+        self.assertEqual(backend.reads, [('get_many', ['a']), ('get', 'a')])
+
+    @inlineCallbacks
+    def test_bulk_writes_invalidate(self):
+        backend, collection = self.mk_collection()
+        yield collection.get_many(['a', 'b'])
+        yield collection.update_many([('a', {'foo': 3})])
+        yield collection.delete_many(['b'])
+        yield collection.create_many([('c', {})])
+        results = yield collection.get_many(['a', 'b', 'c'])
+        self.assertEqual(
+            [success for success, _ in results], [True, False, True])
+        self.assertEqual(results[0][1], {'id': 'a', 'foo': 3})
+
+    @inlineCallbacks
+    def test_failed_write_invalidates(self):
+        backend, collection = self.mk_collection()
+        yield collection.page(None, None, None)
+        yield self.assertFailure(
+            collection.update('missing', {}), CollectionObjectNotFound)
+        self.assertEqual(len(collection.page_cache), 0)
+
+    @inlineCallbacks
+    def test_versions_cached(self):
+        backend, collection = self.mk_collection()
+        backend_version = yield backend.get_version('a')
+        backend.reads = []
+        obj = yield collection.get('a')
+        version = yield collection.get_version('a')
+        self.assertEqual(version, backend_version)
+        version, data = yield collection.get_with_version('a', ('foo',))
+        self.assertEqual((version, data), (backend_version, {'foo': 1}))
+        self.assertEqual(backend.reads, [('get', 'a')])
+
+        # The cached version goes with the cached data, even if the backend
+        # has been written to directly.
+        yield backend.update('a', {'foo': 3})
+        version, data = yield collection.get_with_version('a')
+        self.assertEqual((version, data), (backend_version, obj))
+
+        yield collection.invalidate(['a'])
+        version, data = yield collection.get_with_version('a')
+        self.assertNotEqual(version, backend_version)
+        self.assertEqual(data, {'id': 'a', 'foo': 3})
+
+    @inlineCallbacks
+    def test_versions_fetched_before_data(self):
+        backend, collection = self.mk_collection()
+        backend.get_with_version = None
+        yield collection.get_version('a')
+        yield collection.get('a')
+        self.assertEqual(
+            backend.reads, [('get_version', 'a'), ('get', 'a')])
+
+    @inlineCallbacks
+    def test_collection_versions_cached(self):
+        backend, collection = self.mk_collection()
+        backend_version = yield backend.get_collection_version()
+        backend.reads = []
+        version = yield collection.get_collection_version()
+        self.assertEqual(version, backend_version)
+        version, page = yield collection.page_with_version(None, 1, None)
+        self.assertEqual(version, backend_version)
+        self.assertEqual(page, (yield collection.page(None, 1, None)))
+        self.assertEqual(
+            backend.reads,
+            [('get_collection_version',), ('page', None, 1, None)])
+
+        yield collection.create('c', {})
+        version = yield collection.get_collection_version()
+        self.assertNotEqual(version, backend_version)
+
+    def test_versions_hidden_if_unsupported(self):
+        _, collection = self.mk_collection(backend_cls=UnversionedCollection)
+        for name in ['get_version', 'get_with_version',
+                     'get_collection_version', 'page_with_version']:
+            self.assertEqual(getattr(collection, name, None), None)
+
+    def test_collection_versions_hidden_if_pages_not_cached(self):
+        _, collection = self.mk_collection(cache_pages=False)
+        for name in ['get_collection_version', 'page_with_version']:
+            self.assertEqual(getattr(collection, name, None), None)
+
+    @inlineCallbacks
+    def test_passthrough(self):
+        backend, collection = self.mk_collection()
+        keys = yield collection.all_keys()
+        self.assertEqual(sorted(keys), ['a', 'b'])
+        self.assertEqual(collection.keyset_cursors, False)
+
+    def test_passthrough_missing(self):
+        collection = CachingCollection(object(), clock=Clock())
+        self.assertEqual(getattr(collection, 'get_version', None), None)
+
+    @inlineCallbacks
+    def test_wraps_deferred_backend(self):
+        class SlowCollection(object):
+            def __init__(self):
+                self.pending = []
+
+            def get(self, object_id):
+                d = Deferred()
+                self.pending.append(d)
+                return d
+
+        backend = SlowCollection()
+        collection = CachingCollection(backend, clock=Clock())
+        d1 = collection.get('a')
+        d2 = collection.get('a')
+        self.assertEqual(len(backend.pending), 1)
+        backend.pending[0].callback({'id': 'a'})
+        objs = yield gatherResults([d1, d2])
+        self.assertEqual(objs, [{'id': 'a'}, {'id': 'a'}])
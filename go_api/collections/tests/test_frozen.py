@@ -0,0 +1,98 @@
+"""
+Tests for immutable collection data types.
+"""
+
+import json
+import pickle
+from copy import copy, deepcopy
+
+from twisted.trial.unittest import TestCase
+
+from go_api.collections.frozen import FrozenDict, FrozenList, freeze, thaw
+
+
+class TestFrozenDict(TestCase):
+    def test_equality(self):
+        self.assertEqual(FrozenDict({"a": 1}), {"a": 1})
+
+    def test_immutable(self):
+        d = FrozenDict({"a": 1})
+        self.assertRaises(TypeError, d.__setitem__, "b", 2)
+        self.assertRaises(TypeError, d.__delitem__, "a")
+        self.assertRaises(TypeError, d.update, {"b": 2})
+        self.assertRaises(TypeError, d.setdefault, "b", 2)
+        self.assertRaises(TypeError, d.pop, "a")
+        self.assertRaises(TypeError, d.popitem)
+        self.assertRaises(TypeError, d.clear)
+        self.assertEqual(d, {"a": 1})
+
+    def test_copy_returns_self(self):
+        d = FrozenDict({"a": 1})
+        self.assertIdentical(copy(d), d)
+        self.assertIdentical(deepcopy(d), d)
+
+    def test_pickle(self):
+        d = FrozenDict({"a": 1})
+        d2 = pickle.loads(pickle.dumps(d))
+        self.assertEqual(type(d2), FrozenDict)
+        self.assertEqual(d2, d)
+
+    def test_json(self):
+        self.assertEqual(json.dumps(FrozenDict({"a": 1})), '{"a": 1}')
+
+
+class TestFrozenList(TestCase):
+    def test_equality(self):
+        self.assertEqual(FrozenList([1, 2]), [1, 2])
+
+    def test_immutable(self):
+        lst = FrozenList([1, 2])
+        self.assertRaises(TypeError, lst.__setitem__, 0, 2)
+        self.assertRaises(TypeError, lst.__delitem__, 0)
+        self.assertRaises(TypeError, lst.append, 3)
+        self.assertRaises(TypeError, lst.extend, [3])
+        self.assertRaises(TypeError, lst.insert, 0, 3)
+        self.assertRaises(TypeError, lst.pop)
+        self.assertRaises(TypeError, lst.remove, 1)
+        self.assertRaises(TypeError, lst.reverse)
+        self.assertRaises(TypeError, lst.sort)
+        self.assertRaises(TypeError, lst.__iadd__, [3])
+        self.assertEqual(lst, [1, 2])
+
+    def test_copy_returns_self(self):
+        lst = FrozenList([1, 2])
+        self.assertIdentical(copy(lst), lst)
+        self.assertIdentical(deepcopy(lst), lst)
+
+    def test_json(self):
+        self.assertEqual(json.dumps(FrozenList([1, 2])), '[1, 2]')
+
+
+class TestFreeze(TestCase):
+    def test_nested(self):
+        value = freeze({"a": [{"b": 1}], "c": "d"})
+        self.assertEqual(value, {"a": [{"b": 1}], "c": "d"})
+        self.assertEqual(type(value), FrozenDict)
+        self.assertEqual(type(value["a"]), FrozenList)
+        self.assertEqual(type(value["a"][0]), FrozenDict)
+
+    def test_copies_input(self):
+        data = {"a": [1]}
+        value = freeze(data)
+        data["a"].append(2)
+        self.assertEqual(value, {"a": [1]})
+
+    def test_shares_frozen_values(self):
+        inner = freeze({"b": 1})
+        value = freeze({"a": inner})
+        self.assertIdentical(value["a"], inner)
+        self.assertIdentical(freeze(value), value)
+
+    def test_thaw(self):
+        frozen = freeze({"a": [{"b": 1}]})
+        value = thaw(frozen)
+        self.assertEqual(type(value), dict)
+        self.assertEqual(type(value["a"]), list)
+        self.assertEqual(type(value["a"][0]), dict)
+        value["a"][0]["b"] = 2
+        self.assertEqual(frozen, {"a": [{"b": 1}]})
@@ -10,6 +10,7 @@ from zope.interface.verify import verifyObject
 from go_api.collections.errors import (
     CollectionObjectNotFound, CollectionObjectAlreadyExists,
     CollectionUsageError)
+from go_api.collections.frozen import thaw
 from go_api.collections.inmemory import InMemoryCollection
 from go_api.collections.interfaces import ICollection
 from go_api.queue.pausingdeferredqueue import PausingQueueCloseMarker
@@ -112,9 +113,9 @@ class TestInMemoryCollection(TestCase):
         all_data = yield self.filtered_stream(collection)
         self.assertEqual(all_data, [data])
 
-    def test_stream_with_query(self):
+    def test_stream_with_invalid_query(self):
         """
-        Calling the stream function with a query parameter should raise a
+        Calling the stream function with an invalid query should raise a
         CollectionUsageError.
         """
         collection = InMemoryCollection()
@@ -164,9 +165,9 @@ class TestInMemoryCollection(TestCase):
         self.assertTrue(data1 in pages)
         self.assertTrue(data2 in pages)
 
-    def test_page_with_query(self):
+    def test_page_with_invalid_query(self):
         """
-        Calling the page function with a query parameter should raise a
+        Calling the page function with an invalid query should raise a
         CollectionUsageError.
         """
         collection = InMemoryCollection()
@@ -274,3 +275,511 @@ class TestInMemoryCollection(TestCase):
         yield self.failUnlessFailure(d, CollectionObjectNotFound)
         keys = yield collection.all_keys()
         self.assertEqual(keys, [])
+
+    @inlineCallbacks
+    def test_page_uses_key_index(self):
+        """
+        Paging reads object ids from the maintained key index rather than
+        sorting the datastore on every call.
+        """
+        collection = InMemoryCollection()
+        yield collection.create('b', {})
+        yield collection.create('a', {})
+        (_, page) = yield collection.page(None, None, None)
+        self.ensure_equal([o['id'] for o in page], ['a', 'b'])
+
+        collection._get_keys = lambda: self.fail("datastore scanned")
+        yield collection.create('c', {})
+        yield collection.delete('a')
+        (pointer, page) = yield collection.page(None, None, None)
+        self.assertEqual(pointer, None)
+        self.assertEqual(page, [{'id': 'b'}, {'id': 'c'}])
+
+    @inlineCallbacks
+    def test_key_index_update_does_not_duplicate(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        yield collection.all_keys()
+        yield collection.page(None, None, None)
+        yield collection.update('a', {'foo': 'bar'})
+        self.assertEqual(collection._get_key_index(), ['a'])
+
+    @inlineCallbacks
+    def test_rebuild_key_index(self):
+        store = {}
+        collection = InMemoryCollection(store)
+        yield collection.create('a', {})
+        self.ensure_equal(collection._get_key_index(), ['a'])
+        store['b'] = {'id': 'b'}
+        collection._rebuild_key_index()
+        self.assertEqual(collection._get_key_index(), ['a', 'b'])
+
+    @inlineCallbacks
+    def test_stream_sees_concurrent_changes(self):
+        """
+        Objects created or deleted ahead of a stream's position while it is
+        running are included or skipped respectively, and nothing is
+        repeated.
+        """
+        collection = InMemoryCollection()
+        for key in ['a', 'c', 'e', 'g', 'i']:
+            yield collection.create(key, {})
+        q = yield collection.stream(query=None)
+        # The first few objects have already been queued by now.
+        yield collection.create('f', {})
+        yield collection.delete('i')
+        objs = []
+        while True:
+            obj = yield q.get()
+            if isinstance(obj, PausingQueueCloseMarker):
+                break
+            objs.append(obj)
+        self.assertEqual(
+            [o['id'] for o in objs if o is not None],
+            ['a', 'c', 'e', 'f', 'g'])
+
+    @inlineCallbacks
+    def test_stream_cancelled(self):
+        """
+        When the consumer cancels a stream's queue, the collection stops
+        filling it.
+        """
+        collection = InMemoryCollection()
+        for key in ['a', 'b', 'c', 'd', 'e', 'f']:
+            yield collection.create(key, {})
+        q = yield collection.stream(query=None)
+        obj = yield q.get()
+        self.assertEqual(obj['id'], 'a')
+        self.assertFalse(q.fill_d.called)
+        q.cancel()
+        self.assertEqual(self.successResultOf(q.fill_d), None)
+        self.assertEqual(list(q.pending), [])
+
+    @inlineCallbacks
+    def test_page_keyset_cursors(self):
+        """
+        With keyset cursors enabled, the cursor is an opaque string that
+        refers to the next page.
+        """
+        collection = InMemoryCollection(keyset_cursors=True)
+        for key in ['a', 'b', 'c']:
+            yield collection.create(key, {})
+        (pointer, page1) = yield collection.page(None, 2, None)
+        self.assertEqual(page1, [{'id': 'a'}, {'id': 'b'}])
+        self.assertTrue(isinstance(pointer, str))
+
+        (pointer, page2) = yield collection.page(pointer, 2, None)
+        self.assertEqual(pointer, None)
+        self.assertEqual(page2, [{'id': 'c'}])
+
+    @inlineCallbacks
+    def test_page_keyset_cursors_concurrent_changes(self):
+        """
+        Creating or deleting objects on earlier pages doesn't cause objects
+        to be skipped or repeated when using keyset cursors.
+        """
+        collection = InMemoryCollection(keyset_cursors=True)
+        for key in ['b', 'd', 'f', 'h']:
+            yield collection.create(key, {})
+        (pointer, page1) = yield collection.page(None, 2, None)
+        self.ensure_equal(page1, [{'id': 'b'}, {'id': 'd'}])
+
+        yield collection.create('a', {})
+        yield collection.delete('b')
+        (pointer, page2) = yield collection.page(pointer, 2, None)
+        self.assertEqual(pointer, None)
+        self.assertEqual(page2, [{'id': 'f'}, {'id': 'h'}])
+
+    @inlineCallbacks
+    def test_page_keyset_cursor_unicode(self):
+        collection = InMemoryCollection(keyset_cursors=True)
+        for key in [u'\xe9a', u'\xe9b']:
+            yield collection.create(key, {})
+        (pointer, _) = yield collection.page(None, 1, None)
+        (pointer, page) = yield collection.page(
+            pointer.decode('ascii'), 1, None)
+        self.assertEqual(pointer, None)
+        self.assertEqual(page, [{'id': u'\xe9b'}])
+
+    def test_page_keyset_cursor_invalid(self):
+        collection = InMemoryCollection(keyset_cursors=True)
+        self.failUnlessFailure(collection.page(u'\xe9', 1, None),
+                               CollectionUsageError)
+        # Valid base64, but not a cursor we created.
+        self.failUnlessFailure(collection.page(u'Zm9v', 1, None),
+                               CollectionUsageError)
+
+    @inlineCallbacks
+    def test_frozen_rows_shared(self):
+        """
+        With frozen rows enabled, reads return the stored row without
+        copying it.
+        """
+        collection = InMemoryCollection(frozen_rows=True)
+        key, created = yield collection.create(None, {'foo': ['bar']})
+        data1 = yield collection.get(key)
+        data2 = yield collection.get(key)
+        self.assertIdentical(data1, created)
+        self.assertIdentical(data1, data2)
+        self.assertEqual(data1, {'id': key, 'foo': ['bar']})
+
+    @inlineCallbacks
+    def test_frozen_rows_isolation(self):
+        """
+        With frozen rows enabled, neither the data passed in nor the data
+        returned can be used to modify the stored row.
+        """
+        collection = InMemoryCollection(frozen_rows=True)
+        data = {'foo': ['bar']}
+        key, created = yield collection.create(None, data)
+        data['foo'].append('baz')
+        self.assertRaises(TypeError, created.__setitem__, 'foo', 'baz')
+        self.assertRaises(TypeError, created['foo'].append, 'baz')
+
+        stored = yield collection.get(key)
+        self.assertEqual(stored, {'id': key, 'foo': ['bar']})
+
+        mutable = thaw(stored)
+        mutable['foo'].append('quux')
+        updated = yield collection.update(key, mutable)
+        self.assertEqual(updated, {'id': key, 'foo': ['bar', 'quux']})
+        self.assertEqual(stored, {'id': key, 'foo': ['bar']})
+
+    @inlineCallbacks
+    def test_frozen_rows_existing_datastore(self):
+        """
+        Rows already in the datastore are frozen when they are first read.
+        """
+        store = {'key': {'id': 'key', 'foo': ['bar']}}
+        collection = InMemoryCollection(store, frozen_rows=True)
+        (_, [data]) = yield collection.page(None, None, None)
+        self.assertRaises(TypeError, data['foo'].append, 'baz')
+        self.assertIdentical(store['key'], data)
+
+    @inlineCallbacks
+    def mk_query_collection(self, **kw):
+        collection = InMemoryCollection(**kw)
+        yield collection.create('a', {'name': 'Jane', 'age': 30})
+        yield collection.create('b', {'name': 'John', 'age': 17})
+        yield collection.create('c', {'name': 'Jo', 'age': '18'})
+        yield collection.create('d', {'name': 'Bob', 'age': 18})
+        returnValue(collection)
+
+    @inlineCallbacks
+    def test_page_with_query(self):
+        collection = yield self.mk_query_collection()
+        (pointer, page) = yield collection.page(
+            None, None, u'name^="Jo" and age>=17')
+        self.assertEqual(pointer, None)
+        self.assertEqual([o['id'] for o in page], ['b'])
+
+    @inlineCallbacks
+    def test_page_with_query_multiple(self):
+        collection = yield self.mk_query_collection(
+            indexes={'age': 'sorted'}, keyset_cursors=True)
+        (pointer, page1) = yield collection.page(None, 1, u'age>17')
+        self.assertEqual([o['id'] for o in page1], ['a'])
+        (pointer, page2) = yield collection.page(pointer, 1, u'age>17')
+        self.assertEqual(pointer, None)
+        self.assertEqual([o['id'] for o in page2], ['d'])
+
+    @inlineCallbacks
+    def test_stream_with_query(self):
+        collection = yield self.mk_query_collection(
+            indexes={'name': 'hash'})
+        q = yield collection.stream(u'name="Jane"')
+        obj = yield q.get()
+        self.assertEqual(obj, {'id': 'a', 'name': 'Jane', 'age': 30})
+        obj = yield q.get()
+        self.assertTrue(isinstance(obj, PausingQueueCloseMarker))
+
+    @inlineCallbacks
+    def test_get_with_fields(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {'name': 'Jane', 'address': {
+            'city': 'Cape Town', 'code': '8001'}})
+        obj = yield collection.get('a', fields=('name', 'address.city'))
+        self.assertEqual(
+            obj, {'name': 'Jane', 'address': {'city': 'Cape Town'}})
+        obj = yield collection.get('a', fields=('missing',))
+        self.assertEqual(obj, {})
+        d = collection.get('missing', fields=('name',))
+        yield self.failUnlessFailure(d, CollectionObjectNotFound)
+
+    @inlineCallbacks
+    def test_get_with_fields_copies_values(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {'tags': ['x']})
+        obj = yield collection.get('a', fields=('tags',))
+        obj['tags'].append('y')
+        obj = yield collection.get('a')
+        self.assertEqual(obj['tags'], ['x'])
+
+    @inlineCallbacks
+    def test_get_with_fields_frozen_rows(self):
+        collection = InMemoryCollection(frozen_rows=True)
+        yield collection.create('a', {'name': 'Jane', 'tags': ['x']})
+        obj = yield collection.get('a', fields=('tags',))
+        self.assertEqual(obj, {'tags': ['x']})
+        self.assertRaises(TypeError, obj['tags'].append, 'y')
+
+    @inlineCallbacks
+    def test_page_with_fields(self):
+        collection = yield self.mk_query_collection()
+        (pointer, page) = yield collection.page(
+            None, 2, u'age>=17', fields=('id', 'name'))
+        self.assertEqual(pointer, 2)
+        self.assertEqual(page, [
+            {'id': 'a', 'name': 'Jane'},
+            {'id': 'b', 'name': 'John'},
+        ])
+
+    @inlineCallbacks
+    def test_stream_with_fields(self):
+        collection = yield self.mk_query_collection()
+        q = yield collection.stream(u'name="Jane"', fields=('age',))
+        obj = yield q.get()
+        self.assertEqual(obj, {'age': 30})
+        obj = yield q.get()
+        self.assertTrue(isinstance(obj, PausingQueueCloseMarker))
+
+    @inlineCallbacks
+    def test_query_indexed_no_scan(self):
+        """
+        Queries on indexed fields are answered without reading any rows
+        other than the ones returned.
+        """
+        collection = yield self.mk_query_collection(
+            indexes={'name': 'hash', 'age': 'sorted'},
+            allow_full_scans=False)
+        # Build the indexes before we stop rows from being read.
+        yield collection.page(None, None, u'name="Jane"')
+        collection._get_raw_data = lambda object_id: self.fail("row read")
+        (_, page) = yield collection.page(
+            None, None, u'name="John" and age<18')
+        self.assertEqual([o['id'] for o in page], ['b'])
+        (_, page) = yield collection.page(None, None, u'age>=18')
+        self.assertEqual([o['id'] for o in page], ['a', 'd'])
+
+    def test_query_full_scan_not_allowed(self):
+        collection = InMemoryCollection(
+            indexes={'name': 'hash'}, allow_full_scans=False)
+        self.failUnlessFailure(collection.page(None, None, u'name^="J"'),
+                               CollectionUsageError)
+        self.failUnlessFailure(collection.stream(u'age=1'),
+                               CollectionUsageError)
+
+    def test_unknown_index_type(self):
+        self.assertRaises(
+            ValueError, InMemoryCollection, indexes={'name': 'magic'})
+
+    @inlineCallbacks
+    def test_indexes_maintained(self):
+        collection = yield self.mk_query_collection(
+            indexes={'name': 'hash', 'age': 'sorted'},
+            allow_full_scans=False)
+        (_, page) = yield collection.page(None, None, u'age=18')
+        self.ensure_equal([o['id'] for o in page], ['d'])
+
+        yield collection.update('d', {'name': 'Bob', 'age': 40})
+        yield collection.delete('a')
+        yield collection.create('e', {'name': 'Eve', 'age': 18})
+        (_, page) = yield collection.page(None, None, u'age=18')
+        self.assertEqual([o['id'] for o in page], ['e'])
+        (_, page) = yield collection.page(None, None, u'age>20')
+        self.assertEqual([o['id'] for o in page], ['d'])
+        (_, page) = yield collection.page(None, None, u'name="Jane"')
+        self.assertEqual(page, [])
+
+    @inlineCallbacks
+    def test_writes_without_indexes_do_not_read_rows(self):
+        class WriteOnlyDict(dict):
+            def __getitem__(self, key):
+                raise AssertionError("row read")
+
+            def get(self, key, default=None):
+                raise AssertionError("row read")
+
+            def pop(self, key, default=None):
+                raise AssertionError("row read")
+
+        collection = InMemoryCollection(WriteOnlyDict())
+        collection._get_data = lambda object_id: None
+        yield collection.create('a', {'foo': 'bar'})
+        yield collection.update('a', {'foo': 'baz'})
+        self.assertEqual(
+            dict(collection._data), {'a': {'id': 'a', 'foo': 'baz'}})
+        # Deletes return the deleted object, so only check removing the row.
+        collection._del_data('a')
+        self.assertEqual(dict(collection._data), {})
+
+    @inlineCallbacks
+    def test_get_many(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {'foo': 'bar'})
+        [(s1, r1), (s2, r2)] = yield collection.get_many(['a', 'missing'])
+        self.assertEqual((s1, r1), (True, {'id': 'a', 'foo': 'bar'}))
+        self.assertEqual(s2, False)
+        self.assertTrue(r2.check(CollectionObjectNotFound))
+
+    @inlineCallbacks
+    def test_create_many(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        [(s1, r1), (s2, r2), (s3, r3)] = yield collection.create_many([
+            ('b', {'foo': 'bar'}),
+            ('a', {}),
+            (None, {}),
+        ])
+        self.assertEqual((s1, r1), (True, ('b', {'id': 'b', 'foo': 'bar'})))
+        self.assertEqual(s2, False)
+        self.assertTrue(r2.check(CollectionObjectAlreadyExists))
+        self.assertEqual(s3, True)
+        keys = yield collection.all_keys()
+        self.assertEqual(sorted(keys), sorted(['a', 'b', r3[0]]))
+
+    @inlineCallbacks
+    def test_update_many(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        [(s1, r1), (s2, r2)] = yield collection.update_many([
+            ('a', {'foo': 'bar'}),
+            ('missing', {}),
+        ])
+        self.assertEqual((s1, r1), (True, {'id': 'a', 'foo': 'bar'}))
+        self.assertEqual(s2, False)
+        self.assertTrue(r2.check(CollectionObjectNotFound))
+        data = yield collection.get('a')
+        self.assertEqual(data, {'id': 'a', 'foo': 'bar'})
+
+    @inlineCallbacks
+    def test_delete_many(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        yield collection.create('b', {})
+        [(s1, r1), (s2, r2)] = yield collection.delete_many(['a', 'missing'])
+        self.assertEqual((s1, r1), (True, {'id': 'a'}))
+        self.assertEqual(s2, False)
+        self.assertTrue(r2.check(CollectionObjectNotFound))
+        keys = yield collection.all_keys()
+        self.assertEqual(keys, ['b'])
+
+    @inlineCallbacks
+    def test_get_version(self):
+        collection = InMemoryCollection({'a': {'id': 'a'}, 'b': {'id': 'b'}})
+        va = yield collection.get_version('a')
+        vb = yield collection.get_version('b')
+        self.assertEqual(va, vb)
+
+        yield collection.update('a', {'foo': 'bar'})
+        va2 = yield collection.get_version('a')
+        self.assertNotEqual(va2, va)
+        vb2 = yield collection.get_version('b')
+        self.assertEqual(vb2, vb)
+
+    @inlineCallbacks
+    def test_get_version_missing(self):
+        collection = InMemoryCollection()
+        yield self.assertFailure(
+            collection.get_version('missing'), CollectionObjectNotFound)
+        yield collection.create('a', {})
+        yield collection.delete('a')
+        yield self.assertFailure(
+            collection.get_version('a'), CollectionObjectNotFound)
+
+    @inlineCallbacks
+    def test_get_version_recreated(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        v1 = yield collection.get_version('a')
+        yield collection.delete('a')
+        yield collection.create('a', {})
+        v2 = yield collection.get_version('a')
+        self.assertNotEqual(v1, v2)
+
+    @inlineCallbacks
+    def test_deleted_versions_forgotten(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {})
+        yield collection.delete('a')
+        self.assertEqual(collection._versions, {})
+
+    @inlineCallbacks
+    def test_get_with_version(self):
+        collection = InMemoryCollection()
+        yield collection.create('a', {'foo': 'bar'})
+        version = yield collection.get_version('a')
+        result = yield collection.get_with_version('a')
+        self.assertEqual(result, (version, {'id': 'a', 'foo': 'bar'}))
+        result = yield collection.get_with_version('a', fields=('foo',))
+        self.assertEqual(result, (version, {'foo': 'bar'}))
+        yield self.assertFailure(
+            collection.get_with_version('missing'), CollectionObjectNotFound)
+
+    @inlineCallbacks
+    def test_page_with_version(self):
+        collection = InMemoryCollection({'a': {'id': 'a'}, 'b': {'id': 'b'}})
+        version = yield collection.get_collection_version()
+        result = yield collection.page_with_version(None, 1, None)
+        self.assertEqual(result, (version, (1, [{'id': 'a'}])))
+        result = yield collection.page_with_version(
+            1, 1, None, fields=('missing',))
+        self.assertEqual(result, (version, (None, [{}])))
+
+    @inlineCallbacks
+    def test_with_version_uses_overridden_methods(self):
+        class UpperCollection(InMemoryCollection):
+            def get(self, object_id):
+                d = super(UpperCollection, self).get(object_id)
+                return d.addCallback(lambda data: {'id': data['id'].upper()})
+
+            def page(self, cursor, max_results, query, fields=None):
+                d = super(UpperCollection, self).page(
+                    cursor, max_results, query, fields)
+                return d.addCallback(lambda page: (page[0], []))
+
+        collection = UpperCollection({'a': {'id': 'a'}})
+        version, data = yield collection.get_with_version('a', ('id',))
+        self.assertEqual(data, {'id': 'A'})
+        version, page = yield collection.page_with_version(None, 1, None)
+        self.assertEqual(page, (None, []))
+
+    @inlineCallbacks
+    def test_get_version_different_instances(self):
+        data = {'a': {'id': 'a'}}
+        v1 = yield InMemoryCollection(data).get_version('a')
+        v2 = yield InMemoryCollection(data).get_version('a')
+        self.assertNotEqual(v1, v2)
+
+    @inlineCallbacks
+    def test_get_collection_version(self):
+        collection = InMemoryCollection()
+        versions = set()
+        v = yield collection.get_collection_version()
+        versions.add(v)
+        yield collection.create('a', {})
+        v = yield collection.get_collection_version()
+        versions.add(v)
+        yield collection.update('a', {'foo': 'bar'})
+        v = yield collection.get_collection_version()
+        versions.add(v)
+        yield collection.delete('a')
+        v = yield collection.get_collection_version()
+        versions.add(v)
+        self.assertEqual(len(versions), 4)
+
+        # Reads don't change the version.
+        yield collection.page(None, None, None)
+        v2 = yield collection.get_collection_version()
+        self.assertEqual(v2, v)
+
+    @inlineCallbacks
+    def test_rebuild_key_index_resets_versions(self):
+        collection = InMemoryCollection({'a': {'id': 'a'}})
+        v1 = yield collection.get_version('a')
+        c1 = yield collection.get_collection_version()
+        collection._rebuild_key_index()
+        v2 = yield collection.get_version('a')
+        c2 = yield collection.get_collection_version()
+        self.assertNotEqual(v1, v2)
+        self.assertNotEqual(c1, c2)
@@ -0,0 +1,203 @@
+"""
+Tests for the collection query language and secondary indexes.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from go_api.collections.errors import CollectionUsageError
+from go_api.collections.query import (
+    Condition, HashIndex, SortedIndex, fields_kwargs, get_field,
+    parse_fields, parse_query, project)
+from go_api.utils import simulate_async
+
+
+class TestParseQuery(TestCase):
+    def test_single_condition(self):
+        self.assertEqual(
+            parse_query(u'name="Jane"'), [Condition(u'name', u'=', u'Jane')])
+
+    def test_operators(self):
+        for op in [u'=', u'<', u'<=', u'>', u'>=']:
+            self.assertEqual(
+                parse_query(u'age %s 3' % (op,)), [Condition(u'age', op, 3)])
+        self.assertEqual(
+            parse_query(u'name^=J'), [Condition(u'name', u'^=', u'J')])
+
+    def test_multiple_conditions(self):
+        self.assertEqual(
+            parse_query(u'a=1 and b.c>=2.5 AND d="x y"'), [
+                Condition(u'a', u'=', 1),
+                Condition(u'b.c', u'>=', 2.5),
+                Condition(u'd', u'=', u'x y'),
+            ])
+
+    def test_values(self):
+        [c1, c2, c3, c4] = parse_query(
+            u'a=true and b=null and c=foo and d="1"')
+        self.assertEqual(c1.value, True)
+        self.assertEqual(c2.value, None)
+        self.assertEqual(c3.value, u'foo')
+        self.assertEqual(c4.value, u'1')
+
+    def test_invalid(self):
+        for query in [u'', u'q', u'a=1 b=2', u'a=1 or b=2', u'a=1 and',
+                      u'a="b', u'a<true', u'a^=1']:
+            self.assertRaises(CollectionUsageError, parse_query, query)
+
+
+class TestFields(TestCase):
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields(u'name'), (u'name',))
+        self.assertEqual(
+            parse_fields(u'b, a.c,b'), (u'b', u'a.c'))
+
+    def test_parse_fields_invalid(self):
+        for fields in [u'', u'a,', u'a..b', u'a b', u'1a']:
+            self.assertRaises(CollectionUsageError, parse_fields, fields)
+
+    def test_project(self):
+        row = {'id': 'a', 'name': 'Jane', 'address': {'city': 'Cape Town'}}
+        self.assertEqual(
+            project(row, ['name', 'address.city', 'missing', 'name.x']),
+            {'name': 'Jane', 'address': {'city': 'Cape Town'}})
+        self.assertEqual(project(row, []), {})
+        self.assertTrue(project(row, None) is row)
+
+    def test_project_containing_field(self):
+        row = {'address': {'city': 'Cape Town', 'code': '8001'}}
+        result = project(row, ['address.city', 'address'])
+        self.assertEqual(result, row)
+        self.assertTrue(result['address'] is row['address'])
+
+    def test_fields_kwargs(self):
+        class Collection(object):
+            def get(self, object_id, fields=None):
+                pass
+
+            def page(self, cursor, max_results, query, **kw):
+                pass
+
+            def stream(self, query):
+                pass
+
+        collection = Collection()
+        fields = ('name',)
+        self.assertEqual(
+            fields_kwargs(collection.get, fields), {'fields': fields})
+        self.assertEqual(
+            fields_kwargs(collection.page, fields), {'fields': fields})
+        self.assertEqual(fields_kwargs(collection.stream, fields), {})
+        self.assertEqual(fields_kwargs(collection.get, None), {})
+        # Callables that can't be inspected aren't given fields.
+        self.assertEqual(fields_kwargs(len, fields), {})
+
+    def test_fields_kwargs_wrapped(self):
+        class Collection(object):
+            @simulate_async
+            def get(self, object_id):
+                pass
+
+            @simulate_async
+            def page(self, cursor, max_results, query, fields=None):
+                pass
+
+            def stream(self, *args, **kw):
+                pass
+
+        collection = Collection()
+        fields = ('name',)
+        self.assertEqual(fields_kwargs(collection.get, fields), {})
+        self.assertEqual(
+            fields_kwargs(collection.page, fields), {'fields': fields})
+        # Wrappers that we can't see through aren't given fields.
+        self.assertEqual(fields_kwargs(collection.stream, fields), {})
+
+
+class TestCondition(TestCase):
+    def test_get_field(self):
+        self.assertEqual(get_field({'a': {'b': 1}}, 'a.b'), (True, 1))
+        self.assertEqual(get_field({'a': {'b': 1}}, 'a.c'), (False, None))
+        self.assertEqual(get_field({'a': 1}, 'a.b'), (False, None))
+
+    def test_matches(self):
+        row = {'name': 'Jane', 'age': 30, 'flag': True}
+        self.assertTrue(Condition('name', '=', u'Jane').matches(row))
+        self.assertTrue(Condition('name', '^=', u'Ja').matches(row))
+        self.assertTrue(Condition('age', '>', 29).matches(row))
+        self.assertTrue(Condition('age', '<=', 30).matches(row))
+        self.assertFalse(Condition('age', '<', 30).matches(row))
+        self.assertFalse(Condition('missing', '=', None).matches(row))
+
+    def test_matches_kinds(self):
+        row = {'age': '30', 'flag': True}
+        self.assertFalse(Condition('age', '=', 30).matches(row))
+        self.assertFalse(Condition('age', '<', 40).matches(row))
+        self.assertFalse(Condition('flag', '=', 1).matches(row))
+
+
+class TestHashIndex(TestCase):
+    def test_lookup(self):
+        index = HashIndex('name')
+        index.add('a', {'name': 'Jane'})
+        index.add('b', {'name': 'Jane'})
+        index.add('c', {'name': 'John'})
+        index.add('d', {})
+        self.assertEqual(
+            index.lookup(Condition('name', '=', u'Jane')), set(['a', 'b']))
+        self.assertEqual(index.lookup(Condition('name', '=', u'Bob')), set())
+
+    def test_lookup_kinds(self):
+        index = HashIndex('flag')
+        index.add('a', {'flag': True})
+        index.add('b', {'flag': 1})
+        self.assertEqual(index.lookup(Condition('flag', '=', True)),
+                         set(['a']))
+        self.assertEqual(index.lookup(Condition('flag', '=', 1)), set(['b']))
+
+    def test_remove(self):
+        index = HashIndex('name')
+        index.add('a', {'name': 'Jane'})
+        index.add('b', {'name': 'Jane'})
+        index.remove('a', {'name': 'Jane'})
+        index.remove('c', {'name': 'Jane'})
+        self.assertEqual(
+            index.lookup(Condition('name', '=', u'Jane')), set(['b']))
+
+
+class TestSortedIndex(TestCase):
+    def mk_index(self):
+        index = SortedIndex('v')
+        for object_id, v in [('a', 1), ('b', 2), ('c', 2), ('d', 3),
+                             ('e', 'ab'), ('f', 'abc'), ('g', 'b'),
+                             ('h', True), ('i', [1])]:
+            index.add(object_id, {'v': v})
+        return index
+
+    def assert_lookup(self, index, op, value, expected):
+        self.assertEqual(
+            index.lookup(Condition('v', op, value)), set(expected))
+
+    def test_equal(self):
+        index = self.mk_index()
+        self.assert_lookup(index, '=', 2, ['b', 'c'])
+        self.assert_lookup(index, '=', 'b', ['g'])
+        self.assert_lookup(index, '=', True, ['h'])
+
+    def test_ranges(self):
+        index = self.mk_index()
+        self.assert_lookup(index, '<', 2, ['a'])
+        self.assert_lookup(index, '<=', 2, ['a', 'b', 'c'])
+        self.assert_lookup(index, '>', 2, ['d'])
+        self.assert_lookup(index, '>=', 2, ['b', 'c', 'd'])
+        self.assert_lookup(index, '>', 'ab', ['f', 'g'])
+
+    def test_prefix(self):
+        index = self.mk_index()
+        self.assert_lookup(index, '^=', 'ab', ['e', 'f'])
+        self.assert_lookup(index, '^=', 'c', [])
+
+    def test_remove(self):
+        index = self.mk_index()
+        index.remove('b', {'v': 2})
+        index.remove('i', {'v': [1]})
+        self.assert_lookup(index, '=', 2, ['c'])
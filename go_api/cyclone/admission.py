@@ -0,0 +1,210 @@
+"""
+Per-owner rate limits and concurrency caps for API requests.
+"""
+
+import math
+
+from cyclone.web import HTTPError
+
+from ..cache import LRUCache
+
+
+class TooManyRequests(HTTPError):
+    """
+    An :class:`HTTPError` for a request that was refused because its owner
+    is over a limit. It becomes a ``429 Too Many Requests`` response with a
+    ``Retry-After`` header.
+
+    :param float retry_after:
+        The number of seconds the client should wait before trying again.
+    :param str reason:
+        Which limit was exceeded.
+    """
+
+    def __init__(self, retry_after, reason):
+        HTTPError.__init__(self, 429, reason=reason)
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        """
+        Return the value of the ``Retry-After`` header, a whole number of
+        seconds.
+        """
+        return str(max(1, int(math.ceil(self.retry_after))))
+
+
+class TokenBucket(object):
+    """
+    A token bucket that holds up to ``burst`` tokens and gains ``rate``
+    tokens per second. It starts full.
+
+    :param float rate:
+        Tokens added per second.
+    :param float burst:
+        The maximum number of tokens.
+    :param float now:
+        The current time, in seconds.
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """
+        Take a token if there is one. Returns ``0`` if a token was taken,
+        otherwise the number of seconds until there will be one.
+        """
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def time_to_full(self):
+        """
+        Return the number of seconds until the bucket is full again.
+        """
+        return (self.burst - self.tokens) / self.rate
+
+
+class OwnerLimiter(object):
+    """
+    Enforces per-owner limits on the rate of requests, the number of
+    requests in flight and the number of open streams.
+
+    Each limit is ``None`` for no limit. ``owners`` maps owner ids to dicts
+    that override any of the limits for that owner.
+
+    :param float rate:
+        The number of requests per second each owner may make, on average.
+    :param float burst:
+        The number of requests each owner may make at once, after making
+        none for a while. Defaults to ``rate``, or ``1`` if that is smaller.
+    :param int max_concurrent:
+        The number of requests each owner may have in flight at once,
+        including streams.
+    :param int max_streams:
+        The number of streaming requests each owner may have in flight at
+        once.
+    :param dict owners:
+        Limits for particular owners.
+    :param float retry_after:
+        The number of seconds that clients refused because of a concurrency
+        limit are asked to wait.
+    :param int max_owners:
+        The number of owners to keep rate limit state for. Owners that
+        haven't made a request for the longest are forgotten first.
+    :param clock:
+        An object with a ``seconds()`` method, such as the reactor or a
+        :class:`twisted.internet.task.Clock`. Defaults to the reactor.
+    """
+
+    LIMITS = ('rate', 'burst', 'max_concurrent', 'max_streams')
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None,
+                 max_streams=None, owners=None, retry_after=1,
+                 max_owners=10000, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.defaults = {
+            'rate': rate,
+            'burst': burst,
+            'max_concurrent': max_concurrent,
+            'max_streams': max_streams,
+        }
+        self.owners = {}
+        for owner, limits in (owners or {}).iteritems():
+            unknown = set(limits) - set(self.LIMITS)
+            if unknown:
+                raise ValueError("Unknown limits for owner %r: %s" % (
+                    owner, ", ".join(sorted(unknown))))
+            self.owners[owner] = limits
+        for limits in [self.defaults] + self.owners.values():
+            if limits.get('rate') is not None and limits['rate'] <= 0:
+                raise ValueError("rate must be positive")
+        self.retry_after = retry_after
+        # Buckets expire once they would be full again, because a missing
+        # bucket is the same as a full one.
+        self.buckets = LRUCache(max_owners, clock=clock)
+        self.in_flight = {}
+        self.streams = {}
+
+    @classmethod
+    def from_config(cls, config, clock=None):
+        """
+        Build a limiter from a config dict with the same keys as this
+        class's parameters.
+        """
+        try:
+            return cls(clock=clock, **config)
+        except TypeError as e:
+            raise ValueError("Invalid owner_limits config: %s" % (e,))
+
+    def limits_for(self, owner):
+        """
+        Return a dict of the limits that apply to ``owner``.
+        """
+        limits = dict(self.defaults)
+        limits.update(self.owners.get(owner, {}))
+        if limits['rate'] is not None and limits['burst'] is None:
+            limits['burst'] = max(1, limits['rate'])
+        return limits
+
+    def _take_token(self, owner, rate, burst):
+        now = self.clock.seconds()
+        bucket = self.buckets.get(owner)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, now)
+        wait = bucket.take(now)
+        self.buckets.set(owner, bucket, ttl=bucket.time_to_full())
+        return wait
+
+    def admit(self, owner, stream=False):
+        """
+        Admit a request from ``owner``, or raise :class:`TooManyRequests`
+        if it would exceed one of the owner's limits.
+
+        :param bool stream:
+            Whether the request is a streaming request.
+
+        :return:
+            A function to call when the request has finished.
+        """
+        limits = self.limits_for(owner)
+        max_concurrent = limits['max_concurrent']
+        if (max_concurrent is not None and
+                self.in_flight.get(owner, 0) >= max_concurrent):
+            raise TooManyRequests(
+                self.retry_after, "Too many concurrent requests")
+        max_streams = limits['max_streams']
+        if (stream and max_streams is not None and
+                self.streams.get(owner, 0) >= max_streams):
+            raise TooManyRequests(self.retry_after, "Too many open streams")
+        if limits['rate'] is not None:
+            wait = self._take_token(owner, limits['rate'], limits['burst'])
+            if wait:
+                raise TooManyRequests(wait, "Rate limit exceeded")
+
+        counters = [self.in_flight]
+        if stream:
+            counters.append(self.streams)
+        for counter in counters:
+            counter[owner] = counter.get(owner, 0) + 1
+
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            for counter in counters:
+                counter[owner] -= 1
+                if not counter[owner]:
+                    del counter[owner]
+        return release
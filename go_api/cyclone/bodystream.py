@@ -0,0 +1,234 @@
+"""
+Request bodies that are passed to cyclone handlers as they arrive.
+"""
+
+from collections import deque
+
+from cyclone.httpserver import HTTPConnection
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.python.failure import Failure
+
+
+class RequestBodyLost(Exception):
+    """
+    Raised when the connection is lost before the whole request body has
+    arrived.
+    """
+
+
+class RequestBodyStream(object):
+    """
+    The body of a request, split into lines as it arrives.
+
+    Once more than ``buffer_size`` bytes are waiting to be read, reading from
+    the transport is paused until :meth:`get_lines` has taken enough of them.
+    Lines longer than ``max_line_length`` bytes are not kept, so memory use
+    is bounded however large the body is. They are returned as ``None``.
+
+    :param transport:
+        The transport the body arrives on, or ``None``.
+    :param int buffer_size:
+        The number of bytes to buffer before pausing the transport.
+    :param int max_line_length:
+        The length, in bytes, of the longest line to return.
+    """
+
+    def __init__(self, transport=None, buffer_size=64 * 1024,
+                 max_line_length=1024 * 1024):
+        self.transport = transport
+        self.buffer_size = buffer_size
+        self.max_line_length = max_line_length
+        self.lines = deque()
+        self.finished = False
+        self.paused = False
+        self.discarded = False
+        self._line_bytes = 0
+        self._partial = []
+        self._partial_bytes = 0
+        self._overlong = False
+        self._waiting = None
+        self._failure = None
+
+    @classmethod
+    def from_body(cls, body, **kw):
+        """
+        Return a finished stream containing ``body``.
+        """
+        stream = cls(**kw)
+        stream.data_received(body)
+        stream.finish()
+        return stream
+
+    @property
+    def buffered(self):
+        """
+        The number of bytes waiting to be read.
+        """
+        return self._line_bytes + self._partial_bytes
+
+    @property
+    def pending(self):
+        """
+        The number of complete lines waiting to be read.
+        """
+        return len(self.lines)
+
+    def _add_partial(self, data):
+        if self._overlong or not data:
+            return
+        if self._partial_bytes + len(data) > self.max_line_length:
+            self._overlong = True
+            self._partial = []
+            self._partial_bytes = 0
+            return
+        self._partial.append(data)
+        self._partial_bytes += len(data)
+
+    def _end_line(self):
+        if self._overlong:
+            self._overlong = False
+            self.lines.append(None)
+            return
+        line = "".join(self._partial)
+        self._partial = []
+        self._partial_bytes = 0
+        self._line_bytes += len(line)
+        self.lines.append(line)
+
+    def data_received(self, data):
+        """
+        Add data from the request body.
+        """
+        if self.discarded:
+            return
+        parts = data.split("\n")
+        for part in parts[:-1]:
+            self._add_partial(part)
+            self._end_line()
+        self._add_partial(parts[-1])
+        if (not self.paused and self.transport is not None and
+                self.buffered >= self.buffer_size):
+            self.paused = True
+            self.transport.pauseProducing()
+        self._fire_waiting()
+
+    def finish(self):
+        """
+        Mark the body as complete. Anything after the last newline is the
+        last line.
+        """
+        if self._partial or self._overlong:
+            self._end_line()
+        self.finished = True
+        self._fire_waiting()
+
+    def fail(self, reason):
+        """
+        Mark the body as incomplete because the connection was lost.
+        """
+        self._failure = Failure(RequestBodyLost(reason.getErrorMessage()))
+        self._fire_waiting()
+
+    def discard(self):
+        """
+        Throw away the rest of the body, e.g. because the request finished
+        without reading it.
+        """
+        self.discarded = True
+        self.lines.clear()
+        self._line_bytes = 0
+        self._partial = []
+        self._partial_bytes = 0
+        self._resume()
+
+    def _resume(self):
+        if self.paused and self.buffered < self.buffer_size:
+            self.paused = False
+            self.transport.resumeProducing()
+
+    def _fire_waiting(self):
+        if self._waiting is None:
+            return
+        if self.lines or self.finished or self._failure is not None:
+            d, count = self._waiting
+            self._waiting = None
+            self.get_lines(count).chainDeferred(d)
+
+    def get_lines(self, count):
+        """
+        Return a deferred that fires with a list of up to ``count`` lines,
+        without their newlines, or an empty list once the body has been
+        read. It fails with :class:`RequestBodyLost` if the connection is
+        lost first.
+        """
+        if self._waiting is not None:
+            raise RuntimeError("Already waiting for lines")
+        if self.lines:
+            lines = self.lines
+            lines = [lines.popleft() for _ in xrange(min(count, len(lines)))]
+            self._line_bytes -= sum(len(line) for line in lines if line)
+            self._resume()
+            return succeed(lines)
+        if self._failure is not None:
+            return fail(self._failure)
+        if self.finished:
+            return succeed([])
+        d = Deferred()
+        self._waiting = (d, count)
+        return d
+
+
+class StreamingHTTPConnection(HTTPConnection):
+    """
+    An HTTP connection that passes request bodies to handlers as they
+    arrive, instead of waiting for the whole body.
+
+    If the factory has a ``streams_request_body`` method and it returns
+    ``True`` for a request with a body, the request is handled as soon as
+    its headers arrive. Its ``body`` is empty and its ``body_stream`` is a
+    :class:`RequestBodyStream` that the body is fed into. Other requests are
+    handled as usual.
+    """
+
+    _body_stream = None
+
+    def _on_headers(self, data):
+        HTTPConnection._on_headers(self, data)
+        request = self._request
+        if self._contentbuffer is None or request is None:
+            return
+        streams_request_body = getattr(
+            self.factory, 'streams_request_body', None)
+        if streams_request_body is None or not streams_request_body(request):
+            return
+        self._contentbuffer.close()
+        self._contentbuffer = None
+        self._body_stream = RequestBodyStream(self.transport)
+        request.body = ""
+        request.body_stream = self._body_stream
+        self.request_callback(request)
+
+    def rawDataReceived(self, data):
+        stream = self._body_stream
+        if stream is None:
+            return HTTPConnection.rawDataReceived(self, data)
+        data, rest = data[:self.content_length], data[self.content_length:]
+        self.content_length -= len(data)
+        stream.data_received(data)
+        if self.content_length == 0:
+            self._body_stream = self.content_length = None
+            stream.finish()
+            self.setLineMode(rest)
+
+    def _finish_request(self):
+        if self._body_stream is not None:
+            # Nobody is going to read the rest of the body, so don't let it
+            # pause the connection.
+            self._body_stream.discard()
+        HTTPConnection._finish_request(self)
+
+    def connectionLost(self, reason):
+        if self._body_stream is not None:
+            stream, self._body_stream = self._body_stream, None
+            stream.fail(reason)
+        HTTPConnection.connectionLost(self, reason)
@@ -0,0 +1,145 @@
+"""
+Negotiated gzip and deflate compression for cyclone responses.
+"""
+
+import zlib
+
+from cyclone.web import OutputTransform
+
+
+# Supported content codings, in order of preference, with the zlib window
+# bits that produce them.
+ENCODINGS = (
+    ("gzip", 16 + zlib.MAX_WBITS),
+    ("deflate", zlib.MAX_WBITS),
+)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Choose a content coding from an ``Accept-Encoding`` header value.
+
+    :param str accept_encoding:
+        The header value, e.g. ``"gzip;q=0.8, deflate"``.
+
+    :return:
+        ``"gzip"``, ``"deflate"`` or ``None`` if the response shouldn't be
+        compressed.
+    """
+    qvalues = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name] = q
+
+    best_q, best_encoding = 0.0, None
+    for encoding, _ in ENCODINGS:
+        q = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best_q, best_encoding = q, encoding
+    return best_encoding
+
+
+class CompressionTransform(OutputTransform):
+    """
+    An output transform that compresses responses with gzip or deflate,
+    depending on the request's ``Accept-Encoding`` header.
+
+    Responses that are finished in one go are only compressed if they are at
+    least :attr:`min_size` bytes long. Responses that are flushed in parts,
+    such as streams, are always compressed. Each flush ends with a zlib sync
+    flush, so that everything written so far can be decompressed by the
+    client straight away.
+
+    Strong ETags on compressed responses are made weak, since the
+    compressed body differs from the uncompressed one.
+
+    Use :func:`compression_transform` to set the minimum size and
+    compression level.
+    """
+
+    CONTENT_TYPES = frozenset([
+        "application/json", "application/x-ndjson", "text/plain"])
+
+    min_size = 1024
+    level = 6
+
+    def __init__(self, request):
+        self._encoding = None
+        self._compressor = None
+        if request.supports_http_1_1():
+            self._encoding = negotiate_encoding(
+                request.headers.get("Accept-Encoding", ""))
+
+    def _should_compress(self, status_code, headers, chunk, finishing):
+        if self._encoding is None or status_code in (204, 304):
+            return False
+        if "Content-Encoding" in headers:
+            return False
+        if finishing:
+            return len(chunk) >= self.min_size
+        # We can't change the length of a response that has already
+        # promised one.
+        return "Content-Length" not in headers
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        ctype = headers.get("Content-Type", "").split(";")[0].strip()
+        if ctype not in self.CONTENT_TYPES:
+            return status_code, headers, chunk
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+        if not self._should_compress(status_code, headers, chunk, finishing):
+            return status_code, headers, chunk
+
+        headers["Content-Encoding"] = self._encoding
+        etag = headers.get("Etag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["Etag"] = "W/" + etag
+        self._compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, dict(ENCODINGS)[self._encoding])
+        chunk = self.transform_chunk(chunk, finishing)
+        if "Content-Length" in headers:
+            headers["Content-Length"] = str(len(chunk))
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._compressor is None:
+            return chunk
+        if finishing:
+            return self._compressor.compress(chunk) + self._compressor.flush()
+        if not chunk:
+            # A sync flush without new data would send an empty block.
+            return chunk
+        return (self._compressor.compress(chunk) +
+                self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def compression_transform(min_size=CompressionTransform.min_size,
+                          level=CompressionTransform.level):
+    """
+    Return a :class:`CompressionTransform` subclass with the given settings,
+    suitable for adding to a cyclone application's transforms.
+
+    :param int min_size:
+        The smallest response body, in bytes, to compress.
+    :param int level:
+        The zlib compression level, from 1 (fastest) to 9 (smallest).
+    """
+    if not 1 <= level <= 9:
+        raise ValueError("Compression level must be between 1 and 9")
+    return type("CompressionTransform", (CompressionTransform,), {
+        "min_size": min_size,
+        "level": level,
+    })
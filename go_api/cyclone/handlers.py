@@ -1,21 +1,46 @@
 """ Base handlers for constructing APIs handlers from.
 """
 
+import hashlib
 import json
+import time
 import traceback
+from collections import deque
 
 import treq
 import yaml
 
-from twisted.internet.defer import inlineCallbacks, maybeDeferred, returnValue
+from twisted.internet.defer import (
+    CancelledError, Deferred, DeferredList, DeferredSemaphore, FirstError,
+    gatherResults, inlineCallbacks, maybeDeferred, returnValue, succeed)
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.threads import deferToThreadPool
 from twisted.python import log
-
-from cyclone.web import RequestHandler, Application, URLSpec, HTTPError
-
+from twisted.python.threadpool import ThreadPool
+from twisted.web.client import HTTPConnectionPool
+from zope.interface import implementer
+
+from cyclone.web import (
+    RequestHandler, Application, URLSpec, HTTPError, ErrorHandler,
+    RedirectHandler)
+
+from .admission import OwnerLimiter, TooManyRequests
+from .bodystream import (
+    RequestBodyLost, RequestBodyStream, StreamingHTTPConnection)
+from .compression import compression_transform
+from .metrics import MetricsRegistry
+from .router import ROUTE_VAR_RE, RouteTrie, match_args
+from ..cache import LRUCache
 from ..collections.errors import CollectionObjectNotFound, CollectionUsageError
+from ..collections.query import fields_kwargs, parse_fields, project
+from ..jsoncodec import default_json_codec, get_json_codec
 from ..queue.pausingdeferredqueue import PausingQueueCloseMarker
 
 
+# Stands in for a route or host group that hasn't been looked up yet.
+_UNMATCHED = object()
+
+
 class RouteParseError(Exception):
     "Raised when an erroneous route is parsed"
 
@@ -59,6 +84,33 @@ def parse_route_vars(dfn):
     return [p.lstrip(":") for p in dfn.split("/") if p.startswith(":")]
 
 
+def _timed_call(f, *args, **kw):
+    """
+    Call ``f`` and return its result along with the time it took, in
+    seconds.
+    """
+    start = time.time()
+    result = f(*args, **kw)
+    return result, time.time() - start
+
+
+def _version_and_data(get_version, get_data):
+    """
+    Call ``get_version`` and then ``get_data`` without waiting for the
+    version, and return a deferred that fires with ``(version, data)``. If
+    either call fails, the deferred fails with the first error.
+    """
+    def unwrap(failure):
+        failure.trap(FirstError)
+        return failure.value.subFailure
+
+    d = gatherResults(
+        [maybeDeferred(get_version), maybeDeferred(get_data)],
+        consumeErrors=True)
+    d.addCallbacks(tuple, unwrap)
+    return d
+
+
 def create_urlspec_regex(dfn):
     """
     Create a URLSpec regex from a friendlier definition.
@@ -96,6 +148,46 @@ class HealthHandler(RequestHandler):
         self.write("OK")
 
 
+@implementer(IPushProducer)
+class StreamProducer(object):
+    """
+    A push producer that a streaming handler registers with its transport
+    so that it can stop writing while the transport's buffers are full.
+    """
+
+    def __init__(self):
+        self.paused = False
+        self.stopped = False
+        self._resume_d = None
+
+    def wait_for_resume(self):
+        """
+        Return a deferred that fires when the transport is ready for more
+        data, or has been closed.
+        """
+        if not self.paused or self.stopped:
+            return succeed(None)
+        if self._resume_d is None:
+            self._resume_d = Deferred()
+        return self._resume_d
+
+    def _fire_resume(self):
+        if self._resume_d is not None:
+            d, self._resume_d = self._resume_d, None
+            d.callback(None)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self._fire_resume()
+
+    def stopProducing(self):
+        self.stopped = True
+        self._fire_resume()
+
+
 class BaseHandler(RequestHandler):
     """
     Base class for utility methods for :class:`CollectionHandler`
@@ -104,9 +196,38 @@ class BaseHandler(RequestHandler):
 
     model_alias = None
     route_suffix = ""
+    # Set this to ``True`` to handle requests as soon as their headers
+    # arrive, with the body available from ``request.body_stream`` as a
+    # :class:`RequestBodyStream`, when the application supports it.
+    stream_request_body = False
+
+    # The maximum number of objects to take from a stream's queue at once.
+    stream_batch_size = 100
+    # The number of bytes of a stream to buffer before flushing them to the
+    # transport. May be overridden by the ``stream_flush_size`` application
+    # setting.
+    stream_flush_size = 16 * 1024
+    # Pages with at least this many objects are serialized in the
+    # ``serialization_pool`` thread pool, if the application has one. May be
+    # overridden by the ``serialization_threshold`` application setting.
+    serialization_threshold = 1000
+    # The number of seconds a request may take before whatever it is waiting
+    # for is cancelled and it gets a ``504 Gateway Timeout`` response, or
+    # ``None`` for no deadline. May be overridden by the ``request_timeout``
+    # application setting, which may in turn be overridden for a route. See
+    # :meth:`time_remaining`.
+    request_timeout = None
+
+    # The time spent in each phase of handling the request, in seconds,
+    # keyed by phase name. See :meth:`add_timing`.
+    timings = None
+
+    # The queue that :meth:`write_queue` is reading from, if any.
+    _stream_queue = None
 
     @classmethod
-    def mk_urlspec(cls, dfn, model_factory, path_prefix=""):
+    def mk_urlspec(cls, dfn, model_factory, path_prefix="",
+                   request_timeout=None):
         """
         Constructs a :class:`URLSpec` from a path definition and
         a model factory. The returned :class:`URLSpec` routes
@@ -124,25 +245,173 @@ class BaseHandler(RequestHandler):
             called during ``RequestHandler.prepare``.
         :param str path_prefix:
             A prefix to add to the path ``dfn``. Defaults to ``""``.
+        :param float request_timeout:
+            The deadline for requests to this route, in seconds. Defaults to
+            the ``request_timeout`` application setting.
         """
         dfn = join_paths(path_prefix, dfn, cls.route_suffix)
+        kwargs = {"model_factory": model_factory}
+        if request_timeout is not None:
+            kwargs["request_timeout"] = request_timeout
 
-        return URLSpec(create_urlspec_regex(dfn), cls,
-                       kwargs={"model_factory": model_factory})
+        return URLSpec(create_urlspec_regex(dfn), cls, kwargs=kwargs)
 
-    def initialize(self, model_factory):
+    def initialize(self, model_factory, request_timeout=None):
         self.model_factory = model_factory
+        self._release_admission = None
+        if request_timeout is None:
+            request_timeout = self.settings.get(
+                'request_timeout', self.request_timeout)
+        self.deadline = None
+        if request_timeout is not None:
+            self.deadline = time.time() + request_timeout
+        self.deadline_expired = False
+        self._deadline_call = None
+        self._cancel_at_deadline = set()
 
     @inlineCallbacks
     def prepare(self):
         for path_var in parse_route_vars(self.route_suffix):
             setattr(self, path_var, self.path_kwargs[path_var].encode('utf-8'))
 
-        self.model = yield self.model_factory(self)
+        self.start_deadline()
+        start = time.time()
+        try:
+            self.model = yield self.cancel_at_deadline(
+                maybeDeferred(self.model_factory, self))
+        finally:
+            self.add_timing('model_factory', time.time() - start)
 
         if self.model_alias is not None:
             setattr(self, self.model_alias, self.model)
 
+    def is_stream_request(self):
+        """
+        Return ``True`` if this request streams its response or its body,
+        and so counts towards per-owner stream limits.
+        """
+        return False
+
+    def admit(self, limiter, owner):
+        """
+        Admit this request for ``owner`` under the limits of an
+        :class:`OwnerLimiter`, or raise :class:`TooManyRequests`. The
+        request counts towards the owner's concurrency limits until it
+        finishes.
+        """
+        self._release_admission = limiter.admit(
+            owner, stream=self.is_stream_request())
+
+    def start_deadline(self):
+        """
+        Start waiting for the request's deadline, if it has one.
+        """
+        if self.deadline is None or self._deadline_call is not None:
+            return
+        from twisted.internet import reactor
+        self._deadline_call = reactor.callLater(
+            self.time_remaining(), self._expire_deadline)
+
+    def clear_deadline(self):
+        """
+        Stop waiting for the request's deadline, e.g. because a streaming
+        response has started and may legitimately take longer.
+        """
+        if self._deadline_call is not None and self._deadline_call.active():
+            self._deadline_call.cancel()
+        self._deadline_call = None
+        self.deadline = None
+        self._cancel_at_deadline.clear()
+
+    def time_remaining(self):
+        """
+        Return the number of seconds left until the request's deadline, or
+        ``None`` if it has no deadline. Model factories and collections may
+        use this to limit the time they spend on the request.
+        """
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.time())
+
+    def cancel_at_deadline(self, d):
+        """
+        Cancel the deferred ``d`` if it hasn't fired by the request's
+        deadline. Returns ``d``.
+        """
+        if self.deadline is None or d.called:
+            return d
+        self._cancel_at_deadline.add(d)
+
+        def done(result):
+            self._cancel_at_deadline.discard(d)
+            return result
+        return d.addBoth(done)
+
+    def _expire_deadline(self):
+        self._deadline_call = None
+        if self._finished:
+            return
+        self.deadline_expired = True
+        pending, self._cancel_at_deadline = self._cancel_at_deadline, set()
+        for d in pending:
+            d.cancel()
+
+    def on_connection_close(self, *args, **kw):
+        """
+        Cancel the queue that a streaming response is being read from, if
+        any, so that whatever is filling it stops when the client goes
+        away.
+        """
+        q, self._stream_queue = self._stream_queue, None
+        if q is not None:
+            q.cancel()
+
+    def on_finish(self):
+        if self._release_admission is not None:
+            self._release_admission()
+        self.clear_deadline()
+
+    def _handle_request_exception(self, e):
+        value = getattr(e, 'value', e)
+        if self.deadline_expired and not isinstance(value, HTTPError):
+            # Whatever was cancelled at the deadline may fail with something
+            # other than a CancelledError, e.g. an HTTP client error.
+            e = value = HTTPError(504, reason="Request deadline exceeded")
+        # Cyclone turns status codes that httplib doesn't know about, like
+        # 429, into 500s.
+        if isinstance(value, TooManyRequests):
+            self.send_error(
+                value.status_code, exc_info=(type(value), value, None))
+            return
+        RequestHandler._handle_request_exception(self, e)
+
+    def add_timing(self, phase, seconds):
+        """
+        Add to the time spent in a phase of handling the request. The
+        application records these timings when the request finishes.
+
+        :param str phase:
+            The name of the phase, e.g. ``'collection'``.
+        :param float seconds:
+            The time spent, in seconds.
+        """
+        if self.timings is None:
+            self.timings = {}
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def timed(self, phase, f, *args, **kw):
+        """
+        Call ``f(*args, **kw)`` and return a deferred that fires with its
+        result. The time until the deferred fires is added to ``phase``.
+        """
+        start = time.time()
+        d = self.cancel_at_deadline(maybeDeferred(f, *args, **kw))
+
+        def record(result):
+            self.add_timing(phase, time.time() - start)
+            return result
+        return d.addBoth(record)
+
     def raise_err(self, failure, status_code, reason):
         """
         Catch any error, log the failure and raise a suitable
@@ -159,6 +428,10 @@ class BaseHandler(RequestHandler):
         if failure.check(HTTPError):
             # re-raise any existing HTTPErrors
             failure.raiseException()
+        if self.deadline_expired:
+            # This is most likely the result of cancelling a call at the
+            # deadline, and becomes a 504 in _handle_request_exception.
+            failure.raiseException()
         log.err(failure)
         raise HTTPError(status_code, reason=reason)
 
@@ -180,6 +453,74 @@ class BaseHandler(RequestHandler):
             failure.raiseException()
         raise HTTPError(status_code, reason=str(failure.value))
 
+    @property
+    def json_codec(self):
+        """
+        The :class:`JsonCodec` used to encode responses and decode request
+        bodies. This is the ``json_codec`` application setting if there is
+        one, otherwise the standard library codec.
+        """
+        codec = self.settings.get('json_codec')
+        if codec is None:
+            codec = default_json_codec()
+        return codec
+
+    def _get_transport(self):
+        connection = getattr(self.request, 'connection', None)
+        return getattr(connection, 'transport', None)
+
+    def start_stream(self):
+        """
+        Prepare to write a streaming response.
+
+        Registers a :class:`StreamProducer` with the transport, so that
+        :meth:`write_stream_chunk` and :meth:`wait_for_transport` can
+        respect backpressure. :meth:`end_stream` must be called when the
+        stream is done. The request's deadline no longer applies once the
+        stream has started.
+        """
+        self.clear_deadline()
+        self._stream_buffered = 0
+        self._stream_producer = StreamProducer()
+        transport = self._get_transport()
+        if transport is not None:
+            transport.registerProducer(self._stream_producer, True)
+
+    def end_stream(self):
+        """
+        Unregister the stream producer. Any data that is still buffered is
+        sent when the request finishes.
+        """
+        transport = self._get_transport()
+        if transport is not None:
+            transport.unregisterProducer()
+
+    def flush_stream(self):
+        """
+        Flush buffered stream data to the transport.
+        """
+        self._stream_buffered = 0
+        self.flush()
+
+    def write_stream_chunk(self, chunk):
+        """
+        Write part of a streaming response, flushing it once enough data has
+        been buffered.
+        """
+        self.write(chunk)
+        self._stream_buffered += len(chunk)
+        flush_size = self.settings.get(
+            'stream_flush_size', self.stream_flush_size)
+        if self._stream_buffered >= flush_size:
+            self.flush_stream()
+
+    def wait_for_transport(self):
+        """
+        Return a deferred that fires once the transport is ready for more
+        data, or the connection has been closed.
+        """
+        return self._stream_producer.wait_for_resume()
+
     def write_error(self, status_code, **kw):
         """
         Overrides :class:`RequestHandler`'s ``.write_error`` to format
@@ -189,23 +530,158 @@ class BaseHandler(RequestHandler):
             "status_code": status_code,
             "reason": str(kw.get("exception", self._reason)),
         }
+        exc_info = kw.get("exc_info")
+        if exc_info is not None and isinstance(exc_info[1], TooManyRequests):
+            self.set_header("Retry-After", exc_info[1].retry_after_header())
         if self.settings.get("debug") and "exc_info" in kw:
             # in debug mode, try to send a traceback
             error_data["traceback"] = traceback.format_exception(
                 *kw["exc_info"])
 
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        self.finish(json.dumps(error_data))
+        self.finish(self.json_codec.dumps(error_data))
 
-    def write_object(self, obj):
+    def version_etag(self, version, fields=None, page_args=None):
+        """
+        Return a strong ETag for a collection or object version. Responses
+        that only contain some ``fields`` of the data get a different ETag
+        for each set of fields, and pages of a collection get a different
+        ETag for each ``(cursor, max_results, query)`` in ``page_args``.
+        """
+        tag = str(version)
+        if fields is not None:
+            tag += "\0" + ",".join(sorted(fields))
+        if page_args is not None:
+            tag += "\0" + json.dumps(list(page_args))
+        return '"%s"' % (hashlib.sha1(tag).hexdigest(),)
+
+    def etag_matches(self, etag):
+        """
+        Return ``True`` if the request's ``If-None-Match`` header matches
+        ``etag``.
+        """
+        header = self.request.headers.get("If-None-Match")
+        if not header:
+            return False
+        for tag in header.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                # If-None-Match uses weak comparison.
+                tag = tag[2:]
+            if tag == "*" or tag == etag:
+                return True
+        return False
+
+    @inlineCallbacks
+    def write_versioned(self, get_version, get_data, write, fields=None,
+                        get_with_version=None, page_args=None):
+        """
+        Write data with an ETag built from its version. If the client
+        already has the current version, respond with ``304 Not Modified``
+        without fetching or serializing the data.
+
+        The version is only looked up on its own for ``If-None-Match``
+        requests. Otherwise it is fetched along with the data, with a single
+        call to ``get_with_version`` if there is one. If not, ``get_version``
+        and ``get_data`` are called without waiting for each other. In
+        either case the version is never looked up after the data, so the
+        ETag may be for an older version than the data, but never a newer
+        one. A client with an out of date ETag just gets the data again.
+
+        :param func get_version:
+            A function that returns the current version, or a deferred that
+            fires with it.
+        :param func get_data:
+            A function that returns the data, or a deferred that fires with
+            it.
+        :param func write:
+            A function that writes the data out. It may return a deferred.
+        :param tuple fields:
+            The fields that will be written, if not all of them.
+        :param func get_with_version:
+            A function that returns a ``(version, data)`` tuple, or a
+            deferred that fires with it.
+        :param tuple page_args:
+            The ``(cursor, max_results, query)`` of the page being written,
+            if the data is a page of a collection.
+        """
+        if self.request.headers.get("If-None-Match"):
+            version = yield self.timed('collection', get_version)
+            etag = self.version_etag(version, fields, page_args)
+            if self.etag_matches(etag):
+                self.set_header("Etag", etag)
+                self.set_status(304)
+                return
+            if get_with_version is None:
+                # We already have a version from before the data.
+                data = yield self.timed('collection', get_data)
+            else:
+                version, data = yield self.timed(
+                    'collection', get_with_version)
+        elif get_with_version is None:
+            version, data = yield self.timed(
+                'collection', _version_and_data, get_version, get_data)
+        else:
+            version, data = yield self.timed('collection', get_with_version)
+        self.set_header(
+            "Etag", self.version_etag(version, fields, page_args))
+        yield write(data)
+
+    def encode_json(self, obj):
+        """
+        Encode an object as JSON, adding the time taken to the
+        ``'serialization'`` phase.
+        """
+        start = time.time()
+        data = self.json_codec.dumps(obj)
+        self.add_timing('serialization', time.time() - start)
+        return data
+
+    @inlineCallbacks
+    def encode_json_in_thread(self, obj):
+        """
+        Encode an object as JSON in the ``serialization_pool`` thread pool
+        and return a deferred that fires with the result on the reactor
+        thread. ``obj`` must not be modified until the deferred fires.
+
+        The time spent encoding is added to the ``'serialization'`` phase,
+        and the time from submitting the work to getting the result back
+        (including any time spent waiting for a free thread) is added to the
+        ``'threaded_serialization'`` phase.
+        """
+        from twisted.internet import reactor
+        start = time.time()
+        data, seconds = yield deferToThreadPool(
+            reactor, self.settings['serialization_pool'], _timed_call,
+            self.json_codec.dumps, obj)
+        self.add_timing('serialization', seconds)
+        self.add_timing('threaded_serialization', time.time() - start)
+        returnValue(data)
+
+    def get_fields(self):
+        """
+        Return the field names requested with the ``fields`` argument as a
+        tuple, or ``None`` if no fields were requested.
+        """
+        fields = self.get_argument('fields', default=None)
+        if fields is None:
+            return None
+        try:
+            return parse_fields(fields)
+        except CollectionUsageError as e:
+            raise HTTPError(400, reason=str(e))
+
+    def write_object(self, obj, fields=None):
         """
         Write a serializable object out as JSON.
 
         :param dict obj:
             JSON serializable object to write out.
+        :param tuple fields:
+            If not ``None``, only these fields of the object are written.
         """
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        self.write(json.dumps(obj))
+        self.write(self.encode_json(project(obj, fields)))
 
     @inlineCallbacks
     def write_objects(self, objs):
@@ -216,14 +692,18 @@ class BaseHandler(RequestHandler):
             List of dictionaries to write out.
         """
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        for obj_deferred in objs:
-            obj = yield obj_deferred
-            if obj is None:
-                continue
-            self.write(json.dumps(obj))
-            self.write("\n")
-
-    def write_page(self, result):
+        self.start_stream()
+        try:
+            for obj_deferred in objs:
+                yield self.wait_for_transport()
+                obj = yield obj_deferred
+                if obj is None:
+                    continue
+                self.write_stream_chunk(self.encode_json(obj) + "\n")
+        finally:
+            self.end_stream()
+
+    def write_page(self, result, fields=None):
         """
         Write out a list of serializable objects into one page with a pointer
         to the next page.
@@ -232,30 +712,105 @@ class BaseHandler(RequestHandler):
             Pointer to set to get the next page
         :param list result[1]:
             List of dictionaries to write out.
+        :param tuple fields:
+            If not ``None``, only these fields of each object are written.
+
+        Pages with at least :attr:`serialization_threshold` objects are
+        serialized in the application's ``serialization_pool`` thread pool,
+        if it has one, so that they don't hold up other requests. A deferred
+        that fires once the page is written is returned in that case.
         """
         cursor, data = result
+        if fields is not None:
+            data = [project(obj, fields) for obj in data]
         page = {
             'cursor': cursor,
             'data': data,
         }
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        self.write(json.dumps(page))
+        threshold = self.settings.get(
+            'serialization_threshold', self.serialization_threshold)
+        if (self.settings.get('serialization_pool') is None or
+                len(data) < threshold):
+            self.write(self.encode_json(page))
+            return
+        d = self.encode_json_in_thread(page)
+        d.addCallback(self.write)
+        return d
 
     @inlineCallbacks
-    def write_queue(self, q):
+    def write_queue(self, q, fields=None):
+        """
+        Write out the objects from a :class:`PausingDeferredQueue` as newline
+        separated JSON, until a :class:`PausingQueueCloseMarker` is reached.
+
+        Output is flushed to the client in chunks of about
+        :attr:`stream_flush_size` bytes, and whenever the queue runs dry.
+        While the transport's buffers are full we stop reading from the
+        queue, which in turn pauses whatever is filling it. If the client
+        disconnects, the queue is cancelled (see
+        :meth:`on_connection_close`) and we stop.
+
+        :type q: :class:`PausingDeferredQueue`
+        :param q:
+            Queue to read objects from, up to :attr:`stream_batch_size` at a
+            time.
+        :param tuple fields:
+            If not ``None``, only these fields of each object are written.
+        """
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        while True:
-            obj = yield q.get()
-            if obj is None:
-                continue
-            if isinstance(obj, PausingQueueCloseMarker):
-                break
-            self.write(json.dumps(obj))
-            self.write("\n")
+        self.start_stream()
+        self._stream_queue = q
+        try:
+            while True:
+                yield self.wait_for_transport()
+                if self._stream_producer.stopped:
+                    q.cancel()
+                    return
+                try:
+                    objs = yield self.timed(
+                        'collection', q.get_many, self.stream_batch_size)
+                except CancelledError:
+                    if q.cancelled:
+                        return
+                    raise
+                if self._stream_producer.stopped:
+                    q.cancel()
+                    return
+                for obj in objs:
+                    if obj is None:
+                        continue
+                    if isinstance(obj, PausingQueueCloseMarker):
+                        return
+                    obj = project(obj, fields)
+                    self.write_stream_chunk(self.encode_json(obj) + "\n")
+                if self._stream_buffered and not q.pending:
+                    # Don't hold on to data while we wait for more.
+                    self.flush_stream()
+        finally:
+            self._stream_queue = None
+            self.end_stream()
+
+    def format_result(self, result, format_data):
+        """
+        Format a ``(success, result)`` tuple from a bulk collection method,
+        or from a single collection method call, as a result dictionary.
+        """
+        success, value = result
+        if success:
+            return {"status_code": 200, "data": format_data(value)}
+        if value.check(CollectionObjectNotFound):
+            status_code, reason = 404, str(value.value)
+        elif value.check(CollectionUsageError):
+            status_code, reason = 400, str(value.value)
+        else:
+            log.err(value)
+            status_code, reason = 500, "Failed to process item."
+        return {"status_code": status_code, "reason": reason}
 
     def parse_json(self, data):
         try:
-            return json.loads(data)
+            return self.json_codec.loads(data)
         except ValueError as e:
             raise HTTPError(400, reason="Invalid JSON: %s" % e)
 
@@ -276,26 +831,62 @@ class CollectionHandler(BaseHandler):
     route_suffix = "/"
     model_alias = "collection"
 
+    def is_stream_request(self):
+        return (self.request.method == "GET" and
+                self.get_argument('stream', default='false') == 'true')
+
     def get(self, *args, **kw):
         """
         Return all elements from a collection.
+
+        If the collection implements ``get_collection_version``, pages have
+        an ``ETag`` and ``If-None-Match`` requests are supported. Collections
+        that also implement ``page_with_version`` return the page and its
+        version from one call.
+
+        A comma separated list of field names may be given in the ``fields``
+        argument to return only those fields of each element.
         """
         query = self.get_argument('query', default=None)
+        fields = self.get_fields()
         stream = self.get_argument('stream', default='false')
         if stream == 'true':
-            d = maybeDeferred(self.collection.stream, query=query)
-            d.addCallback(self.write_queue)
+            d = self.timed(
+                'collection', self.collection.stream, query=query,
+                **fields_kwargs(self.collection.stream, fields))
+            d.addCallback(self.write_queue, fields)
         else:
-            cursor = self.get_argument('cursor', default=None)
+            # Cursors are opaque, so we pass them through unchanged.
+            cursor = self.get_argument('cursor', default=None, strip=False)
             max_results = self.get_argument('max_results', default=None)
             try:
                 max_results = max_results and int(max_results)
             except ValueError:
                 raise HTTPError(400, "max_results must be an integer")
-            d = maybeDeferred(
-                self.collection.page, cursor=cursor,
-                max_results=max_results, query=query)
-            d.addCallback(self.write_page)
+            get_version = getattr(
+                self.collection, 'get_collection_version', None)
+            page_kw = fields_kwargs(self.collection.page, fields)
+            if get_version is None:
+                d = self.timed(
+                    'collection', self.collection.page, cursor=cursor,
+                    max_results=max_results, query=query, **page_kw)
+                d.addCallback(self.write_page, fields)
+            else:
+                page_with_version = getattr(
+                    self.collection, 'page_with_version', None)
+                get_with_version = None
+                if page_with_version is not None:
+                    get_with_version = lambda: page_with_version(
+                        cursor=cursor, max_results=max_results, query=query,
+                        **fields_kwargs(page_with_version, fields))
+                d = self.write_versioned(
+                    get_version,
+                    lambda: self.collection.page(
+                        cursor=cursor, max_results=max_results, query=query,
+                        **page_kw),
+                    lambda result: self.write_page(result, fields),
+                    fields, get_with_version,
+                    page_args=(cursor, max_results, query))
 
         d.addErrback(self.catch_err, 400, CollectionUsageError)
         d.addErrback(self.raise_err, 500, "Failed to retrieve objects.")
@@ -306,7 +897,7 @@ class CollectionHandler(BaseHandler):
         Create an element witin a collection.
         """
         data = self.parse_json(self.request.body)
-        d = maybeDeferred(self.collection.create, None, data)
+        d = self.timed('collection', self.collection.create, None, data)
         # the result of .create is (object_id, obj)
         d.addCallback(lambda result: self.write_object(result[1]))
         d.addErrback(self.catch_err, 400, CollectionUsageError)
@@ -331,9 +922,34 @@ class ElementHandler(BaseHandler):
     def get(self, *args, **kw):
         """
         Retrieve an element within a collection.
+
+        If the collection implements ``get_version``, responses have an
+        ``ETag`` and ``If-None-Match`` requests are supported. Collections
+        that also implement ``get_with_version`` return the element and its
+        version from one call.
+
+        A comma separated list of field names may be given in the ``fields``
+        argument to return only those fields of the element.
         """
-        d = maybeDeferred(self.collection.get, self.elem_id)
-        d.addCallback(self.write_object)
+        fields = self.get_fields()
+        get_kw = fields_kwargs(self.collection.get, fields)
+        get_version = getattr(self.collection, 'get_version', None)
+        if get_version is None:
+            d = self.timed(
+                'collection', self.collection.get, self.elem_id, **get_kw)
+            d.addCallback(self.write_object, fields)
+        else:
+            elem_with_version = getattr(
+                self.collection, 'get_with_version', None)
+            get_with_version = None
+            if elem_with_version is not None:
+                get_with_version = lambda: elem_with_version(
+                    self.elem_id, **fields_kwargs(elem_with_version, fields))
+            d = self.write_versioned(
+                lambda: get_version(self.elem_id),
+                lambda: self.collection.get(self.elem_id, **get_kw),
+                lambda obj: self.write_object(obj, fields),
+                fields, get_with_version)
         d.addErrback(self.catch_err, 404, CollectionObjectNotFound)
         d.addErrback(self.catch_err, 400, CollectionUsageError)
         d.addErrback(self.raise_err, 500,
@@ -345,7 +961,8 @@ class ElementHandler(BaseHandler):
         Update an element within a collection.
         """
         data = self.parse_json(self.request.body)
-        d = maybeDeferred(self.collection.update, self.elem_id, data)
+        d = self.timed(
+            'collection', self.collection.update, self.elem_id, data)
         d.addCallback(self.write_object)
         d.addErrback(self.catch_err, 404, CollectionObjectNotFound)
         d.addErrback(self.catch_err, 400, CollectionUsageError)
@@ -357,7 +974,7 @@ class ElementHandler(BaseHandler):
         """
         Delete an element from within a collection.
         """
-        d = maybeDeferred(self.collection.delete, self.elem_id)
+        d = self.timed('collection', self.collection.delete, self.elem_id)
         d.addCallback(self.write_object)
         d.addErrback(self.catch_err, 404, CollectionObjectNotFound)
         d.addErrback(self.catch_err, 400, CollectionUsageError)
@@ -366,6 +983,243 @@ class ElementHandler(BaseHandler):
         return d
 
 
+class BulkHandler(BaseHandler):
+    """
+    Handler for operations on batches of elements within a collection.
+
+    Methods supported:
+
+    * ``POST /_bulk/`` - perform an action on a batch of elements.
+
+    The request body is a JSON object with an ``action`` and a list of
+    ``items``:
+
+    * ``{"action": "get", "items": [id, ...]}``
+    * ``{"action": "create", "items": [object, ...]}``
+    * ``{"action": "update", "items": [object, ...]}`` - each object must
+      have an ``id``.
+    * ``{"action": "delete", "items": [id, ...]}``
+
+    The response is a JSON object with a list of ``results``, one for each
+    item. Each result has a ``status_code`` and either the object ``data``
+    or a ``reason`` for the failure.
+
+    Collections that don't implement the batch methods (``get_many`` and
+    so on) have the single item method called for each item instead.
+    """
+
+    route_suffix = "/_bulk/"
+    model_alias = "collection"
+
+    max_items = 1000
+
+    def _encode_id(self, object_id):
+        if not isinstance(object_id, basestring):
+            raise HTTPError(400, reason="Bulk items must be object ids")
+        if isinstance(object_id, unicode):
+            object_id = object_id.encode('utf-8')
+        return object_id
+
+    def _check_object(self, obj):
+        if not isinstance(obj, dict):
+            raise HTTPError(400, reason="Bulk items must be JSON objects")
+        return obj
+
+    def _bulk_method(self, name, item_name, unpack=False):
+        """
+        Return the collection's ``name`` batch method. If it doesn't have
+        one, return a function that calls ``item_name`` for each item and
+        gathers the results in the same format. Items are passed as a
+        tuple of arguments if ``unpack`` is ``True``.
+        """
+        method = getattr(self.collection, name, None)
+        if method is not None:
+            return method
+        item_method = getattr(self.collection, item_name)
+
+        def call_each(items):
+            return DeferredList([
+                maybeDeferred(item_method, *(item if unpack else (item,)))
+                for item in items], consumeErrors=True)
+        return call_each
+
+    def _parse_bulk_request(self, body):
+        if not isinstance(body, dict):
+            raise HTTPError(400, reason="Bulk request must be a JSON object")
+        action = body.get("action")
+        items = body.get("items")
+        if not isinstance(items, list):
+            raise HTTPError(400, reason="Bulk items must be a list")
+        if len(items) > self.max_items:
+            raise HTTPError(
+                400, reason="Too many bulk items (maximum %d)" % (
+                    self.max_items,))
+
+        if action == "get":
+            ids = [self._encode_id(i) for i in items]
+            return self._bulk_method('get_many', 'get'), ids, lambda r: r
+        if action == "create":
+            objs = [(None, self._check_object(o)) for o in items]
+            method = self._bulk_method('create_many', 'create', unpack=True)
+            return method, objs, lambda r: r[1]
+        if action == "update":
+            objs = [self._check_object(o) for o in items]
+            objs = [(self._encode_id(o.get("id")), o) for o in objs]
+            method = self._bulk_method('update_many', 'update', unpack=True)
+            return method, objs, lambda r: r
+        if action == "delete":
+            ids = [self._encode_id(i) for i in items]
+            return self._bulk_method('delete_many', 'delete'), ids, lambda r: r
+        raise HTTPError(400, reason="Unknown bulk action: %r" % (action,))
+
+    def write_results(self, results, format_data):
+        self.write_object({
+            "results": [self.format_result(r, format_data) for r in results],
+        })
+
+    def post(self, *args, **kw):
+        """
+        Perform an action on a batch of elements within a collection.
+        """
+        body = self.parse_json(self.request.body)
+        method, items, format_data = self._parse_bulk_request(body)
+        d = self.timed('collection', method, items)
+        d.addCallback(self.write_results, format_data)
+        d.addErrback(self.catch_err, 400, CollectionUsageError)
+        d.addErrback(self.raise_err, 500, "Failed to process bulk request.")
+        return d
+
+
+class ImportHandler(BaseHandler):
+    """
+    Handler for importing a stream of elements into a collection.
+
+    Methods supported:
+
+    * ``POST /_import/`` - create an element for each line of the body.
+
+    The request body is newline-delimited JSON, with one object per line.
+    Blank lines are skipped. Lines are parsed as they arrive, and up to
+    :attr:`import_concurrency` objects are created at once.
+
+    The response is newline-delimited JSON, with a result for each
+    non-blank line, in the same order. Each result has the ``line`` number,
+    a ``status_code`` and either the object ``data`` or a ``reason`` for the
+    failure.
+
+    When the application uses a :class:`StreamingHTTPConnection` (as
+    :class:`ApiApplication` does when it has import routes), the body is
+    never held in memory all at once, and reading it is paused while the
+    collection catches up.
+
+    Many clients send the whole body before reading any of the response, so
+    up to :attr:`import_buffer_size` bytes of results are buffered while the
+    client isn't reading them, and the body is read meanwhile. Once that
+    many are waiting, reading the body is paused until the client reads some
+    results. Clients that import more than that must read the response
+    while they send the body.
+    """
+
+    route_suffix = "/_import/"
+    model_alias = "collection"
+    stream_request_body = True
+
+    # The maximum number of objects to create at once. May be overridden by
+    # the ``import_concurrency`` application setting.
+    import_concurrency = 10
+
+    # The number of bytes of results to buffer while the client isn't
+    # reading the response. May be overridden by the ``import_buffer_size``
+    # application setting.
+    import_buffer_size = 1024 * 1024
+
+    def is_stream_request(self):
+        return True
+
+    def _get_body_stream(self):
+        stream = getattr(self.request, 'body_stream', None)
+        if stream is None:
+            stream = RequestBodyStream.from_body(self.request.body)
+        return stream
+
+    def import_line(self, line):
+        """
+        Create an object from a line of the request body. Returns a deferred
+        that fires with a result dictionary.
+        """
+        if line is None:
+            return succeed({"status_code": 400, "reason": "Line too long"})
+        try:
+            obj = self.json_codec.loads(line)
+        except ValueError as e:
+            return succeed(
+                {"status_code": 400, "reason": "Invalid JSON: %s" % (e,)})
+        if not isinstance(obj, dict):
+            return succeed({
+                "status_code": 400,
+                "reason": "Import items must be JSON objects"})
+        d = self.timed('collection', self.collection.create, None, obj)
+        d.addCallbacks(lambda r: (True, r), lambda f: (False, f))
+        d.addCallback(self.format_result, lambda r: r[1])
+        return d
+
+    @inlineCallbacks
+    def write_result(self, line_number, d):
+        result = yield d
+        result["line"] = line_number
+        chunk = self.encode_json(result) + "\n"
+        self.write_stream_chunk(chunk)
+        if not self._stream_producer.paused:
+            self._unread_bytes = 0
+            return
+        # Keep going until enough results are waiting for the client, so
+        # that we keep reading the body of clients that send all of it
+        # before they read the response.
+        self._unread_bytes += len(chunk)
+        buffer_size = self.settings.get(
+            'import_buffer_size', self.import_buffer_size)
+        if self._unread_bytes >= buffer_size:
+            yield self.wait_for_transport()
+            self._unread_bytes = 0
+
+    @inlineCallbacks
+    def post(self, *args, **kw):
+        """
+        Create an element within a collection for each line of the request
+        body.
+        """
+        concurrency = self.settings.get(
+            'import_concurrency', self.import_concurrency)
+        body = self._get_body_stream()
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.start_stream()
+        self._unread_bytes = 0
+        try:
+            in_flight = deque()
+            line_number = 0
+            while not self._stream_producer.stopped:
+                if self._stream_buffered and not body.pending:
+                    # Don't hold on to results while we wait for more lines.
+                    self.flush_stream()
+                try:
+                    lines = yield body.get_lines(concurrency)
+                except RequestBodyLost:
+                    return
+                if not lines:
+                    break
+                for line in lines:
+                    line_number += 1
+                    if line is not None and not line.strip():
+                        continue
+                    in_flight.append((line_number, self.import_line(line)))
+                    if len(in_flight) >= concurrency:
+                        yield self.write_result(*in_flight.popleft())
+            while in_flight and not self._stream_producer.stopped:
+                yield self.write_result(*in_flight.popleft())
+        finally:
+            self.end_stream()
+
+
 def owner_from_static_value(owner):
     """
     Return a function that returns a static owner id.
@@ -416,28 +1270,129 @@ def owner_from_path_kwarg(path_kwarg):
     return owner_factory
 
 
-def owner_from_oauth2_bouncer(url_base):
+def owner_from_oauth2_bouncer(url_base, cache=None, negative_ttl=None,
+                              cache_per_uri=True, pool=None, coalesce=True,
+                              max_connections=None):
     """
     Return a function that retrieves an owner id from a call to an auth service
     API.
 
     :param str url_base:
         The base URL to make an auth request to.
-
+    :type cache: :class:`go_api.cache.LRUCache`
+    :param cache:
+        If given, owner ids returned by the auth service are cached here,
+        keyed by the ``Authorization`` header. Note that a cached owner id
+        remains valid until it expires, even if the token is revoked.
+    :param float negative_ttl:
+        If given (and ``cache`` is given), ``401`` and ``403`` responses from
+        the auth service are cached for this many seconds.
+    :param bool cache_per_uri:
+        If ``True`` (the default), the path of the request URI is part of
+        the cache key, so that auth decisions are cached separately for each
+        path. The query string is left out, so that requests that only
+        differ in e.g. their cursor share an entry. Set this to ``False`` if
+        the auth service's decisions don't depend on the path. This also
+        controls which requests are coalesced.
+    :type pool: :class:`twisted.web.client.HTTPConnectionPool`
+    :param pool:
+        If given, connections to the auth service are made from (and kept
+        open in) this pool. Otherwise a new connection is made for each
+        request.
+    :param bool coalesce:
+        If ``True`` (the default), concurrent requests with the same
+        credentials share a single in-flight call to the auth service.
+    :param int max_connections:
+        If given, at most this many calls to the auth service are made at
+        once. Further calls wait for one of them to finish.
     """
+    in_flight = {}
+    semaphore = None
+    if max_connections is not None:
+        semaphore = DeferredSemaphore(max_connections)
+
+    def cache_key(request):
+        key = request.headers.get('Authorization')
+        if cache_per_uri:
+            return (key, request.uri.partition('?')[0])
+        return key
+
     @inlineCallbacks
-    def owner_factory(handler):
-        request = handler.request
+    def fetch_owner(request):
         uri = "".join([url_base.rstrip('/'), request.uri])
         auth_headers = {}
         if 'Authorization' in request.headers:
             auth_headers['Authorization'] = request.headers['Authorization']
-        resp = yield treq.get(uri, headers=auth_headers, persistent=False)
+        if pool is None:
+            resp = yield treq.get(uri, headers=auth_headers, persistent=False)
+        else:
+            resp = yield treq.get(uri, headers=auth_headers, pool=pool)
         yield resp.content()
         if resp.code >= 400:
             raise HTTPError(resp.code)
         [owner] = resp.headers.getRawHeaders('X-Owner-Id')
         returnValue(owner)
+
+    def limited_fetch_owner(request):
+        if semaphore is None:
+            return fetch_owner(request)
+        return semaphore.run(fetch_owner, request)
+
+    @inlineCallbacks
+    def fetch_and_cache_owner(request, key):
+        try:
+            owner = yield limited_fetch_owner(request)
+        except HTTPError as e:
+            if (cache is not None and negative_ttl is not None and
+                    e.status_code in (401, 403)):
+                cache.set(key, (None, e.status_code), ttl=negative_ttl)
+            raise
+        if cache is not None:
+            cache.set(key, (owner, None))
+        returnValue(owner)
+
+    def fire_waiters(result, key, entry):
+        if in_flight.get(key) is entry:
+            del in_flight[key]
+        for d in entry['waiters']:
+            d.callback(result)
+
+    def cancel_waiter(d, key, entry):
+        entry['waiters'].remove(d)
+        if not entry['waiters']:
+            # Nobody is waiting for the auth service any more, so stop
+            # asking it.
+            if in_flight.get(key) is entry:
+                del in_flight[key]
+            entry['fetch'].cancel()
+
+    def coalesced_fetch(request, key):
+        entry = in_flight.get(key)
+        fetch = entry is None
+        if fetch:
+            entry = in_flight[key] = {'waiters': [], 'fetch': None}
+        d = Deferred(lambda d: cancel_waiter(d, key, entry))
+        entry['waiters'].append(d)
+        if fetch:
+            entry['fetch'] = fetch_and_cache_owner(request, key)
+            entry['fetch'].addBoth(fire_waiters, key, entry)
+        return d
+
+    def get_owner(request):
+        key = cache_key(request)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                owner, status_code = cached
+                if status_code is not None:
+                    raise HTTPError(status_code)
+                return owner
+        if coalesce:
+            return coalesced_fetch(request, key)
+        return fetch_and_cache_owner(request, key)
+
+    def owner_factory(handler):
+        return maybeDeferred(get_owner, handler.request)
     return owner_factory
 
 
@@ -468,6 +1423,79 @@ class ApiApplication(Application):
 
     config_required = False
     health_handler = HealthHandler
+    bulk_handler = None
+    # Set this to a handler class (usually :class:`ImportHandler`) to
+    # serve ``/_import/`` routes for each collection.
+    import_handler = None
+
+    # Request bodies are passed to handlers with ``stream_request_body``
+    # set as they arrive, if any routes have such handlers. See
+    # :meth:`setup_protocol` and :meth:`streams_request_body`.
+    streaming_protocol = StreamingHTTPConnection
+
+    # Set this to a handler class (usually
+    # :class:`go_api.cyclone.metrics.MetricsHandler`) to record request
+    # metrics and serve them at ``/metrics/``.
+    metrics_handler = None
+
+    # The name of the JSON codec to use, or a JsonCodec instance. The
+    # default of "json" uses the standard library, and "auto" uses the
+    # fastest installed codec. This may be overridden by the ``json_codec``
+    # config option.
+    json_codec = "json"
+
+    # The maximum number of concurrent requests to the auth service, which is
+    # also the number of idle connections kept open to it. This may be
+    # overridden by the ``auth_max_connections`` config option.
+    auth_max_connections = 10
+
+    # Set ``compression_min_size`` to a number of bytes to compress responses
+    # with gzip or deflate if the client accepts it. Smaller responses are
+    # sent uncompressed, except for streams. Compression is off by default
+    # since it changes response bodies and makes strong ETags weak. Setting
+    # ``compression_level`` to ``0`` also disables it. These may be
+    # overridden by the config options of the same names.
+    compression_min_size = None
+    compression_level = 6
+
+    # The maximum number of threads to serialize large pages in. The default
+    # of ``0`` serializes all pages on the reactor thread. This may be
+    # overridden by the ``serialization_threads`` config option, and the
+    # number of objects that makes a page large by the
+    # ``serialization_threshold`` config option. See
+    # :meth:`BaseHandler.write_page`.
+    serialization_threads = 0
+
+    # Set this to ``True`` to match request paths with a :class:`RouteTrie`
+    # instead of trying each route's regex in turn, which is faster for
+    # applications with many routes. This may be overridden by the
+    # ``trie_routing`` config option.
+    trie_routing = False
+
+    # Per-owner limits on request rates, requests in flight and open streams,
+    # as keyword arguments for :class:`OwnerLimiter`, or ``None`` for no
+    # limits. Requests over a limit get a ``429 Too Many Requests`` response
+    # before their model factory is called. This may be overridden by the
+    # ``owner_limits`` config option, e.g.::
+    #
+    #     owner_limits:
+    #       rate: 10            # requests per second
+    #       burst: 20           # requests at once after a quiet period
+    #       max_concurrent: 5   # requests in flight
+    #       max_streams: 1      # streaming requests in flight
+    #       owners:             # overrides for particular owners
+    #         owner-1:
+    #           rate: 100
+    owner_limits = None
+
+    # The number of seconds requests may take before they are cancelled and
+    # get a ``504 Gateway Timeout`` response, or ``None`` for no deadline.
+    # ``route_timeouts`` maps route definitions (as used in
+    # :attr:`collections` and :attr:`models`, without the path prefix) to
+    # deadlines for their routes. These may be overridden by the config
+    # options of the same names. See :attr:`BaseHandler.request_timeout`.
+    request_timeout = None
+    route_timeouts = {}
 
     models = ()
     collections = ()
@@ -479,11 +1507,22 @@ class ApiApplication(Application):
             raise ValueError(
                 "Please specify a config file using --appopts=<config.yaml>")
         config = self.get_config_settings(config_file)
+        self.metrics = None
+        if self.metrics_handler is not None:
+            self.metrics = MetricsRegistry()
         self.setup_factory_preprocessor(config)
+        self.setup_json_codec(settings, config)
+        self.setup_serialization_pool(settings, config)
+        self.setup_owner_limits(config)
+        self.setup_request_timeouts(settings, config)
+        self.trie_routing = config.get('trie_routing', self.trie_routing)
+        self._routers = {}
         self.initialize(settings, config)
         path_prefix = self._get_configured_path_prefix(config)
         routes = self._build_routes(path_prefix)
         Application.__init__(self, routes, **settings)
+        self.setup_compression(config)
+        self.setup_protocol()
 
     def initialize(self, settings, config):
         """
@@ -496,8 +1535,11 @@ class ApiApplication(Application):
         # TODO: Better configuration mechanism than this.
         auth_bouncer_url = config.get('auth_bouncer_url')
         if auth_bouncer_url is not None:
-            self.factory_preprocessor = (
-                owner_from_oauth2_bouncer(auth_bouncer_url))
+            self.factory_preprocessor = owner_from_oauth2_bouncer(
+                auth_bouncer_url, pool=self._get_auth_pool(config),
+                max_connections=config.get(
+                    'auth_max_connections', self.auth_max_connections),
+                **self._get_auth_cache_kwargs(config))
             return
         static_owner_id = config.get('static_owner_id')
         if static_owner_id is not None:
@@ -505,6 +1547,121 @@ class ApiApplication(Application):
                 owner_from_static_value(static_owner_id))
             return
 
+    def setup_owner_limits(self, config):
+        """
+        Create the :class:`OwnerLimiter` that requests are admitted by, if
+        there are any owner limits.
+        """
+        self.owner_limiter = None
+        owner_limits = config.get('owner_limits', self.owner_limits)
+        if owner_limits:
+            self.owner_limiter = OwnerLimiter.from_config(owner_limits)
+
+    def setup_request_timeouts(self, settings, config):
+        """
+        Add the default request deadline to the application settings, where
+        handlers will find it, and pick up the per-route deadlines.
+        """
+        request_timeout = config.get('request_timeout', self.request_timeout)
+        if request_timeout is not None:
+            settings.setdefault('request_timeout', request_timeout)
+        self.route_timeouts = config.get('route_timeouts', self.route_timeouts)
+
+    def setup_json_codec(self, settings, config):
+        """
+        Add the configured :class:`JsonCodec` to the application settings,
+        where handlers will find it.
+        """
+        codec = config.get('json_codec', self.json_codec)
+        if isinstance(codec, basestring):
+            codec = get_json_codec(codec)
+        settings.setdefault('json_codec', codec)
+
+    def setup_serialization_pool(self, settings, config):
+        """
+        Create the thread pool that handlers serialize large pages in and
+        add it to the application settings, unless it is disabled or a
+        ``serialization_pool`` setting was given. The pool is started when
+        the reactor is running and stopped when it shuts down.
+        """
+        self.serialization_pool = None
+        threads = config.get(
+            'serialization_threads', self.serialization_threads)
+        if 'serialization_threshold' in config:
+            settings.setdefault(
+                'serialization_threshold', config['serialization_threshold'])
+        if not threads or 'serialization_pool' in settings:
+            return
+        from twisted.internet import reactor
+        self.serialization_pool = ThreadPool(
+            minthreads=0, maxthreads=threads, name="go_api-serialization")
+        settings['serialization_pool'] = self.serialization_pool
+        reactor.callWhenRunning(self.serialization_pool.start)
+        reactor.addSystemEventTrigger(
+            'during', 'shutdown', self.stop_serialization_pool)
+
+    def stop_serialization_pool(self):
+        """
+        Stop the serialization thread pool, if there is one and it is
+        running.
+        """
+        if self.serialization_pool is not None and (
+                self.serialization_pool.started):
+            self.serialization_pool.stop()
+
+    def setup_compression(self, config):
+        """
+        Add a transform that compresses responses, if compression is
+        enabled. Must be called after the application's transforms have
+        been set up.
+        """
+        level = config.get('compression_level', self.compression_level)
+        min_size = config.get(
+            'compression_min_size', self.compression_min_size)
+        if min_size is None or not level:
+            return
+        # Compression must happen before any transfer encoding.
+        self.transforms.insert(
+            0, compression_transform(min_size=min_size, level=level))
+
+    def _get_auth_pool(self, config):
+        """
+        Build the persistent connection pool for auth service requests. The
+        ``auth_max_connections`` config option sets the number of idle
+        connections kept open to the auth service. It also limits the number
+        of concurrent requests to the auth service (see
+        :func:`owner_from_oauth2_bouncer`), so no more connections than that
+        are needed.
+        """
+        from twisted.internet import reactor
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = config.get(
+            'auth_max_connections', self.auth_max_connections)
+        return pool
+
+    def _get_auth_cache_kwargs(self, config):
+        """
+        Build the caching arguments for :func:`owner_from_oauth2_bouncer`
+        from the ``auth_cache`` config option, which looks like::
+
+            auth_cache:
+              ttl: 60           # seconds to cache owner ids for
+              max_size: 10000   # maximum number of cached owner ids
+              negative_ttl: 5   # seconds to cache 401 and 403 responses
+              per_uri: true     # whether to cache each request path separately
+        """
+        cache_config = config.get('auth_cache')
+        if not cache_config:
+            return {}
+        cache = LRUCache(
+            max_size=cache_config.get('max_size', 10000),
+            ttl=cache_config.get('ttl', 60))
+        return {
+            'cache': cache,
+            'negative_ttl': cache_config.get('negative_ttl'),
+            'cache_per_uri': cache_config.get('per_uri', True),
+        }
+
     def get_config_settings(self, config_file=None):
         return read_yaml_config(config_file)
 
@@ -512,11 +1669,30 @@ class ApiApplication(Application):
         prefix = config.get('url_path_prefix')
         return prefix or ""
 
+    def _admit_owner(self, preprocessor):
+        """
+        Wrap a factory preprocessor so that requests are admitted by the
+        :attr:`owner_limiter` once their owner is known.
+        """
+        def admit(handler):
+            d = maybeDeferred(preprocessor, handler)
+
+            def admit_owner(owner):
+                handler.admit(self.owner_limiter, owner)
+                return owner
+            return d.addCallback(admit_owner)
+        return admit
+
     def _build_route(self, path_prefix, dfn, handler, factory):
         if self.factory_preprocessor is not None:
-            factory = compose_deferred(factory, self.factory_preprocessor)
+            preprocessor = self.factory_preprocessor
+            if self.owner_limiter is not None:
+                preprocessor = self._admit_owner(preprocessor)
+            factory = compose_deferred(factory, preprocessor)
 
-        return handler.mk_urlspec(dfn, factory, path_prefix=path_prefix)
+        return handler.mk_urlspec(
+            dfn, factory, path_prefix=path_prefix,
+            request_timeout=self.route_timeouts.get(dfn))
 
     def _build_element_routes(self, path_prefix):
         """
@@ -534,6 +1710,15 @@ class ApiApplication(Application):
         """
         return [URLSpec('/health/', self.health_handler)]
 
+    def _build_metrics_routes(self, path_prefix):
+        """
+        Build up routes for serving request metrics, if they are enabled.
+        """
+        if self.metrics_handler is None:
+            return []
+        return [URLSpec('/metrics/', self.metrics_handler,
+                        kwargs={'metrics': self.metrics})]
+
     def _build_collection_routes(self, path_prefix):
         """
         Build up routes for handlers.
@@ -542,6 +1727,26 @@ class ApiApplication(Application):
             self._build_route(path_prefix, dfn, CollectionHandler, factory)
             for dfn, factory in self.collections]
 
+    def _build_bulk_routes(self, path_prefix):
+        """
+        Build up routes for bulk handlers if :attr:`bulk_handler` is set.
+        """
+        if self.bulk_handler is None:
+            return []
+        return [
+            self._build_route(path_prefix, dfn, self.bulk_handler, factory)
+            for dfn, factory in self.collections]
+
+    def _build_import_routes(self, path_prefix):
+        """
+        Build up routes for import handlers if :attr:`import_handler` is set.
+        """
+        if self.import_handler is None:
+            return []
+        return [
+            self._build_route(path_prefix, dfn, self.import_handler, factory)
+            for dfn, factory in self.collections]
+
     def _build_model_routes(self, path_prefix):
         """
         Build up routes for handlers.
@@ -556,12 +1761,156 @@ class ApiApplication(Application):
         extra routes.
         """
         routes = self._build_health_routes(path_prefix)
+        routes.extend(self._build_metrics_routes(path_prefix))
         routes.extend(self._build_collection_routes(path_prefix))
         routes.extend(self._build_element_routes(path_prefix))
         routes.extend(self._build_model_routes(path_prefix))
+        routes.extend(self._build_bulk_routes(path_prefix))
+        routes.extend(self._build_import_routes(path_prefix))
         return routes
 
+    def add_handlers(self, host_pattern, host_handlers):
+        Application.add_handlers(self, host_pattern, host_handlers)
+        # The route tries are built again when they're next needed.
+        self._routers = {}
+        self.setup_protocol()
+
+    def setup_protocol(self):
+        """
+        Use :attr:`streaming_protocol` for connections if any route's
+        handler has ``stream_request_body`` set. Otherwise connections use
+        cyclone's usual protocol, which doesn't need to match each request's
+        route before its body has arrived.
+        """
+        streaming = any(
+            getattr(spec.handler_class, 'stream_request_body', False)
+            for _, handlers in self.handlers for spec in handlers)
+        if streaming:
+            self.protocol = self.streaming_protocol
+
+    def _get_router(self, handlers):
+        """
+        Return the :class:`RouteTrie` for a list of handlers, building it
+        if necessary.
+        """
+        entry = self._routers.get(id(handlers))
+        if entry is None:
+            # Keep the list alive with its trie so that its id isn't reused.
+            entry = self._routers[id(handlers)] = (
+                handlers, RouteTrie(handlers))
+        return entry[1]
+
+    def _get_host_groups(self, request):
+        """
+        Return the lists of routes for every host pattern that matches the
+        request's host, in the order they were added.
+
+        As in cyclone, the default host's routes are only used if no host
+        pattern matches and we're not behind a load balancer.
+        """
+        host = request.host.lower().split(':')[0]
+        groups = [handlers for pattern, handlers in self.handlers
+                  if handlers and pattern.match(host)]
+        if not groups and "X-Real-Ip" not in request.headers:
+            groups = [handlers for pattern, handlers in self.handlers
+                      if handlers and pattern.match(self.default_host)]
+        return groups
+
+    def _match_route(self, request, groups=_UNMATCHED):
+        """
+        Return ``(spec, args, kwargs)`` for the route that matches the
+        request, or ``None`` if no route matches.
+
+        ``groups`` are the routes for the request's host, if they have
+        already been looked up. Each group is tried in order, so the first
+        matching route is the same one cyclone would pick. The match is
+        saved on the request, so that streaming the request body,
+        dispatching the request and recording metrics for it only match it
+        once.
+        """
+        route = getattr(request, '_matched_route', _UNMATCHED)
+        if route is not _UNMATCHED:
+            return route
+        if groups is _UNMATCHED:
+            groups = self._get_host_groups(request)
+        route = None
+        for handlers in groups:
+            if self.trie_routing:
+                route = self._get_router(handlers).match(request.path)
+            else:
+                route = self._match_regex_route(handlers, request.path)
+            if route is not None:
+                break
+        request._matched_route = route
+        return route
+
+    def _match_regex_route(self, handlers, path):
+        """
+        Return ``(spec, args, kwargs)`` for the first of ``handlers`` whose
+        regex matches ``path``, or ``None``.
+        """
+        for spec in handlers:
+            match = spec.regex.match(path)
+            if match is not None:
+                args, kwargs = match_args(spec, match)
+                return (spec, args, kwargs)
+        return None
+
+    def __call__(self, request):
+        if not self.trie_routing or self.settings.get("debug"):
+            # Cyclone's own dispatch also handles reloading templates and
+            # static files in debug mode.
+            return Application.__call__(self, request)
+        transforms = [t(request) for t in self.transforms]
+        args, kwargs = [], {}
+        groups = self._get_host_groups(request)
+        if not groups:
+            handler = RedirectHandler(
+                self, request, url="http://" + self.default_host + "/")
+        else:
+            route = self._match_route(request, groups)
+            if route is None:
+                handler = ErrorHandler(self, request, status_code=404)
+            else:
+                spec, args, kwargs = route
+                handler = spec.handler_class(self, request, **spec.kwargs)
+        handler._execute(transforms, *args, **kwargs)
+        return handler
+
+    def streams_request_body(self, request):
+        """
+        Return ``True`` if the handler for ``request`` should be given its
+        body as it arrives, because its class has ``stream_request_body``
+        set. Called by :class:`StreamingHTTPConnection`.
+        """
+        route = self._match_route(request)
+        return route is not None and getattr(
+            route[0].handler_class, 'stream_request_body', False)
+
+    def _route_label(self, handler):
+        """
+        Return a label for the route that ``handler`` was matched by, e.g.
+        ``/:owner_id/store/``.
+        """
+        route = self._match_route(handler.request)
+        if route is None:
+            return "unmatched"
+        label = ROUTE_VAR_RE.sub(r':\1', route[0].regex.pattern)
+        return label.rstrip('$')
+
+    def record_metrics(self, handler):
+        """
+        Record the request handled by ``handler`` in :attr:`metrics`.
+        """
+        self.metrics.record_request(
+            self._route_label(handler), handler.request.method,
+            handler.get_status(), handler.request.request_time(),
+            getattr(handler, 'timings', None))
+
     def log_request(self, handler):
+        if self.metrics is not None:
+            self.record_metrics(handler)
+
         if getattr(handler, 'suppress_request_log', False):
             # The handler doesn't want to be logged, so we're done.
             return
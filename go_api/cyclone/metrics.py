@@ -0,0 +1,173 @@
+"""
+Request metrics for API applications, in the Prometheus text format.
+"""
+
+from bisect import bisect_left
+
+from cyclone.web import RequestHandler
+
+
+# Histogram bucket upper bounds, in seconds.
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0)
+
+
+def _escape_label_value(value):
+    return (unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labels):
+    return "{%s}" % (",".join(
+        '%s="%s"' % (name, _escape_label_value(value))
+        for name, value in labels),)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """
+    A histogram of observed values.
+
+    :param tuple buckets:
+        The upper bounds of the histogram's buckets, in increasing order.
+        Values larger than the last bound are counted in an implicit
+        ``+Inf`` bucket.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """
+        Return a list of ``(suffix, extra_labels, value)`` tuples for the
+        histogram's cumulative buckets, sum and count.
+        """
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (None,), self.counts):
+            cumulative += count
+            le = "+Inf" if bound is None else repr(float(bound))
+            samples.append(("_bucket", (("le", le),), cumulative))
+        samples.append(("_sum", (), self.sum))
+        samples.append(("_count", (), self.count))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    Request counts and latencies, broken down by route and HTTP method.
+
+    The time handlers spend in each phase of a request (e.g. calling the
+    ``model_factory``, calling the collection or serializing the response)
+    is recorded in a separate histogram for each phase.
+
+    :param str prefix:
+        The prefix for metric names.
+    :param tuple buckets:
+        The histogram bucket bounds, in seconds.
+    """
+
+    def __init__(self, prefix="go_api_", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.requests = {}
+        self.durations = {}
+        self.phase_durations = {}
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def record_request(self, route, method, status_code, duration,
+                       timings=None):
+        """
+        Record a finished request.
+
+        :param str route:
+            The route the request matched.
+        :param str method:
+            The HTTP method.
+        :param int status_code:
+            The response status code.
+        :param float duration:
+            The time taken to handle the request, in seconds.
+        :param dict timings:
+            The time spent in each phase of the request, in seconds, keyed
+            by phase name.
+        """
+        key = (route, method, status_code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        self._histogram(self.durations, (route, method)).observe(duration)
+        for phase, seconds in (timings or {}).iteritems():
+            self._histogram(
+                self.phase_durations, (route, method, phase)).observe(seconds)
+
+    def _render_metric(self, lines, name, metric_type, help_text, samples):
+        name = self.prefix + name
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for suffix, labels, value in samples:
+            lines.append("%s%s%s %s" % (
+                name, suffix, _format_labels(labels), _format_value(value)))
+
+    def _histogram_samples(self, histograms, label_names):
+        for key in sorted(histograms):
+            labels = tuple(zip(label_names, key))
+            for suffix, extra_labels, value in histograms[key].samples():
+                yield (suffix, labels + extra_labels, value)
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        self._render_metric(
+            lines, "requests_total", "counter",
+            "Total number of requests handled.",
+            (("", (("route", route), ("method", method),
+                   ("status", status_code)), count)
+             for (route, method, status_code), count in sorted(
+                self.requests.iteritems())))
+        self._render_metric(
+            lines, "request_duration_seconds", "histogram",
+            "Time taken to handle requests.",
+            self._histogram_samples(self.durations, ("route", "method")))
+        self._render_metric(
+            lines, "request_phase_duration_seconds", "histogram",
+            "Time spent in each phase of handling requests.",
+            self._histogram_samples(
+                self.phase_durations, ("route", "method", "phase")))
+        return (u"\n".join(lines) + u"\n").encode("utf-8")
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Handler that serves a :class:`MetricsRegistry` in the Prometheus text
+    format.
+    """
+
+    suppress_request_log = True
+
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self, *args, **kw):
+        self.set_header(
+            'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.metrics.render())
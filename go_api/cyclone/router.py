@@ -0,0 +1,163 @@
+"""
+A segment trie for matching request paths against route tables.
+"""
+
+import re
+
+from cyclone import escape
+
+
+# Matches the named groups that create_urlspec_regex() makes for route
+# variables.
+ROUTE_VAR_RE = re.compile(r'\(\?P<(\w+)>\[\^/\]\*\)')
+
+# Stands in for a route variable while a pattern is split into segments.
+_VAR_MARKER = '\0'
+
+# Characters that give a path segment a meaning other than its literal text
+# in a regex.
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _unquote(s):
+    return escape.url_unescape(s, encoding=None)
+
+
+def spec_segments(spec):
+    """
+    Return a list of ``(literal, var_name)`` pairs for the path segments of
+    a :class:`URLSpec`, or ``None`` if its regex can't be matched segment by
+    segment. One of ``literal`` and ``var_name`` is always ``None``.
+
+    Regexes built by :func:`create_urlspec_regex` from literal segments and
+    ``:var`` segments can be. Other regexes can't.
+    """
+    pattern = spec.regex.pattern
+    if pattern.endswith('$'):
+        pattern = pattern[:-1]
+    if _VAR_MARKER in pattern:
+        return None
+    var_names = iter(ROUTE_VAR_RE.findall(pattern))
+    segments = []
+    for part in ROUTE_VAR_RE.sub(_VAR_MARKER, pattern).split('/'):
+        if part == _VAR_MARKER:
+            segments.append((None, next(var_names)))
+        elif _VAR_MARKER not in part and _REGEX_CHARS.isdisjoint(part):
+            segments.append((part, None))
+        else:
+            return None
+    return segments
+
+
+def match_args(spec, match):
+    """
+    Return the ``(args, kwargs)`` that Cyclone passes to a handler for a
+    regex ``match`` of ``spec``.
+    """
+    if not spec.regex.groups:
+        return [], {}
+    if spec.regex.groupindex:
+        return [], dict(
+            (str(k), None if v is None else _unquote(v))
+            for k, v in match.groupdict().iteritems())
+    return [None if s is None else _unquote(s) for s in match.groups()], {}
+
+
+class _Node(object):
+    __slots__ = ('literals', 'var', 'route', 'min_index')
+
+    def __init__(self):
+        self.literals = {}
+        self.var = None
+        # The (index, spec, var_names) of the route ending here, if any.
+        self.route = None
+        # The smallest index of any route ending at or below this node.
+        self.min_index = None
+
+
+class RouteTrie(object):
+    """
+    Matches request paths against a list of :class:`URLSpec` instances.
+
+    Routes built by :func:`create_urlspec_regex` are compiled into a trie
+    with one level per path segment, where a ``:var`` segment matches any
+    segment. Matching a path takes time proportional to its number of
+    segments rather than the number of routes. Other routes are matched
+    with their regexes.
+
+    As with Cyclone's own dispatch, the first route in the list that
+    matches wins, and path arguments are URL-unescaped.
+
+    :param list specs:
+        The :class:`URLSpec` instances to match, in order.
+    """
+
+    def __init__(self, specs):
+        self.root = _Node()
+        self.fallback = []
+        for index, spec in enumerate(specs):
+            segments = spec_segments(spec)
+            if segments is None:
+                self.fallback.append((index, spec))
+            else:
+                self._insert(index, spec, segments)
+
+    def _insert(self, index, spec, segments):
+        node = self.root
+        nodes = [node]
+        for literal, var_name in segments:
+            if var_name is not None:
+                if node.var is None:
+                    node.var = _Node()
+                node = node.var
+            else:
+                node = node.literals.setdefault(literal, _Node())
+            nodes.append(node)
+        if node.route is not None:
+            # An earlier route has the same shape, so this one can never
+            # match.
+            return
+        var_names = [v for _, v in segments if v is not None]
+        node.route = (index, spec, var_names)
+        for node in nodes:
+            if node.min_index is None or index < node.min_index:
+                node.min_index = index
+
+    def _search(self, node, segments, i, values, best):
+        if best is not None and node.min_index >= best[0]:
+            return best
+        if i == len(segments):
+            if node.route is not None and (
+                    best is None or node.route[0] < best[0]):
+                return node.route + (list(values),)
+            return best
+        child = node.literals.get(segments[i])
+        if child is not None:
+            best = self._search(child, segments, i + 1, values, best)
+        if node.var is not None:
+            values.append(segments[i])
+            best = self._search(node.var, segments, i + 1, values, best)
+            values.pop()
+        return best
+
+    def match(self, path):
+        """
+        Return ``(spec, args, kwargs)`` for the first route that matches
+        ``path``, or ``None`` if no route matches.
+        """
+        best = None
+        if self.root.min_index is not None:
+            best = self._search(self.root, path.split('/'), 0, [], None)
+        for index, spec in self.fallback:
+            if best is not None and index > best[0]:
+                break
+            match = spec.regex.match(path)
+            if match is not None:
+                args, kwargs = match_args(spec, match)
+                return spec, args, kwargs
+        if best is None:
+            return None
+        _, spec, var_names, values = best
+        return spec, [], dict(
+            (str(name), _unquote(value))
+            for name, value in zip(var_names, values))
@@ -0,0 +1,167 @@
+from twisted.trial.unittest import TestCase
+from twisted.internet.task import Clock
+
+from go_api.cyclone.admission import (
+    OwnerLimiter, TokenBucket, TooManyRequests)
+
+
+class TestTooManyRequests(TestCase):
+    def test_status(self):
+        err = TooManyRequests(2, "Rate limit exceeded")
+        self.assertEqual(err.status_code, 429)
+        self.assertEqual(err.reason, "Rate limit exceeded")
+
+    def test_retry_after_header(self):
+        self.assertEqual(TooManyRequests(2, "").retry_after_header(), "2")
+        self.assertEqual(TooManyRequests(0.1, "").retry_after_header(), "1")
+        self.assertEqual(TooManyRequests(2.5, "").retry_after_header(), "3")
+        self.assertEqual(TooManyRequests(0, "").retry_after_header(), "1")
+
+
+class TestTokenBucket(TestCase):
+    def test_take(self):
+        bucket = TokenBucket(rate=2, burst=2, now=0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0.5)
+        self.assertEqual(bucket.take(0.25), 0.25)
+        self.assertEqual(bucket.take(0.5), 0)
+        self.assertEqual(bucket.take(0.5), 0.5)
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=1, burst=2, now=0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertEqual(bucket.take(100), 0)
+        self.assertEqual(bucket.take(100), 0)
+        self.assertEqual(bucket.take(100), 1)
+
+    def test_time_to_full(self):
+        bucket = TokenBucket(rate=2, burst=4, now=0)
+        self.assertEqual(bucket.time_to_full(), 0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertEqual(bucket.time_to_full(), 1)
+
+
+class TestOwnerLimiter(TestCase):
+    def assert_refused(self, limiter, owner, reason, retry_after=None,
+                       **kw):
+        err = self.assertRaises(TooManyRequests, limiter.admit, owner, **kw)
+        self.assertEqual(err.reason, reason)
+        if retry_after is not None:
+            self.assertEqual(err.retry_after, retry_after)
+        return err
+
+    def test_no_limits(self):
+        limiter = OwnerLimiter(clock=Clock())
+        for _ in range(100):
+            limiter.admit("owner-1", stream=True)
+        self.assertEqual(limiter.in_flight, {"owner-1": 100})
+        self.assertEqual(len(limiter.buckets), 0)
+
+    def test_rate(self):
+        clock = Clock()
+        limiter = OwnerLimiter(rate=2, burst=3, clock=clock)
+        for _ in range(3):
+            limiter.admit("owner-1")()
+        self.assert_refused(
+            limiter, "owner-1", "Rate limit exceeded", retry_after=0.5)
+        # Other owners have their own buckets.
+        limiter.admit("owner-2")()
+        clock.advance(0.5)
+        limiter.admit("owner-1")()
+        self.assert_refused(limiter, "owner-1", "Rate limit exceeded")
+
+    def test_default_burst(self):
+        limiter = OwnerLimiter(rate=2, clock=Clock())
+        self.assertEqual(limiter.limits_for("owner-1")["burst"], 2)
+        limiter = OwnerLimiter(rate=0.5, clock=Clock())
+        self.assertEqual(limiter.limits_for("owner-1")["burst"], 1)
+        limiter.admit("owner-1")()
+        self.assert_refused(
+            limiter, "owner-1", "Rate limit exceeded", retry_after=2)
+
+    def test_buckets_expire(self):
+        clock = Clock()
+        limiter = OwnerLimiter(rate=1, burst=2, clock=clock)
+        limiter.admit("owner-1")()
+        self.assertEqual(len(limiter.buckets), 1)
+        clock.advance(1)
+        self.assertEqual(limiter.buckets.get("owner-1"), None)
+
+    def test_max_owners(self):
+        limiter = OwnerLimiter(rate=1, max_owners=2, clock=Clock())
+        for owner in ["owner-1", "owner-2", "owner-3"]:
+            limiter.admit(owner)()
+        self.assertEqual(len(limiter.buckets), 2)
+
+    def test_max_concurrent(self):
+        limiter = OwnerLimiter(max_concurrent=2, retry_after=3, clock=Clock())
+        release1 = limiter.admit("owner-1")
+        limiter.admit("owner-1", stream=True)
+        self.assert_refused(
+            limiter, "owner-1", "Too many concurrent requests",
+            retry_after=3)
+        limiter.admit("owner-2")
+        release1()
+        # Releasing twice has no effect.
+        release1()
+        self.assertEqual(limiter.in_flight, {"owner-1": 1, "owner-2": 1})
+        limiter.admit("owner-1")
+        self.assert_refused(limiter, "owner-1", "Too many concurrent requests")
+
+    def test_max_streams(self):
+        limiter = OwnerLimiter(max_streams=1, clock=Clock())
+        release = limiter.admit("owner-1", stream=True)
+        self.assert_refused(
+            limiter, "owner-1", "Too many open streams", stream=True)
+        limiter.admit("owner-1")
+        release()
+        self.assertEqual(limiter.streams, {})
+        limiter.admit("owner-1", stream=True)
+
+    def test_refused_requests_use_no_tokens(self):
+        clock = Clock()
+        limiter = OwnerLimiter(rate=1, max_streams=1, clock=clock)
+        limiter.admit("owner-1", stream=True)
+        self.assert_refused(
+            limiter, "owner-1", "Too many open streams", stream=True)
+        self.assertEqual(len(limiter.buckets), 1)
+        clock.advance(1)
+        limiter.admit("owner-1")
+
+    def test_owner_overrides(self):
+        limiter = OwnerLimiter(
+            max_concurrent=1, owners={"owner-2": {"max_concurrent": None}},
+            clock=Clock())
+        limiter.admit("owner-1")
+        self.assert_refused(limiter, "owner-1", "Too many concurrent requests")
+        for _ in range(5):
+            limiter.admit("owner-2")
+        self.assertEqual(limiter.limits_for("owner-2"), {
+            "rate": None, "burst": None, "max_concurrent": None,
+            "max_streams": None,
+        })
+
+    def test_invalid_limits(self):
+        self.assertRaises(
+            ValueError, OwnerLimiter, owners={"owner-1": {"rat": 1}})
+        self.assertRaises(ValueError, OwnerLimiter, rate=0)
+        self.assertRaises(
+            ValueError, OwnerLimiter, owners={"owner-1": {"rate": -1}})
+
+    def test_from_config(self):
+        clock = Clock()
+        limiter = OwnerLimiter.from_config({
+            "rate": 5,
+            "max_streams": 2,
+            "owners": {"owner-1": {"rate": 50}},
+        }, clock=clock)
+        self.assertTrue(limiter.clock is clock)
+        self.assertEqual(limiter.limits_for("owner-1")["rate"], 50)
+        self.assertEqual(limiter.limits_for("owner-2"), {
+            "rate": 5, "burst": 5, "max_concurrent": None, "max_streams": 2,
+        })
+        self.assertRaises(
+            ValueError, OwnerLimiter.from_config, {"unknown": 1})
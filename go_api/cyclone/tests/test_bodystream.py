@@ -0,0 +1,209 @@
+from twisted.trial.unittest import TestCase
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from cyclone.web import Application
+
+from go_api.cyclone.bodystream import (
+    RequestBodyLost, RequestBodyStream, StreamingHTTPConnection)
+
+
+class TestRequestBodyStream(TestCase):
+    def test_lines(self):
+        stream = RequestBodyStream()
+        stream.data_received("foo\nba")
+        stream.data_received("r\n\nba")
+        self.assertEqual(stream.pending, 3)
+        self.assertEqual(stream.buffered, 8)
+        self.assertEqual(
+            self.successResultOf(stream.get_lines(2)), ["foo", "bar"])
+        self.assertEqual(self.successResultOf(stream.get_lines(2)), [""])
+        d = stream.get_lines(2)
+        self.assertNoResult(d)
+        stream.data_received("z")
+        self.assertNoResult(d)
+        stream.finish()
+        self.assertEqual(self.successResultOf(d), ["baz"])
+        self.assertEqual(self.successResultOf(stream.get_lines(2)), [])
+        self.assertEqual(stream.buffered, 0)
+
+    def test_waiting_get(self):
+        stream = RequestBodyStream()
+        d = stream.get_lines(10)
+        self.assertRaises(RuntimeError, stream.get_lines, 10)
+        stream.data_received("foo\nbar\n")
+        self.assertEqual(self.successResultOf(d), ["foo", "bar"])
+
+    def test_finish_trailing_newline(self):
+        stream = RequestBodyStream()
+        stream.data_received("foo\n")
+        stream.finish()
+        self.assertEqual(self.successResultOf(stream.get_lines(10)), ["foo"])
+        self.assertEqual(self.successResultOf(stream.get_lines(10)), [])
+
+    def test_from_body(self):
+        stream = RequestBodyStream.from_body("foo\nbar")
+        self.assertTrue(stream.finished)
+        self.assertEqual(
+            self.successResultOf(stream.get_lines(10)), ["foo", "bar"])
+
+    def test_overlong_lines(self):
+        stream = RequestBodyStream(max_line_length=3)
+        stream.data_received("foo\nba")
+        stream.data_received("rbaz\nq")
+        self.assertEqual(stream.buffered, 4)
+        stream.data_received("uux")
+        stream.finish()
+        self.assertEqual(
+            self.successResultOf(stream.get_lines(10)), ["foo", None, None])
+
+    def test_pause_transport(self):
+        transport = StringTransport()
+        stream = RequestBodyStream(transport, buffer_size=6)
+        stream.data_received("foo\nbar\n")
+        self.assertEqual(transport.producerState, 'paused')
+        stream.data_received("baz\n")
+        self.successResultOf(stream.get_lines(1))
+        self.assertEqual(transport.producerState, 'paused')
+        self.successResultOf(stream.get_lines(1))
+        self.assertEqual(transport.producerState, 'producing')
+        self.assertFalse(stream.paused)
+
+    def test_pause_transport_partial_line(self):
+        transport = StringTransport()
+        stream = RequestBodyStream(transport, buffer_size=4)
+        stream.data_received("foob")
+        self.assertEqual(transport.producerState, 'paused')
+
+    def test_fail(self):
+        stream = RequestBodyStream()
+        stream.data_received("foo\n")
+        d = stream.get_lines(10)
+        self.assertEqual(self.successResultOf(d), ["foo"])
+        d = stream.get_lines(10)
+        stream.fail(Failure(ConnectionLost("Gone")))
+        f = self.failureResultOf(d, RequestBodyLost)
+        self.assertTrue("Gone" in str(f.value))
+        self.failureResultOf(stream.get_lines(10), RequestBodyLost)
+
+    def test_discard(self):
+        transport = StringTransport()
+        stream = RequestBodyStream(transport, buffer_size=4)
+        stream.data_received("foo\nbar\n")
+        self.assertEqual(transport.producerState, 'paused')
+        stream.discard()
+        self.assertEqual(transport.producerState, 'producing')
+        stream.data_received("baz\nquux\n")
+        self.assertEqual(stream.buffered, 0)
+        self.assertEqual(stream.pending, 0)
+
+
+class StreamingApp(Application):
+    """
+    An application that records the requests it's called with, and streams
+    the bodies of POST requests.
+    """
+
+    def __init__(self):
+        Application.__init__(self, [])
+        self.requests = []
+
+    def streams_request_body(self, request):
+        return request.method == "POST"
+
+    def __call__(self, request):
+        self.requests.append(request)
+
+
+class TestStreamingHTTPConnection(TestCase):
+    def mk_connection(self, app=None):
+        if app is None:
+            app = StreamingApp()
+        conn = StreamingHTTPConnection()
+        conn.factory = app
+        conn.makeConnection(StringTransport())
+        return conn
+
+    def test_streams_body(self):
+        conn = self.mk_connection()
+        requests = conn.factory.requests
+        conn.dataReceived(
+            "POST /foo HTTP/1.1\r\nContent-Length: 11\r\n\r\nfoo\nb")
+        [request] = requests
+        self.assertEqual(request.body, "")
+        stream = request.body_stream
+        self.assertEqual(self.successResultOf(stream.get_lines(10)), ["foo"])
+        d = stream.get_lines(10)
+        conn.dataReceived("ar\nba")
+        self.assertEqual(self.successResultOf(d), ["bar"])
+        self.assertFalse(stream.finished)
+        conn.dataReceived("zGET /bar HTTP/1.1\r\n\r\n")
+        self.assertTrue(stream.finished)
+        self.assertEqual(
+            self.successResultOf(stream.get_lines(10)), ["baz"])
+        self.assertEqual([r.path for r in requests], ["/foo", "/bar"])
+
+    def test_buffers_other_bodies(self):
+        conn = self.mk_connection()
+        conn.dataReceived("PUT /foo HTTP/1.1\r\nContent-Length: 4\r\n\r\nfo")
+        self.assertEqual(conn.factory.requests, [])
+        conn.dataReceived("o\n")
+        [request] = conn.factory.requests
+        self.assertEqual(request.body, "foo\n")
+        self.assertFalse(hasattr(request, "body_stream"))
+
+    def test_no_body(self):
+        conn = self.mk_connection()
+        conn.dataReceived("POST /foo HTTP/1.1\r\n\r\n")
+        [request] = conn.factory.requests
+        self.assertEqual(request.body, "")
+        self.assertFalse(hasattr(request, "body_stream"))
+
+    def test_plain_application(self):
+        conn = self.mk_connection(Application([]))
+        conn.dataReceived(
+            "POST /foo HTTP/1.1\r\nContent-Length: 4\r\n\r\nfo")
+        self.assertEqual(conn.transport.value(), "")
+        conn.dataReceived("o\n")
+        self.assertTrue(conn.transport.value().startswith("HTTP/1.1 "))
+
+    def test_backpressure(self):
+        conn = self.mk_connection()
+        conn.dataReceived(
+            "POST /foo HTTP/1.1\r\nContent-Length: 200000\r\n\r\n")
+        [request] = conn.factory.requests
+        stream = request.body_stream
+        conn.dataReceived("x" * 100 + "\n")
+        self.assertEqual(conn.transport.producerState, 'producing')
+        conn.dataReceived("x" * stream.buffer_size + "\n")
+        self.assertEqual(conn.transport.producerState, 'paused')
+        self.successResultOf(stream.get_lines(10))
+        self.assertEqual(conn.transport.producerState, 'producing')
+
+    def test_connection_lost(self):
+        conn = self.mk_connection()
+        conn.dataReceived(
+            "POST /foo HTTP/1.1\r\nContent-Length: 10\r\n\r\nfoo\n")
+        [request] = conn.factory.requests
+        stream = request.body_stream
+        conn.connectionLost(Failure(ConnectionLost("Gone")))
+        self.assertEqual(
+            self.successResultOf(stream.get_lines(10)), ["foo"])
+        self.failureResultOf(stream.get_lines(10), RequestBodyLost)
+
+    def test_request_finished_early(self):
+        conn = self.mk_connection()
+        conn.dataReceived(
+            "POST /foo HTTP/1.1\r\nContent-Length: 200000\r\n\r\n")
+        [request] = conn.factory.requests
+        stream = request.body_stream
+        conn.dataReceived("x" * stream.buffer_size + "\n")
+        self.assertEqual(conn.transport.producerState, 'paused')
+        request.finish()
+        self.assertTrue(stream.discarded)
+        self.assertEqual(conn.transport.producerState, 'producing')
+        conn.dataReceived("x" * (200000 - stream.buffer_size - 1))
+        conn.dataReceived("GET /bar HTTP/1.1\r\n\r\n")
+        self.assertEqual(
+            [r.path for r in conn.factory.requests], ["/foo", "/bar"])
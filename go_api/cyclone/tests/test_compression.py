@@ -0,0 +1,170 @@
+import zlib
+
+from twisted.trial.unittest import TestCase
+
+from go_api.cyclone.compression import (
+    CompressionTransform, compression_transform, negotiate_encoding)
+
+
+class DummyRequest(object):
+    def __init__(self, accept_encoding=None, http_1_1=True):
+        self.headers = {}
+        if accept_encoding is not None:
+            self.headers["Accept-Encoding"] = accept_encoding
+        self.supports_http_1_1 = lambda: http_1_1
+
+
+def json_headers(**kw):
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    headers.update(kw)
+    return headers
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class TestNegotiateEncoding(TestCase):
+    def test_empty(self):
+        self.assertEqual(negotiate_encoding(""), None)
+
+    def test_gzip(self):
+        self.assertEqual(negotiate_encoding("gzip"), "gzip")
+        self.assertEqual(negotiate_encoding("GZIP"), "gzip")
+
+    def test_deflate(self):
+        self.assertEqual(negotiate_encoding("deflate"), "deflate")
+
+    def test_prefers_gzip(self):
+        self.assertEqual(negotiate_encoding("deflate, gzip"), "gzip")
+
+    def test_qvalues(self):
+        self.assertEqual(
+            negotiate_encoding("gzip;q=0.5, deflate;q=0.8"), "deflate")
+        self.assertEqual(negotiate_encoding("gzip;q=0"), None)
+        self.assertEqual(negotiate_encoding("gzip;q=foo"), None)
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate_encoding("*"), "gzip")
+        self.assertEqual(negotiate_encoding("gzip;q=0, *"), "deflate")
+        self.assertEqual(negotiate_encoding("*;q=0"), None)
+
+    def test_unsupported(self):
+        self.assertEqual(negotiate_encoding("br, identity"), None)
+
+
+class TestCompressionTransform(TestCase):
+    def mk_transform(self, accept_encoding="gzip", min_size=10, **kw):
+        transform_cls = compression_transform(min_size=min_size)
+        return transform_cls(DummyRequest(accept_encoding, **kw))
+
+    def test_invalid_level(self):
+        self.assertRaises(ValueError, compression_transform, level=0)
+        self.assertRaises(ValueError, compression_transform, level=10)
+
+    def test_compression_transform_settings(self):
+        transform_cls = compression_transform(min_size=5, level=1)
+        self.assertTrue(issubclass(transform_cls, CompressionTransform))
+        self.assertEqual(transform_cls.min_size, 5)
+        self.assertEqual(transform_cls.level, 1)
+
+    def test_finished_response(self):
+        transform = self.mk_transform()
+        body = '{"foo": "%s"}' % ("x" * 100,)
+        headers = json_headers(**{"Content-Length": str(len(body))})
+        status, headers, chunk = transform.transform_first_chunk(
+            200, headers, body, True)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(headers["Content-Length"], str(len(chunk)))
+        self.assertEqual(gunzip(chunk), body)
+
+    def test_deflate(self):
+        transform = self.mk_transform("deflate")
+        body = '{"foo": "%s"}' % ("x" * 100,)
+        _, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), body, True)
+        self.assertEqual(headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(chunk), body)
+
+    def test_small_response(self):
+        transform = self.mk_transform(min_size=100)
+        _, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), '{"foo": 1}', True)
+        self.assertEqual(chunk, '{"foo": 1}')
+        self.assertFalse("Content-Encoding" in headers)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+
+    def test_not_accepted(self):
+        transform = self.mk_transform(None)
+        _, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "x" * 100, True)
+        self.assertEqual(chunk, "x" * 100)
+        self.assertFalse("Content-Encoding" in headers)
+
+    def test_http_1_0(self):
+        transform = self.mk_transform(http_1_1=False)
+        _, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), "x" * 100, True)
+        self.assertEqual(chunk, "x" * 100)
+
+    def test_other_content_type(self):
+        transform = self.mk_transform()
+        headers = {"Content-Type": "image/png"}
+        _, headers, chunk = transform.transform_first_chunk(
+            200, headers, "x" * 100, True)
+        self.assertEqual(chunk, "x" * 100)
+        self.assertFalse("Vary" in headers)
+
+    def test_not_modified(self):
+        transform = self.mk_transform()
+        _, headers, chunk = transform.transform_first_chunk(
+            304, json_headers(Etag='"abc"'), "", True)
+        self.assertFalse("Content-Encoding" in headers)
+        self.assertEqual(headers["Etag"], '"abc"')
+
+    def test_already_encoded(self):
+        transform = self.mk_transform()
+        headers = json_headers(**{"Content-Encoding": "br"})
+        _, headers, chunk = transform.transform_first_chunk(
+            200, headers, "x" * 100, True)
+        self.assertEqual(chunk, "x" * 100)
+        self.assertEqual(headers["Content-Encoding"], "br")
+
+    def test_weakens_etag(self):
+        transform = self.mk_transform()
+        _, headers, _ = transform.transform_first_chunk(
+            200, json_headers(Etag='"abc"'), "x" * 100, True)
+        self.assertEqual(headers["Etag"], 'W/"abc"')
+
+    def test_appends_to_vary(self):
+        transform = self.mk_transform()
+        _, headers, _ = transform.transform_first_chunk(
+            200, json_headers(Vary="Cookie"), "x" * 100, True)
+        self.assertEqual(headers["Vary"], "Cookie, Accept-Encoding")
+
+    def test_streamed_response(self):
+        transform = self.mk_transform(min_size=1000)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Streamed responses are compressed even if the first chunk is
+        # small.
+        _, headers, chunk = transform.transform_first_chunk(
+            200, json_headers(), '{"id": 1}\n', False)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        # Each chunk is sync flushed, so it can be decompressed in full.
+        self.assertEqual(decompressor.decompress(chunk), '{"id": 1}\n')
+        chunk = transform.transform_chunk('{"id": 2}\n', False)
+        self.assertEqual(decompressor.decompress(chunk), '{"id": 2}\n')
+        self.assertEqual(transform.transform_chunk("", False), "")
+        chunk = transform.transform_chunk('{"id": 3}\n', True)
+        self.assertEqual(decompressor.decompress(chunk), '{"id": 3}\n')
+        self.assertEqual(decompressor.unused_data, "")
+
+    def test_streamed_response_with_content_length(self):
+        transform = self.mk_transform()
+        headers = json_headers(**{"Content-Length": "100"})
+        _, headers, chunk = transform.transform_first_chunk(
+            200, headers, "x" * 50, False)
+        self.assertEqual(chunk, "x" * 50)
+        self.assertEqual(transform.transform_chunk("x" * 50, True), "x" * 50)
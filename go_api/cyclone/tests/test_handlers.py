@@ -1,23 +1,44 @@
 import json
+import threading
+import zlib
 
 import treq
 import yaml
 
 from twisted.trial.unittest import TestCase
+from twisted.internet.task import Clock, deferLater
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.server import NOT_DONE_YET
 from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+from twisted.test.proto_helpers import StringTransport
 from twisted.internet.defer import (
-    maybeDeferred, inlineCallbacks, succeed, returnValue)
+    CancelledError, Deferred, gatherResults, maybeDeferred, inlineCallbacks,
+    succeed, returnValue)
 
+from cyclone.httpserver import HTTPConnection, HTTPRequest
 from cyclone.web import Application, HTTPError, RequestHandler
 
+from go_api.cache import LRUCache
 from go_api.collections import InMemoryCollection
 from go_api.collections.errors import CollectionUsageError
+from go_api.queue import (
+    PausingDeferredQueue, PausingQueueCancelled, PausingQueueCloseMarker)
+from go_api.cyclone import handlers as handlers_module
 from go_api.cyclone.handlers import (
     RouteParseError, BaseHandler, CollectionHandler, ElementHandler,
+    BulkHandler, ImportHandler, StreamProducer,
     duplicates, join_paths, parse_route_vars, create_urlspec_regex,
     ApiApplication, owner_from_header, owner_from_path_kwarg,
     owner_from_oauth2_bouncer, owner_from_static_value)
+from go_api.cyclone.bodystream import StreamingHTTPConnection
+from go_api.cyclone.compression import CompressionTransform
+from go_api.cyclone.metrics import MetricsHandler
+from go_api.cyclone.router import RouteTrie
 from go_api.cyclone.helpers import HandlerHelper, AppHelper, MockHttpServer
+from go_api.jsoncodec import JsonCodec, stdlib_codec
+from go_api.utils import simulate_async
 
 
 class DummyError(Exception):
@@ -31,6 +52,59 @@ class DummyHandler(BaseHandler):
         self.write_object(self.model)
 
 
+class FieldlessCollection(object):
+    """
+    A collection whose methods were written before field selection was
+    added, so they don't accept ``fields``.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def stream(self, query):
+        return self.collection.stream(query)
+
+    def page(self, cursor, max_results, query):
+        return self.collection.page(cursor, max_results, query)
+
+    def get(self, object_id):
+        return self.collection.get(object_id)
+
+
+class VersionedFieldlessCollection(FieldlessCollection):
+    def get_version(self, object_id):
+        return self.collection.get_version(object_id)
+
+    def get_collection_version(self):
+        return self.collection.get_collection_version()
+
+    def get_with_version(self, object_id):
+        return self.collection.get_with_version(object_id)
+
+    def page_with_version(self, cursor, max_results, query):
+        return self.collection.page_with_version(cursor, max_results, query)
+
+
+def mk_thread_pool(test_case, threads=1):
+    """
+    Start a thread pool that is stopped when the test finishes.
+    """
+    pool = ThreadPool(minthreads=0, maxthreads=threads)
+    pool.start()
+    test_case.addCleanup(pool.stop)
+    return pool
+
+
+def thread_recording_codec(threads):
+    """
+    Return a JSON codec that records the threads it encodes in.
+    """
+    def dumps(obj):
+        threads.append(threading.current_thread())
+        return json.dumps(obj)
+    return JsonCodec("recording", dumps, json.loads)
+
+
 def raise_usage_error(*args, **kw):
     """
     Function that raises a generic :class:`CollectionUsageError`. For use in
@@ -47,6 +121,39 @@ def raise_dummy_error(*args, **kw):
     raise DummyError("You pushed the red button")
 
 
+class FakeTransport(object):
+    """
+    Transport that records producer registrations.
+    """
+    def __init__(self):
+        self.producer = None
+        self.unregistered = False
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        self.streaming = streaming
+
+    def unregisterProducer(self):
+        self.unregistered = True
+
+
+@inlineCallbacks
+def raw_get(app_helper, url_suffix, headers=None):
+    """
+    Make a GET request to an app without treq's transparent gzip decoding.
+    Return the response and the raw body.
+    """
+    from twisted.internet import reactor
+    server = reactor.listenTCP(0, app_helper.app, interface="127.0.0.1")
+    url = 'http://127.0.0.1:%d%s' % (server.getHost().port, url_suffix)
+    agent = Agent(reactor, pool=HTTPConnectionPool(reactor, persistent=False))
+    headers = Headers(dict((k, [v]) for k, v in (headers or {}).items()))
+    response = yield agent.request('GET', url, headers)
+    body = yield readBody(response)
+    yield server.stopListening()
+    returnValue((response, body))
+
+
 class TestJoinPaths(TestCase):
     def test_none(self):
         self.assertEqual(join_paths(""), "")
@@ -200,6 +307,129 @@ class TestBaseHandler(TestCase):
             {"id": "obj2"},
         ])
 
+    def mk_streaming_handler(self, flush_size):
+        writes = []
+        handler = self.handler_helper.mk_handler()
+        handler.settings['json_codec'] = stdlib_codec()
+        handler.stream_flush_size = flush_size
+        handler.request.connection.transport = FakeTransport()
+        handler.write = lambda d: writes.append(d)
+        handler.flush = lambda: writes.append("<flush>")
+        return handler, writes
+
+    def test_write_queue_flushes(self):
+        handler, writes = self.mk_streaming_handler(flush_size=20)
+        q = PausingDeferredQueue()
+        q.put_many([{"id": "obj1"}, {"id": "obj2"}])
+        d = handler.write_queue(q)
+        self.assertEqual(writes, [
+            '{"id": "obj1"}\n', '{"id": "obj2"}\n', '<flush>'])
+        q.put_many([{"id": "obj3"}, PausingQueueCloseMarker()])
+        self.successResultOf(d)
+        # The last chunk is left for the request to flush when it finishes.
+        self.assertEqual(writes[3:], ['{"id": "obj3"}\n'])
+
+    def test_write_queue_registers_producer(self):
+        handler, writes = self.mk_streaming_handler(flush_size=1)
+        transport = handler.request.connection.transport
+        q = PausingDeferredQueue()
+        d = handler.write_queue(q)
+        self.assertTrue(isinstance(transport.producer, StreamProducer))
+        self.assertEqual(transport.streaming, True)
+        self.assertEqual(transport.unregistered, False)
+        q.put(PausingQueueCloseMarker())
+        self.successResultOf(d)
+        self.assertEqual(transport.unregistered, True)
+
+    def test_write_queue_backpressure(self):
+        """
+        While the transport has paused the producer, the handler stops
+        taking objects from the queue, so the queue fills up and pauses
+        whatever is putting objects into it.
+        """
+        handler, writes = self.mk_streaming_handler(flush_size=1)
+        q = PausingDeferredQueue(size=2)
+        d = handler.write_queue(q)
+        producer = handler.request.connection.transport.producer
+        producer.pauseProducing()
+
+        q.put({"id": "obj1"})
+        self.assertEqual(writes, ['{"id": "obj1"}\n', '<flush>'])
+        put_d = q.put({"id": "obj2"})
+        self.successResultOf(put_d)
+        put_d = q.put({"id": "obj3"})
+        self.assertNoResult(put_d)
+        self.assertEqual(len(writes), 2)
+
+        producer.resumeProducing()
+        self.successResultOf(put_d)
+        q.put(PausingQueueCloseMarker())
+        self.successResultOf(d)
+        self.assertEqual(writes[2:], [
+            '{"id": "obj2"}\n', '<flush>', '{"id": "obj3"}\n', '<flush>'])
+
+    def test_write_queue_stopped(self):
+        """
+        If the transport stops the producer, the handler stops reading from
+        the queue.
+        """
+        handler, writes = self.mk_streaming_handler(flush_size=1)
+        q = PausingDeferredQueue()
+        d = handler.write_queue(q)
+        handler.request.connection.transport.producer.stopProducing()
+        q.put({"id": "obj1"})
+        self.successResultOf(d)
+        self.assertEqual(writes, [])
+        # Whatever is filling the queue is told to stop.
+        self.assertTrue(q.cancelled)
+
+    def test_write_queue_connection_closed(self):
+        """
+        If the client disconnects, the queue is cancelled and the handler
+        stops waiting for it.
+        """
+        handler, writes = self.mk_streaming_handler(flush_size=1)
+        q = PausingDeferredQueue()
+        d = handler.write_queue(q)
+        q.put({"id": "obj1"})
+        self.assertNoResult(d)
+        handler.on_connection_close()
+        self.assertTrue(q.cancelled)
+        self.successResultOf(d)
+        self.assertEqual(writes, ['{"id": "obj1"}\n', '<flush>'])
+        self.assertRaises(PausingQueueCancelled, q.put, {"id": "obj2"})
+        # Closing the connection after the stream has finished is harmless.
+        handler.on_connection_close()
+
+    def test_json_codec_setting(self):
+        codec = JsonCodec(
+            "test", lambda obj: "<%r>" % (obj,), lambda data: ["decoded"])
+        writes = []
+        handler = self.handler_helper.mk_handler()
+        handler.settings['json_codec'] = codec
+        handler.write = lambda d: writes.append(d)
+        handler.write_object({"id": "foo"})
+        self.assertEqual(writes, ["<{'id': 'foo'}>"])
+        self.assertEqual(handler.parse_json("{}"), ["decoded"])
+
+    def test_json_codec_default(self):
+        handler = self.handler_helper.mk_handler()
+        self.assertTrue(isinstance(handler.json_codec, JsonCodec))
+        self.assertEqual(handler.json_codec.name, 'json')
+
+    def test_parse_json_codec_error(self):
+        class CodecError(ValueError):
+            pass
+
+        def loads(data):
+            raise CodecError("Bad data")
+
+        handler = self.handler_helper.mk_handler()
+        handler.settings['json_codec'] = JsonCodec("test", None, loads)
+        err = self.assertRaises(HTTPError, handler.parse_json, "{")
+        self.assertEqual(err.status_code, 400)
+        self.assertEqual(err.reason, "Invalid JSON: Bad data")
+
     def test_mk_urlspec(self):
         class DummyHandler(BaseHandler):
             route_suffix = '/baz'
@@ -316,6 +546,152 @@ class TestBaseHandler(TestCase):
         yield self._check_content_type(get, 'application/json; charset=utf-8')
 
 
+class TestHandlerTimings(TestCase):
+    def setUp(self):
+        self.handler = HandlerHelper(
+            BaseHandler, handler_kwargs={'model_factory': None}).mk_handler()
+
+    def test_add_timing(self):
+        self.assertEqual(self.handler.timings, None)
+        self.handler.add_timing('foo', 1.5)
+        self.handler.add_timing('bar', 1.0)
+        self.handler.add_timing('foo', 0.5)
+        self.assertEqual(self.handler.timings, {'foo': 2.0, 'bar': 1.0})
+
+    def test_timed(self):
+        d = Deferred()
+        result = self.handler.timed('foo', lambda x: d, 'x')
+        self.assertNoResult(result)
+        self.assertEqual(self.handler.timings, None)
+        d.callback('bar')
+        self.assertEqual(self.successResultOf(result), 'bar')
+        self.assertEqual(self.handler.timings.keys(), ['foo'])
+
+    def test_timed_failure(self):
+        def fail():
+            raise DummyError("Oops")
+        result = self.handler.timed('foo', fail)
+        self.failureResultOf(result, DummyError)
+        self.assertEqual(self.handler.timings.keys(), ['foo'])
+
+    def test_encode_json(self):
+        self.handler.settings['json_codec'] = stdlib_codec()
+        self.assertEqual(self.handler.encode_json({"a": 1}), '{"a": 1}')
+        self.assertEqual(self.handler.timings.keys(), ['serialization'])
+
+    @inlineCallbacks
+    def test_encode_json_in_thread(self):
+        threads = []
+        self.handler.settings['json_codec'] = thread_recording_codec(threads)
+        self.handler.settings['serialization_pool'] = mk_thread_pool(self)
+        data = yield self.handler.encode_json_in_thread({"a": 1})
+        self.assertEqual(data, '{"a": 1}')
+        [thread] = threads
+        self.assertNotEqual(thread, threading.current_thread())
+        self.assertEqual(
+            sorted(self.handler.timings.keys()),
+            ['serialization', 'threaded_serialization'])
+
+
+class TestHandlerDeadlines(TestCase):
+    def mk_handler(self, **kw):
+        kw.setdefault('model_factory', None)
+        handler = HandlerHelper(BaseHandler, handler_kwargs=kw).mk_handler()
+        self.addCleanup(handler.clear_deadline)
+        return handler
+
+    def test_no_deadline(self):
+        handler = self.mk_handler()
+        self.assertEqual(handler.time_remaining(), None)
+        handler.start_deadline()
+        self.assertEqual(handler._deadline_call, None)
+        d = Deferred()
+        self.assertTrue(handler.cancel_at_deadline(d) is d)
+        self.assertEqual(handler._cancel_at_deadline, set())
+
+    def test_time_remaining(self):
+        handler = self.mk_handler(request_timeout=5)
+        remaining = handler.time_remaining()
+        self.assertTrue(4 < remaining <= 5)
+        handler.deadline -= 10
+        self.assertEqual(handler.time_remaining(), 0)
+
+    def test_start_deadline(self):
+        handler = self.mk_handler(request_timeout=5)
+        handler.start_deadline()
+        call = handler._deadline_call
+        self.assertTrue(call.active())
+        handler.start_deadline()
+        self.assertTrue(handler._deadline_call is call)
+        handler.clear_deadline()
+        self.assertFalse(call.active())
+        self.assertEqual(handler.time_remaining(), None)
+
+    def test_expire_deadline(self):
+        handler = self.mk_handler(request_timeout=5)
+        d1, d2 = Deferred(), Deferred()
+        result1 = handler.timed('collection', lambda: d1)
+        result2 = handler.timed('collection', lambda: d2)
+        d2.callback('foo')
+        self.assertEqual(handler._cancel_at_deadline, set([d1]))
+        handler._expire_deadline()
+        self.assertTrue(handler.deadline_expired)
+        self.failureResultOf(result1, CancelledError)
+        self.assertEqual(self.successResultOf(result2), 'foo')
+        self.assertEqual(handler.timings.keys(), ['collection'])
+
+    def test_start_stream_clears_deadline(self):
+        handler = self.mk_handler(request_timeout=5)
+        handler.start_deadline()
+        handler.cancel_at_deadline(Deferred())
+        handler.start_stream()
+        handler.end_stream()
+        self.assertEqual(handler._deadline_call, None)
+        self.assertEqual(handler._cancel_at_deadline, set())
+        self.assertEqual(handler.time_remaining(), None)
+
+    def test_raise_err_after_deadline(self):
+        handler = self.mk_handler(request_timeout=5)
+        handler.deadline_expired = True
+        self.assertRaises(
+            CancelledError, handler.raise_err, Failure(CancelledError()),
+            500, "Eep")
+        self.assertRaises(
+            DummyError, handler.raise_err, Failure(DummyError()), 500, "Eep")
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+    def test_mk_urlspec_request_timeout(self):
+        spec = BaseHandler.mk_urlspec("/foo", None)
+        self.assertEqual(spec.kwargs, {"model_factory": None})
+        spec = BaseHandler.mk_urlspec("/foo", None, request_timeout=2)
+        self.assertEqual(
+            spec.kwargs, {"model_factory": None, "request_timeout": 2})
+
+
+class TestStreamProducer(TestCase):
+    def test_wait_not_paused(self):
+        producer = StreamProducer()
+        self.successResultOf(producer.wait_for_resume())
+
+    def test_wait_paused(self):
+        producer = StreamProducer()
+        producer.pauseProducing()
+        d = producer.wait_for_resume()
+        self.assertNoResult(d)
+        producer.resumeProducing()
+        self.successResultOf(d)
+        self.assertEqual(producer.paused, False)
+
+    def test_wait_stopped(self):
+        producer = StreamProducer()
+        producer.pauseProducing()
+        d = producer.wait_for_resume()
+        producer.stopProducing()
+        self.successResultOf(d)
+        self.assertEqual(producer.stopped, True)
+        self.successResultOf(producer.wait_for_resume())
+
+
 class BaseHandlerTestCase(TestCase):
     @inlineCallbacks
     def check_error_response(self, resp, status_code, reason, **kw):
@@ -347,6 +723,44 @@ class TestCollectionHandler(BaseHandlerTestCase):
             urlspec=CollectionHandler.mk_urlspec(
                 '/root', self.model_factory))
 
+    def mk_serialization_app_helper(self, threads, **settings):
+        return AppHelper(Application(
+            [CollectionHandler.mk_urlspec('/root', self.model_factory)],
+            json_codec=thread_recording_codec(threads),
+            serialization_pool=mk_thread_pool(self), **settings))
+
+    @inlineCallbacks
+    def test_get_page_serialized_in_thread(self):
+        threads = []
+        app_helper = self.mk_serialization_app_helper(
+            threads, serialization_threshold=3)
+        data = yield app_helper.get('/root/?max_results=3', parser='json')
+        self.assertEqual(data, {
+            "cursor": 3,
+            "data": [{"id": "obj1"}, {"id": "obj2"}, {"id": "obj3"}],
+        })
+        [thread] = threads
+        self.assertNotEqual(thread, threading.current_thread())
+
+    @inlineCallbacks
+    def test_get_small_page_not_serialized_in_thread(self):
+        threads = []
+        app_helper = self.mk_serialization_app_helper(
+            threads, serialization_threshold=3)
+        data = yield app_helper.get('/root/?max_results=2', parser='json')
+        self.assertEqual(data, {
+            "cursor": 2,
+            "data": [{"id": "obj1"}, {"id": "obj2"}],
+        })
+        self.assertEqual(threads, [threading.current_thread()])
+
+    @inlineCallbacks
+    def test_get_page_serialization_threshold_default(self):
+        threads = []
+        app_helper = self.mk_serialization_app_helper(threads)
+        yield app_helper.get('/root/', parser='json')
+        self.assertEqual(threads, [threading.current_thread()])
+
     @inlineCallbacks
     def test_get_stream(self):
         data = yield self.app_helper.get('/root/?stream=true',
@@ -376,6 +790,71 @@ class TestCollectionHandler(BaseHandlerTestCase):
             ],
         })
 
+    @inlineCallbacks
+    def test_get_page_query(self):
+        data = yield self.app_helper.get(
+            '/root/?query=id%3D%22obj2%22', parser='json')
+        self.assertEqual(data, {
+            u'cursor': None,
+            u'data': [{u'id': u'obj2'}],
+        })
+
+    @inlineCallbacks
+    def test_get_page_fields(self):
+        yield self.collection.update("obj2", {"name": "Jane", "age": 30})
+        data = yield self.app_helper.get(
+            '/root/?max_results=2&fields=id,name', parser='json')
+        self.assertEqual(data, {
+            u'cursor': 2,
+            u'data': [{u'id': u'obj1'}, {u'id': u'obj2', u'name': u'Jane'}],
+        })
+
+    @inlineCallbacks
+    def test_get_page_fields_etag(self):
+        resp = yield self.app_helper.get('/root/?max_results=2')
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+        resp = yield self.app_helper.get(
+            '/root/?max_results=2&fields=id', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 200)
+        [fields_etag] = resp.headers.getRawHeaders('Etag')
+        self.assertNotEqual(fields_etag, etag)
+        yield resp.content()
+        resp = yield self.app_helper.get(
+            '/root/?max_results=2&fields=id',
+            headers={'If-None-Match': fields_etag})
+        self.assertEqual(resp.code, 304)
+        yield resp.content()
+
+    @inlineCallbacks
+    def test_get_fields_unsupported_by_collection(self):
+        yield self.collection.update("obj2", {"name": "Jane", "age": 30})
+        collection = self.collection
+        for collection_class in [
+                FieldlessCollection, VersionedFieldlessCollection]:
+            self.collection = collection_class(collection)
+            data = yield self.app_helper.get(
+                '/root/?max_results=2&fields=name', parser='json')
+            self.assertEqual(
+                data, {u'cursor': 2, u'data': [{}, {u'name': u'Jane'}]})
+            data = yield self.app_helper.get(
+                '/root/?stream=true&query=age%3D30&fields=name',
+                parser='json_lines')
+            self.assertEqual(data, [{"name": "Jane"}])
+
+    @inlineCallbacks
+    def test_get_page_bad_fields(self):
+        resp = yield self.app_helper.get('/root/?fields=id,')
+        yield self.check_error_response(resp, 400, "Invalid fields: u'id,'")
+
+    @inlineCallbacks
+    def test_get_stream_fields(self):
+        yield self.collection.update("obj2", {"name": "Jane", "age": 30})
+        data = yield self.app_helper.get(
+            '/root/?stream=true&query=age%3D30&fields=name',
+            parser='json_lines')
+        self.assertEqual(data, [{"name": "Jane"}])
+
     @inlineCallbacks
     def test_get_page_bad_limit(self):
         data = yield self.app_helper.get('/root/?max_results=a')
@@ -406,9 +885,91 @@ class TestCollectionHandler(BaseHandlerTestCase):
                 {u'id': u'obj5'},
             ])
 
+    @inlineCallbacks
+    def test_get_page_etag(self):
+        resp = yield self.app_helper.get('/root/?max_results=2')
+        self.assertEqual(resp.code, 200)
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+
+        self.collection.page = raise_dummy_error
+        resp = yield self.app_helper.get(
+            '/root/?max_results=2', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 304)
+        content = yield resp.content()
+        self.assertEqual(content, "")
+        del self.collection.page
+
+        yield self.collection.create("obj6", {})
+        resp = yield self.app_helper.get(
+            '/root/?max_results=2', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 200)
+        self.assertNotEqual(resp.headers.getRawHeaders('Etag'), [etag])
+        yield resp.content()
+
+    @inlineCallbacks
+    def test_get_page_etag_per_page(self):
+        resp = yield self.app_helper.get('/root/?max_results=2')
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+
+        # The collection hasn't changed, but each page has its own ETag.
+        for path in ['/root/?max_results=2&cursor=2', '/root/?max_results=3',
+                     '/root/?max_results=2&query=id%3D%22obj2%22']:
+            resp = yield self.app_helper.get(
+                path, headers={'If-None-Match': etag})
+            self.assertEqual(resp.code, 200)
+            self.assertNotEqual(resp.headers.getRawHeaders('Etag'), [etag])
+            yield resp.content()
+
+    @inlineCallbacks
+    def test_get_page_fetches_version_with_data(self):
+        calls = []
+        page_with_version = self.collection.page_with_version
+
+        def record(*args, **kw):
+            calls.append('page_with_version')
+            return page_with_version(*args, **kw)
+        self.collection.page_with_version = record
+        self.collection.get_collection_version = raise_dummy_error
+        data = yield self.app_helper.get('/root/?max_results=1', parser='json')
+        self.assertEqual(data, {"cursor": 1, "data": [{"id": "obj1"}]})
+        self.assertEqual(calls, ['page_with_version'])
+
+    @inlineCallbacks
+    def test_get_page_keyset_cursor(self):
+        self.collection.keyset_cursors = True
+        data = yield self.app_helper.get('/root/?max_results=3', parser='json')
+        cursor = data[u'cursor']
+        self.assertEqual(
+            data[u'data'],
+            [
+                {u'id': u'obj1'},
+                {u'id': u'obj2'},
+                {u'id': u'obj3'},
+            ])
+
+        data = yield self.app_helper.get(
+            '/root/?max_results=3&cursor=%s' % (cursor,), parser='json')
+        self.assertEqual(data[u'cursor'], None)
+        self.assertEqual(
+            data[u'data'],
+            [
+                {u'id': u'obj4'},
+                {u'id': u'obj5'},
+            ])
+
+    @inlineCallbacks
+    def test_get_page_invalid_cursor(self):
+        self.collection.keyset_cursors = True
+        resp = yield self.app_helper.get('/root/?cursor=Zm9v')
+        yield self.check_error_response(
+            resp, 400, "Invalid cursor: 'Zm9v'")
+
     @inlineCallbacks
     def test_get_usage_error(self):
         self.collection.page = raise_usage_error
+        self.collection.page_with_version = raise_usage_error
         resp = yield self.app_helper.get('/root/')
         yield self.check_error_response(
             resp, 400, "Do not push the red button")
@@ -416,6 +977,7 @@ class TestCollectionHandler(BaseHandlerTestCase):
     @inlineCallbacks
     def test_get_server_error(self):
         self.collection.page = raise_dummy_error
+        self.collection.page_with_version = raise_dummy_error
         resp = yield self.app_helper.get('/root/')
         yield self.check_error_response(
             resp, 500, "Failed to retrieve objects.")
@@ -482,6 +1044,204 @@ class TestElementHandler(BaseHandlerTestCase):
             '/root/obj1', parser='json')
         self.assertEqual(data, {"id": "obj1"})
 
+    @inlineCallbacks
+    def test_get_frozen_rows(self):
+        self.collection.frozen_rows = True
+        data = yield self.app_helper.get(
+            '/root/obj1', parser='json')
+        self.assertEqual(data, {"id": "obj1"})
+
+    @inlineCallbacks
+    def test_get_etag(self):
+        resp = yield self.app_helper.get('/root/obj1')
+        self.assertEqual(resp.code, 200)
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 304)
+        self.assertEqual(resp.headers.getRawHeaders('Etag'), [etag])
+        content = yield resp.content()
+        self.assertEqual(content, "")
+
+        # Updating a different object doesn't change the ETag.
+        yield self.collection.update("obj2", {"foo": "bar"})
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 304)
+        yield resp.content()
+
+        yield self.collection.update("obj1", {"foo": "bar"})
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 200)
+        self.assertNotEqual(resp.headers.getRawHeaders('Etag'), [etag])
+        data = yield resp.json()
+        self.assertEqual(data, {"id": "obj1", "foo": "bar"})
+
+    @inlineCallbacks
+    def test_get_not_modified_skips_fetch(self):
+        resp = yield self.app_helper.get('/root/obj1')
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+        self.collection.get = raise_dummy_error
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': 'W/"foo", ' + etag})
+        self.assertEqual(resp.code, 304)
+        yield resp.content()
+
+    @inlineCallbacks
+    def test_get_if_none_match_star(self):
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': '*'})
+        self.assertEqual(resp.code, 304)
+        yield resp.content()
+
+    def record_calls(self, collection, names):
+        calls = []
+
+        def recorder(name, f):
+            def record(*args, **kw):
+                calls.append(name)
+                return f(*args, **kw)
+            return record
+
+        for name in names:
+            method = getattr(collection, name)
+            setattr(collection, name, recorder(name, method))
+        return calls
+
+    @inlineCallbacks
+    def test_get_fetches_version_with_data(self):
+        version = yield self.collection.get_version('obj1')
+        etag = self.handler_helper.mk_handler().version_etag(version)
+        calls = self.record_calls(
+            self.collection, ['get', 'get_version', 'get_with_version'])
+        resp = yield self.app_helper.get('/root/obj1')
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.headers.getRawHeaders('Etag'), [etag])
+        yield resp.content()
+        # The version isn't looked up separately. The in-memory
+        # get_with_version calls get, so that overrides of get are used.
+        self.assertEqual(calls, ['get_with_version', 'get'])
+
+    @inlineCallbacks
+    def test_get_modified_fetches_version_with_data(self):
+        calls = self.record_calls(
+            self.collection, ['get', 'get_version', 'get_with_version'])
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': '"old"'})
+        self.assertEqual(resp.code, 200)
+        data = yield resp.json()
+        self.assertEqual(data, {"id": "obj1"})
+        self.assertEqual(calls, ['get_version', 'get_with_version', 'get'])
+
+    @inlineCallbacks
+    def test_get_without_get_with_version(self):
+        collection = self.collection
+
+        class VersionedCollection(object):
+            def get(self, object_id):
+                return collection.get(object_id)
+
+            def get_version(self, object_id):
+                return collection.get_version(object_id)
+
+        self.collection = VersionedCollection()
+        calls = self.record_calls(self.collection, ['get', 'get_version'])
+        resp = yield self.app_helper.get('/root/obj1')
+        self.assertEqual(resp.code, 200)
+        [etag] = resp.headers.getRawHeaders('Etag')
+        data = yield resp.json()
+        self.assertEqual(data, {"id": "obj1"})
+        self.assertEqual(calls, ['get_version', 'get'])
+
+        del calls[:]
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 304)
+        yield resp.content()
+        resp = yield self.app_helper.get(
+            '/root/obj1', headers={'If-None-Match': '"old"'})
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.headers.getRawHeaders('Etag'), [etag])
+        yield resp.content()
+        self.assertEqual(calls, ['get_version', 'get_version', 'get'])
+
+        resp = yield self.app_helper.get('/root/missing1')
+        yield self.check_error_response(
+            resp, 404, "Object 'missing1' not found.")
+
+    @inlineCallbacks
+    def test_get_without_versions(self):
+        class UnversionedCollection(object):
+            def get(self, object_id):
+                return {"id": object_id}
+
+        self.collection = UnversionedCollection()
+        resp = yield self.app_helper.get('/root/obj1')
+        self.assertEqual(resp.code, 200)
+        data = yield resp.json()
+        self.assertEqual(data, {"id": "obj1"})
+
+    @inlineCallbacks
+    def test_get_fields(self):
+        yield self.collection.update("obj1", {"name": "Jane", "age": 30})
+        data = yield self.app_helper.get(
+            '/root/obj1?fields=name,missing', parser='json')
+        self.assertEqual(data, {"name": "Jane"})
+
+    @inlineCallbacks
+    def test_get_fields_etag(self):
+        resp = yield self.app_helper.get('/root/obj1')
+        [etag] = resp.headers.getRawHeaders('Etag')
+        yield resp.content()
+        resp = yield self.app_helper.get('/root/obj1?fields=id')
+        [fields_etag] = resp.headers.getRawHeaders('Etag')
+        self.assertNotEqual(fields_etag, etag)
+        yield resp.content()
+
+    @inlineCallbacks
+    def test_get_fields_projected_by_handler(self):
+        class UnprojectedCollection(object):
+            def get(self, object_id, fields=None):
+                return {"id": object_id, "name": "Jane", "age": 30}
+
+        self.collection = UnprojectedCollection()
+        data = yield self.app_helper.get(
+            '/root/obj1?fields=age', parser='json')
+        self.assertEqual(data, {"age": 30})
+
+    @inlineCallbacks
+    def test_get_fields_unsupported_by_collection(self):
+        yield self.collection.update("obj1", {"name": "Jane", "age": 30})
+        collection = self.collection
+        for collection_class in [
+                FieldlessCollection, VersionedFieldlessCollection]:
+            self.collection = collection_class(collection)
+            data = yield self.app_helper.get(
+                '/root/obj1?fields=age', parser='json')
+            self.assertEqual(data, {"age": 30})
+
+    @inlineCallbacks
+    def test_get_fields_unsupported_by_async_collection(self):
+        class AsyncFieldlessCollection(object):
+            @simulate_async
+            def get(self, object_id):
+                return {"id": object_id, "name": "Jane", "age": 30}
+
+        self.collection = AsyncFieldlessCollection()
+        data = yield self.app_helper.get(
+            '/root/obj1?fields=age', parser='json')
+        self.assertEqual(data, {"age": 30})
+
+    @inlineCallbacks
+    def test_get_bad_fields(self):
+        resp = yield self.app_helper.get('/root/obj1?fields=a..b')
+        yield self.check_error_response(
+            resp, 400, "Invalid fields: u'a..b'")
+
     @inlineCallbacks
     def test_get_missing_object(self):
         resp = yield self.app_helper.get('/root/missing1')
@@ -491,6 +1251,7 @@ class TestElementHandler(BaseHandlerTestCase):
     @inlineCallbacks
     def test_get_usage_error(self):
         self.collection.get = raise_usage_error
+        self.collection.get_with_version = raise_usage_error
         resp = yield self.app_helper.get('/root/obj1')
         yield self.check_error_response(
             resp, 400, "Do not push the red button")
@@ -498,6 +1259,7 @@ class TestElementHandler(BaseHandlerTestCase):
     @inlineCallbacks
     def test_get_server_error(self):
         self.collection.get = raise_dummy_error
+        self.collection.get_with_version = raise_dummy_error
         resp = yield self.app_helper.get('/root/obj1')
         yield self.check_error_response(
             resp, 500, "Failed to retrieve 'obj1'")
@@ -586,62 +1348,416 @@ class TestElementHandler(BaseHandlerTestCase):
         self.assertEqual(str(f.value), "You pushed the red button")
 
 
-class TestApiApplication(TestCase):
+class TestBulkHandler(BaseHandlerTestCase):
     def setUp(self):
-        # these helpers should never have their collection factories
-        # called in these tests
-        self._cleanup_funcs = []
-        self.collection_helper = HandlerHelper(
-            CollectionHandler,
-            handler_kwargs={
-                "model_factory": self.uncallable_model_factory,
-            })
-        self.element_helper = HandlerHelper(
-            ElementHandler,
-            handler_kwargs={
-                "model_factory": self.uncallable_model_factory,
-            })
-        self.dummy_helper = HandlerHelper(
-            DummyHandler,
-            handler_kwargs={
-                "model_factory": self.uncallable_model_factory,
-            })
+        self.collection_data = {
+            "obj1": {"id": "obj1"},
+            "obj2": {"id": "obj2"},
+        }
+        self.collection = InMemoryCollection(self.collection_data)
+        self.model_factory = lambda req: self.collection
+        self.app_helper = AppHelper(
+            urlspec=BulkHandler.mk_urlspec('/root', self.model_factory))
 
-    @inlineCallbacks
-    def tearDown(self):
-        for func in reversed(self._cleanup_funcs):
-            yield func()
+    def bulk(self, action, items, **kw):
+        return self.app_helper.post(
+            '/root/_bulk/', data=json.dumps({
+                "action": action,
+                "items": items,
+            }), **kw)
 
-    def add_cleanup(self, func):
-        self._cleanup_funcs.append(func)
+    @inlineCallbacks
+    def test_get(self):
+        data = yield self.bulk("get", ["obj1", "missing1"], parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj1"}},
+            {"status_code": 404, "reason": "Object 'missing1' not found."},
+        ]})
 
     @inlineCallbacks
-    def start_fake_auth_server(self, owner_id):
-        def auth_request(request):
-            request.setHeader("X-Owner-Id", owner_id)
-            return ""
-        fake_server = MockHttpServer(auth_request)
-        yield fake_server.start()
-        self.add_cleanup(fake_server.stop)
-        returnValue(fake_server)
+    def test_create(self):
+        data = yield self.bulk(
+            "create", [{"foo": "bar"}, {"foo": "baz"}], parser='json')
+        [r1, r2] = data["results"]
+        self.assertEqual(r1["status_code"], 200)
+        self.assertEqual(r1["data"], {"id": r1["data"]["id"], "foo": "bar"})
+        self.assertEqual(r2["data"], {"id": r2["data"]["id"], "foo": "baz"})
+        self.assertEqual(
+            self.collection_data[r2["data"]["id"]], r2["data"])
 
-    def get_collection_factory(self, data):
-        collection = InMemoryCollection(data)
-        return lambda _req: collection
+    @inlineCallbacks
+    def test_update(self):
+        data = yield self.bulk(
+            "update", [{"id": "obj2", "foo": "bar"}, {"id": "missing1"}],
+            parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj2", "foo": "bar"}},
+            {"status_code": 404, "reason": "Object 'missing1' not found."},
+        ]})
+        self.assertEqual(
+            self.collection_data["obj2"], {"id": "obj2", "foo": "bar"})
 
-    def get_app_helper(self,
-                       collections=ApiApplication.collections,
-                       models=ApiApplication.models,
-                       preprocessor=ApiApplication.factory_preprocessor,
-                       health_handler=ApiApplication.health_handler,
-                       config=None,
-                       extra_settings=None):
-        class MyApiApplication(ApiApplication):
-            pass
+    @inlineCallbacks
+    def test_delete(self):
+        data = yield self.bulk("delete", ["obj1"], parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj1"}},
+        ]})
+        self.assertTrue("obj1" not in self.collection_data)
 
-        MyApiApplication.collections = collections
+    @inlineCallbacks
+    def test_collection_without_bulk_methods(self):
+        class SingleItemCollection(object):
+            def __init__(self, collection):
+                self.get = collection.get
+                self.create = collection.create
+                self.update = collection.update
+                self.delete = collection.delete
+
+        self.model_factory = lambda req: SingleItemCollection(self.collection)
+        self.app_helper = AppHelper(
+            urlspec=BulkHandler.mk_urlspec('/root', self.model_factory))
+
+        data = yield self.bulk("get", ["obj1", "missing1"], parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj1"}},
+            {"status_code": 404, "reason": "Object 'missing1' not found."},
+        ]})
+        data = yield self.bulk("create", [{"foo": "baz"}], parser='json')
+        [result] = data["results"]
+        self.assertEqual(result["status_code"], 200)
+        obj3_id = result["data"]["id"]
+        self.assertEqual(result["data"], {"id": obj3_id, "foo": "baz"})
+        data = yield self.bulk(
+            "update", [{"id": "obj2", "foo": "bar"}, {"id": "missing1"}],
+            parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj2", "foo": "bar"}},
+            {"status_code": 404, "reason": "Object 'missing1' not found."},
+        ]})
+        data = yield self.bulk("delete", ["obj1"], parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 200, "data": {"id": "obj1"}},
+        ]})
+        self.assertEqual(
+            sorted(self.collection_data), sorted(["obj2", obj3_id]))
+
+    @inlineCallbacks
+    def test_item_server_error(self):
+        def get_many(object_ids):
+            return [(False, Failure(DummyError("You pushed the red button")))]
+        self.collection.get_many = get_many
+        data = yield self.bulk("get", ["obj1"], parser='json')
+        self.assertEqual(data, {"results": [
+            {"status_code": 500, "reason": "Failed to process item."},
+        ]})
+        [f] = self.flushLoggedErrors(DummyError)
+        self.assertEqual(str(f.value), "You pushed the red button")
+
+    @inlineCallbacks
+    def test_usage_error(self):
+        self.collection.get_many = raise_usage_error
+        resp = yield self.bulk("get", ["obj1"])
+        yield self.check_error_response(
+            resp, 400, "Do not push the red button")
+
+    @inlineCallbacks
+    def test_server_error(self):
+        self.collection.get_many = raise_dummy_error
+        resp = yield self.bulk("get", ["obj1"])
+        yield self.check_error_response(
+            resp, 500, "Failed to process bulk request.")
+        [f] = self.flushLoggedErrors(DummyError)
+        self.assertEqual(str(f.value), "You pushed the red button")
+
+    @inlineCallbacks
+    def test_bad_requests(self):
+        resp = yield self.app_helper.post('/root/_bulk/', data='[]')
+        yield self.check_error_response(
+            resp, 400, "Bulk request must be a JSON object")
+        resp = yield self.bulk("get", "obj1")
+        yield self.check_error_response(
+            resp, 400, "Bulk items must be a list")
+        resp = yield self.bulk("frob", [])
+        yield self.check_error_response(
+            resp, 400, "Unknown bulk action: u'frob'")
+        resp = yield self.bulk("get", [1])
+        yield self.check_error_response(
+            resp, 400, "Bulk items must be object ids")
+        resp = yield self.bulk("create", ["obj1"])
+        yield self.check_error_response(
+            resp, 400, "Bulk items must be JSON objects")
+        resp = yield self.bulk("update", [{"foo": "bar"}])
+        yield self.check_error_response(
+            resp, 400, "Bulk items must be object ids")
+
+    @inlineCallbacks
+    def test_too_many_items(self):
+        self.patch(BulkHandler, 'max_items', 1)
+        resp = yield self.bulk("get", ["obj1", "obj2"])
+        yield self.check_error_response(
+            resp, 400, "Too many bulk items (maximum 1)")
+
+
+class StreamingApplication(Application):
+    """
+    An application that passes all request bodies to handlers as they
+    arrive.
+    """
+    protocol = StreamingHTTPConnection
+
+    def streams_request_body(self, request):
+        return True
+
+
+class TestImportHandler(BaseHandlerTestCase):
+    app_class = Application
+
+    def setUp(self):
+        self.collection_data = {}
+        self.collection = InMemoryCollection(self.collection_data)
+        self.model_factory = lambda req: self.collection
+        self.app_helper = AppHelper(self.app_class([
+            ImportHandler.mk_urlspec('/root', self.model_factory)]))
+
+    def import_lines(self, lines, **kw):
+        kw.setdefault('parser', 'json_lines')
+        return self.app_helper.post(
+            '/root/_import/', data="\n".join(lines), **kw)
+
+    def assert_created(self, result, line, data):
+        self.assertEqual(result["line"], line)
+        self.assertEqual(result["status_code"], 200)
+        obj_id = result["data"]["id"]
+        expected = dict(data, id=obj_id)
+        self.assertEqual(result["data"], expected)
+        self.assertEqual(self.collection_data[obj_id], expected)
+
+    @inlineCallbacks
+    def test_import(self):
+        resp = yield self.import_lines(
+            ['{"foo": 1}', '{"foo": 2}', '', '{"foo": 3}', ''], parser=None)
+        self.assertEqual(
+            resp.headers.getRawHeaders('Content-Type'),
+            ['application/json; charset=utf-8'])
+        results = yield self.app_helper._parse_json_lines(resp)
+        [r1, r2, r4] = results
+        self.assert_created(r1, 1, {"foo": 1})
+        self.assert_created(r2, 2, {"foo": 2})
+        self.assert_created(r4, 4, {"foo": 3})
+        self.assertEqual(len(self.collection_data), 3)
+
+    @inlineCallbacks
+    def test_import_empty(self):
+        results = yield self.import_lines([])
+        self.assertEqual(results, [])
+
+    @inlineCallbacks
+    def test_invalid_lines(self):
+        [r1, r2, r3] = yield self.import_lines(
+            ['{"foo": ', '["foo"]', '{"foo": 1}'])
+        self.assertEqual(r1["line"], 1)
+        self.assertEqual(r1["status_code"], 400)
+        self.assertTrue(r1["reason"].startswith("Invalid JSON: "))
+        self.assertEqual(r2, {
+            "line": 2, "status_code": 400,
+            "reason": "Import items must be JSON objects"})
+        self.assert_created(r3, 3, {"foo": 1})
+
+    @inlineCallbacks
+    def test_item_errors(self):
+        create = self.collection.create
+
+        def flaky_create(object_id, data):
+            if data["foo"] == "usage":
+                return raise_usage_error()
+            if data["foo"] == "error":
+                return raise_dummy_error()
+            return create(object_id, data)
+        self.collection.create = flaky_create
+
+        [r1, r2, r3] = yield self.import_lines(
+            ['{"foo": "usage"}', '{"foo": "error"}', '{"foo": "ok"}'])
+        self.assertEqual(r1, {
+            "line": 1, "status_code": 400,
+            "reason": "Do not push the red button"})
+        self.assertEqual(r2, {
+            "line": 2, "status_code": 500,
+            "reason": "Failed to process item."})
+        self.assert_created(r3, 3, {"foo": "ok"})
+        [f] = self.flushLoggedErrors(DummyError)
+        self.assertEqual(str(f.value), "You pushed the red button")
+
+    @inlineCallbacks
+    def test_concurrency(self):
+        """
+        No more than ``import_concurrency`` objects are created at once, and
+        results are returned in order even when objects are created out of
+        order.
+        """
+        from twisted.internet import reactor
+        self.app_helper.app.settings['import_concurrency'] = 3
+        create = self.collection.create
+        in_flight = []
+        max_in_flight = []
+
+        def slow_create(object_id, data):
+            in_flight.append(data)
+            max_in_flight.append(len(in_flight))
+
+            def created(result):
+                in_flight.remove(data)
+                return result
+            # Later lines finish sooner.
+            d = deferLater(reactor, 0.01 / data["n"], lambda: None)
+            d.addCallback(lambda _: create(object_id, data))
+            return d.addCallback(created)
+        self.collection.create = slow_create
+
+        lines = [json.dumps({"n": n}) for n in range(1, 11)]
+        results = yield self.import_lines(lines)
+        self.assertEqual([r["line"] for r in results], range(1, 11))
+        self.assertEqual(
+            [r["data"]["n"] for r in results], range(1, 11))
+        self.assertEqual(max(max_in_flight), 3)
+
+
+class TestImportHandlerStreaming(TestImportHandler):
+    app_class = StreamingApplication
+
+    @inlineCallbacks
+    def test_body_is_streamed(self):
+        requests = []
+
+        def model_factory(handler):
+            requests.append(handler.request)
+            return self.collection
+        self.app_helper = AppHelper(self.app_class([
+            ImportHandler.mk_urlspec('/root', model_factory)]))
+
+        [r1] = yield self.import_lines(['{"foo": 1}'])
+        self.assert_created(r1, 1, {"foo": 1})
+        [request] = requests
+        self.assertEqual(request.body, "")
+        self.assertTrue(request.body_stream.finished)
+
+    def start_import(self, body, **settings):
+        """
+        Start an import request over a connection to a string transport,
+        and return the connection once the request's headers are sent.
+        Objects are created synchronously.
+        """
+        create = self.collection._create
+        self.collection.create = lambda *args: maybeDeferred(create, *args)
+        conn = StreamingHTTPConnection()
+        conn.factory = self.app_class([
+            ImportHandler.mk_urlspec('/root', self.model_factory)],
+            **settings)
+        conn.makeConnection(StringTransport())
+        conn.dataReceived(
+            "POST /root/_import/ HTTP/1.1\r\n"
+            "Content-Length: %d\r\n\r\n" % (len(body),))
+        return conn
+
+    def test_body_read_while_response_unread(self):
+        """
+        The body is read while the client isn't reading the response, so
+        clients that send the whole body before reading don't deadlock.
+        """
+        body = "".join('{"n": %d}\n' % (n,) for n in range(1000))
+        conn = self.start_import(body)
+        # The client doesn't read anything until it has sent the body.
+        conn.transport.producer.pauseProducing()
+        for i in range(0, len(body), 1000):
+            conn.dataReceived(body[i:i + 1000])
+            self.assertEqual(conn.transport.producerState, 'producing')
+        self.assertEqual(len(self.collection_data), 1000)
+        # All the results have been written.
+        self.assertEqual(conn.transport.producer, None)
+        self.assertTrue(conn.transport.value().endswith("0\r\n\r\n"))
+
+    def test_body_paused_once_import_buffer_full(self):
+        body = "".join('{"n": %d}\n' % (n,) for n in range(7000))
+        conn = self.start_import(body, import_buffer_size=1000)
+        producer = conn.transport.producer
+        producer.pauseProducing()
+        for i in range(0, len(body), 1000):
+            conn.dataReceived(body[i:i + 1000])
+        # The results filled the buffer, so the body stopped being read
+        # once the body's own buffer filled up too.
+        created = len(self.collection_data)
+        self.assertTrue(created < 100)
+        self.assertEqual(conn.transport.producerState, 'paused')
+
+        producer.resumeProducing()
+        self.assertEqual(conn.transport.producerState, 'producing')
+        self.assertEqual(len(self.collection_data), 7000)
+
+
+class TestApiApplication(TestCase):
+    def setUp(self):
+        # these helpers should never have their collection factories
+        # called in these tests
+        self._cleanup_funcs = []
+        self.collection_helper = HandlerHelper(
+            CollectionHandler,
+            handler_kwargs={
+                "model_factory": self.uncallable_model_factory,
+            })
+        self.element_helper = HandlerHelper(
+            ElementHandler,
+            handler_kwargs={
+                "model_factory": self.uncallable_model_factory,
+            })
+        self.dummy_helper = HandlerHelper(
+            DummyHandler,
+            handler_kwargs={
+                "model_factory": self.uncallable_model_factory,
+            })
+
+    @inlineCallbacks
+    def tearDown(self):
+        for func in reversed(self._cleanup_funcs):
+            yield func()
+
+    def add_cleanup(self, func):
+        self._cleanup_funcs.append(func)
+
+    @inlineCallbacks
+    def start_fake_auth_server(self, owner_id):
+        def auth_request(request):
+            request.setHeader("X-Owner-Id", owner_id)
+            return ""
+        fake_server = MockHttpServer(auth_request)
+        yield fake_server.start()
+        self.add_cleanup(fake_server.stop)
+        returnValue(fake_server)
+
+    def get_collection_factory(self, data):
+        collection = InMemoryCollection(data)
+        return lambda _req: collection
+
+    def get_app_helper(self,
+                       collections=ApiApplication.collections,
+                       models=ApiApplication.models,
+                       preprocessor=ApiApplication.factory_preprocessor,
+                       health_handler=ApiApplication.health_handler,
+                       bulk_handler=ApiApplication.bulk_handler,
+                       import_handler=ApiApplication.import_handler,
+                       metrics_handler=ApiApplication.metrics_handler,
+                       trie_routing=ApiApplication.trie_routing,
+                       config=None,
+                       extra_settings=None):
+        class MyApiApplication(ApiApplication):
+            pass
+
+        MyApiApplication.collections = collections
         MyApiApplication.models = models
         MyApiApplication.health_handler = health_handler
+        MyApiApplication.bulk_handler = bulk_handler
+        MyApiApplication.import_handler = import_handler
+        MyApiApplication.metrics_handler = metrics_handler
+        MyApiApplication.trie_routing = trie_routing
 
         if callable(preprocessor):
             preprocessor = staticmethod(preprocessor)
@@ -685,6 +1801,108 @@ class TestApiApplication(TestCase):
         content = yield result.content()
         self.assertEqual(json.loads(content), collection_data['foo'])
 
+    @inlineCallbacks
+    def test_process_collection_stream_flush_size(self):
+        collection_data = {
+            'foo': {'id': 'foo'},
+            'bar': {'id': 'bar'},
+        }
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None,
+            extra_settings={'stream_flush_size': 1})
+        result = yield app_helper.request('GET', '/foo/store/?stream=true')
+        # The response was flushed before it finished, so there's no
+        # Content-Length.
+        self.assertEqual(result.headers.getRawHeaders('Content-Length'), None)
+        content = yield result.content()
+        self.assertEqual(
+            [json.loads(l) for l in content.splitlines()],
+            [{'id': 'bar'}, {'id': 'foo'}])
+
+    @inlineCallbacks
+    def test_process_model_request_compressed(self):
+        collection_data = {'foo': {'id': 'foo', 'data': 'x' * 2000}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None,
+            config=self.write_config({'compression_min_size': 1024}))
+        result, content = yield raw_get(
+            app_helper, '/foo/store/foo', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(result.headers.getRawHeaders('Content-Encoding'),
+                         ['gzip'])
+        self.assertEqual(result.headers.getRawHeaders('Vary'),
+                         ['Accept-Encoding'])
+        [etag] = result.headers.getRawHeaders('Etag')
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(
+            json.loads(zlib.decompress(content, 16 + zlib.MAX_WBITS)),
+            collection_data['foo'])
+
+        # The weak ETag still matches.
+        result, _ = yield raw_get(
+            app_helper, '/foo/store/foo',
+            {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(result.code, 304)
+
+        # Clients that don't ask for compression don't get it.
+        result, content = yield raw_get(app_helper, '/foo/store/foo')
+        self.assertEqual(
+            result.headers.getRawHeaders('Content-Encoding'), None)
+        self.assertEqual(json.loads(content), collection_data['foo'])
+
+    @inlineCallbacks
+    def test_process_model_request_not_compressed_by_default(self):
+        collection_data = {'foo': {'id': 'foo', 'data': 'x' * 2000}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None)
+        result, content = yield raw_get(
+            app_helper, '/foo/store/foo', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(
+            result.headers.getRawHeaders('Content-Encoding'), None)
+        [etag] = result.headers.getRawHeaders('Etag')
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(json.loads(content), collection_data['foo'])
+
+    @inlineCallbacks
+    def test_process_model_request_small_not_compressed(self):
+        collection_data = {'foo': {'id': 'foo'}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None,
+            config=self.write_config({'compression_min_size': 1024}))
+        result, content = yield raw_get(
+            app_helper, '/foo/store/foo', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(
+            result.headers.getRawHeaders('Content-Encoding'), None)
+        self.assertEqual(json.loads(content), collection_data['foo'])
+
+    @inlineCallbacks
+    def test_process_collection_stream_compressed(self):
+        collection_data = {
+            'foo': {'id': 'foo'},
+            'bar': {'id': 'bar'},
+        }
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None,
+            config=self.write_config({'compression_min_size': 1024}),
+            extra_settings={'stream_flush_size': 1})
+        result, content = yield raw_get(
+            app_helper, '/foo/store/?stream=true',
+            {'Accept-Encoding': 'deflate'})
+        self.assertEqual(result.headers.getRawHeaders('Content-Encoding'),
+                         ['deflate'])
+        self.assertEqual(
+            [json.loads(l) for l in zlib.decompress(content).splitlines()],
+            [{'id': 'bar'}, {'id': 'foo'}])
+
     @inlineCallbacks
     def test_process_collection_request_no_preprocessor(self):
         collection_data = {'foo': {'id': 'foo'}}
@@ -799,6 +2017,353 @@ class TestApiApplication(TestCase):
             "model_factory": model_factory,
         })
 
+    def test_metrics_routes(self):
+        app_helper = self.get_app_helper(metrics_handler=MetricsHandler)
+        routes = app_helper.app.handlers[0][1]
+        [_health_route, metrics_route] = routes
+        self.assertEqual(metrics_route.handler_class, MetricsHandler)
+        self.assertEqual(metrics_route.regex.pattern, "/metrics/$")
+        self.assertEqual(
+            metrics_route.kwargs, {"metrics": app_helper.app.metrics})
+
+    def test_no_metrics_routes(self):
+        app_helper = self.get_app_helper()
+        [_health_route] = app_helper.app.handlers[0][1]
+        self.assertEqual(app_helper.app.metrics, None)
+
+    @inlineCallbacks
+    def test_metrics(self):
+        collection_data = {'foo': {'id': 'foo'}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            preprocessor=None,
+            metrics_handler=MetricsHandler)
+        metrics = app_helper.app.metrics
+        yield app_helper.get('/owner-1/store/foo', parser='json')
+        yield app_helper.get('/owner-1/store/', parser='json')
+        yield app_helper.get('/owner-1/store/missing', parser='bytes')
+        yield app_helper.get('/nothing/here', parser='bytes')
+
+        self.assertEqual(metrics.requests, {
+            ('/:owner_id/store/:elem_id', 'GET', 200): 1,
+            ('/:owner_id/store/', 'GET', 200): 1,
+            ('/:owner_id/store/:elem_id', 'GET', 404): 1,
+            ('unmatched', 'GET', 404): 1,
+        })
+        elem_key = ('/:owner_id/store/:elem_id', 'GET')
+        self.assertEqual(metrics.durations[elem_key].count, 2)
+        phase_counts = dict(
+            (phase, metrics.phase_durations[elem_key + (phase,)].count)
+            for phase in ['model_factory', 'collection', 'serialization'])
+        # Only the successful request serialized a response.
+        self.assertEqual(phase_counts, {
+            'model_factory': 2, 'collection': 2, 'serialization': 1})
+
+        content = yield app_helper.get('/metrics/', parser='bytes')
+        self.assertTrue(
+            'go_api_requests_total{route="/:owner_id/store/",method="GET",'
+            'status="200"} 1' in content.splitlines())
+
+    @inlineCallbacks
+    def test_bulk_routes(self):
+        collection_data = {'foo': {'id': 'foo'}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            models=(('/baz', DummyHandler, self.uncallable_model_factory),),
+            bulk_handler=BulkHandler)
+        bulk_route = app_helper.app.handlers[0][1][-1]
+        self.assertEqual(bulk_route.handler_class, BulkHandler)
+        self.assertEqual(bulk_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_bulk/$")
+
+        result = yield app_helper.post(
+            '/owner-1/store/_bulk/',
+            data=json.dumps({"action": "get", "items": ["foo"]}),
+            headers={"X-Owner-ID": "owner-1"}, parser='json')
+        self.assertEqual(result, {"results": [
+            {"status_code": 200, "data": {"id": "foo"}},
+        ]})
+
+    def test_no_bulk_routes_by_default(self):
+        model_factory = self.get_collection_factory({})
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),))
+        routes = app_helper.app.handlers[0][1]
+        self.assertEqual(
+            [r for r in routes if r.handler_class is BulkHandler], [])
+
+    @inlineCallbacks
+    def test_import_routes(self):
+        collection_data = {}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            bulk_handler=BulkHandler,
+            import_handler=ImportHandler)
+        import_route = app_helper.app.handlers[0][1][-1]
+        self.assertEqual(import_route.handler_class, ImportHandler)
+        self.assertEqual(import_route.regex.pattern,
+                         "/(?P<owner_id>[^/]*)/store/_import/$")
+
+        results = yield app_helper.post(
+            '/owner-1/store/_import/', data='{"foo": 1}\n{"foo": 2}\n',
+            headers={"X-Owner-ID": "owner-1"}, parser='json_lines')
+        self.assertEqual(
+            [(r["line"], r["data"]["foo"]) for r in results], [(1, 1), (2, 2)])
+        self.assertEqual(
+            sorted(o["foo"] for o in collection_data.values()), [1, 2])
+
+    def test_no_import_routes_by_default(self):
+        model_factory = self.get_collection_factory({})
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),))
+        routes = app_helper.app.handlers[0][1]
+        self.assertEqual(
+            [r for r in routes if r.handler_class is ImportHandler], [])
+
+    def test_streams_request_body(self):
+        model_factory = self.get_collection_factory({})
+        app = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            import_handler=ImportHandler).app
+        self.assertEqual(app.protocol, StreamingHTTPConnection)
+        request = HTTPRequest('POST', '/owner-1/store/_import/')
+        self.assertTrue(app.streams_request_body(request))
+        request = HTTPRequest('POST', '/owner-1/store/')
+        self.assertFalse(app.streams_request_body(request))
+        request = HTTPRequest('POST', '/nothing/here')
+        self.assertFalse(app.streams_request_body(request))
+
+    def test_protocol_not_streaming_without_streaming_routes(self):
+        model_factory = self.get_collection_factory({})
+        app = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),)).app
+        self.assertEqual(app.protocol, HTTPConnection)
+        app.add_handlers('.*$', [
+            ImportHandler.mk_urlspec('/store', model_factory)])
+        self.assertEqual(app.protocol, StreamingHTTPConnection)
+
+    @inlineCallbacks
+    def assert_route_matched_once(self, trie_routing):
+        collection_data = {}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            import_handler=ImportHandler,
+            metrics_handler=MetricsHandler,
+            trie_routing=trie_routing)
+        matches = []
+
+        def recording(f):
+            def record(*args):
+                matches.append(args)
+                return f(*args)
+            return record
+        self.patch(RouteTrie, 'match', recording(RouteTrie.match))
+        self.patch(
+            handlers_module, 'match_args',
+            recording(handlers_module.match_args))
+
+        results = yield app_helper.post(
+            '/owner-1/store/_import/', data='{"foo": 1}\n',
+            headers={"X-Owner-ID": "owner-1"}, parser='json_lines')
+        self.assertEqual([r["line"] for r in results], [1])
+        # Streaming the body, dispatching the request and recording its
+        # metrics all used the same match.
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(app_helper.app.metrics.requests, {
+            ('/:owner_id/store/_import/', 'POST', 200): 1})
+
+    def test_route_matched_once(self):
+        return self.assert_route_matched_once(trie_routing=False)
+
+    def test_trie_route_matched_once(self):
+        return self.assert_route_matched_once(trie_routing=True)
+
+    def write_config(self, config):
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump(config, fp)
+        return tempfile
+
+    def test_configure_owner_limits(self):
+        app = ApiApplication()
+        self.assertEqual(app.owner_limiter, None)
+
+        app = ApiApplication(self.write_config({
+            'owner_limits': {
+                'rate': 5,
+                'owners': {'owner-1': {'max_streams': 1}},
+            },
+        }))
+        self.assertEqual(app.owner_limiter.limits_for('owner-1'), {
+            'rate': 5, 'burst': 5, 'max_concurrent': None, 'max_streams': 1,
+        })
+
+        self.assertRaises(
+            ValueError, ApiApplication,
+            self.write_config({'owner_limits': {'rat': 5}}))
+
+    @inlineCallbacks
+    def test_owner_rate_limit(self):
+        factory_calls = []
+
+        def model_factory(owner):
+            factory_calls.append(owner)
+            return InMemoryCollection({'foo': {'id': 'foo'}})
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            config=self.write_config({
+                'owner_limits': {'rate': 0.001, 'burst': 1},
+            }))
+
+        result = yield app_helper.get(
+            '/owner-1/store/foo', headers={'X-Owner-ID': 'owner-1'},
+            parser='json')
+        self.assertEqual(result, {'id': 'foo'})
+
+        resp = yield app_helper.get(
+            '/owner-1/store/foo', headers={'X-Owner-ID': 'owner-1'})
+        content = yield resp.json()
+        self.assertEqual(resp.code, 429)
+        self.assertEqual(content, {
+            'status_code': 429, 'reason': 'Rate limit exceeded'})
+        retry_after = int(resp.headers.getRawHeaders('Retry-After')[0])
+        self.assertTrue(0 < retry_after <= 1000)
+        self.assertEqual(factory_calls, ['owner-1'])
+
+        # Other owners have their own limits.
+        result = yield app_helper.get(
+            '/owner-2/store/foo', headers={'X-Owner-ID': 'owner-2'},
+            parser='json')
+        self.assertEqual(result, {'id': 'foo'})
+
+    @inlineCallbacks
+    def test_owner_concurrency_limit(self):
+        from twisted.internet import reactor
+        collection = InMemoryCollection({'foo': {'id': 'foo'}})
+        pending = []
+
+        def model_factory(owner):
+            d = Deferred()
+            pending.append(d)
+            return d
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            config=self.write_config({
+                'owner_limits': {'max_concurrent': 1, 'retry_after': 5},
+            }))
+        limiter = app_helper.app.owner_limiter
+
+        d = app_helper.get(
+            '/owner-1/store/foo', headers={'X-Owner-ID': 'owner-1'},
+            parser='json')
+        while not pending:
+            yield deferLater(reactor, 0, lambda: None)
+        self.assertEqual(limiter.in_flight, {'owner-1': 1})
+
+        resp = yield app_helper.get(
+            '/owner-1/store/foo', headers={'X-Owner-ID': 'owner-1'})
+        content = yield resp.json()
+        self.assertEqual(resp.code, 429)
+        self.assertEqual(content["reason"], "Too many concurrent requests")
+        self.assertEqual(resp.headers.getRawHeaders('Retry-After'), ['5'])
+        self.assertEqual(len(pending), 1)
+
+        pending[0].callback(collection)
+        result = yield d
+        self.assertEqual(result, {'id': 'foo'})
+        self.assertEqual(limiter.in_flight, {})
+
+    @inlineCallbacks
+    def test_owner_stream_limit(self):
+        collection = InMemoryCollection({'foo': {'id': 'foo'}})
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', lambda _: collection),),
+            config=self.write_config({'owner_limits': {'max_streams': 0}}))
+
+        resp = yield app_helper.get(
+            '/owner-1/store/?stream=true', headers={'X-Owner-ID': 'owner-1'})
+        content = yield resp.json()
+        self.assertEqual(resp.code, 429)
+        self.assertEqual(content["reason"], "Too many open streams")
+
+        result = yield app_helper.get(
+            '/owner-1/store/', headers={'X-Owner-ID': 'owner-1'},
+            parser='json')
+        self.assertEqual(result, {'cursor': None, 'data': [{'id': 'foo'}]})
+        self.assertEqual(app_helper.app.owner_limiter.in_flight, {})
+
+    @inlineCallbacks
+    def test_request_timeout(self):
+        cancelled = []
+        budgets = []
+
+        def model_factory(handler):
+            budgets.append(handler.time_remaining())
+            return Deferred(cancelled.append)
+        app_helper = self.get_app_helper(
+            collections=(('/store', model_factory),),
+            preprocessor=None,
+            config=self.write_config({'request_timeout': 0.05}))
+        self.assertEqual(app_helper.app.settings['request_timeout'], 0.05)
+
+        resp = yield app_helper.get('/store/foo')
+        content = yield resp.json()
+        self.assertEqual(resp.code, 504)
+        self.assertEqual(content['status_code'], 504)
+        self.assertTrue('Request deadline exceeded' in content['reason'])
+        self.assertEqual(len(cancelled), 1)
+        [budget] = budgets
+        self.assertTrue(0 < budget <= 0.05)
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+    @inlineCallbacks
+    def test_route_timeouts(self):
+        cancelled = []
+
+        class SlowCollection(InMemoryCollection):
+            def get(self, object_id):
+                return Deferred(cancelled.append)
+
+            def get_with_version(self, object_id):
+                return Deferred(cancelled.append)
+        collection = SlowCollection({'foo': {'id': 'foo'}})
+        app_helper = self.get_app_helper(
+            collections=(
+                ('/:owner_id/slow', lambda _: collection),
+                ('/:owner_id/store', lambda _: collection),
+            ),
+            config=self.write_config({
+                'request_timeout': 100,
+                'route_timeouts': {'/:owner_id/slow': 0.05},
+            }))
+        [slow_route] = [
+            spec for spec in app_helper.app.handlers[0][1]
+            if spec.regex.pattern.endswith('/slow/(?P<elem_id>[^/]*)$')]
+        self.assertEqual(slow_route.kwargs['request_timeout'], 0.05)
+
+        resp = yield app_helper.get(
+            '/owner-1/slow/foo', headers={'X-Owner-ID': 'owner-1'})
+        content = yield resp.json()
+        self.assertEqual(resp.code, 504)
+        self.assertTrue('Request deadline exceeded' in content['reason'])
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+        # Other routes use the application's deadline.
+        result = yield app_helper.get(
+            '/owner-1/store/', headers={'X-Owner-ID': 'owner-1'},
+            parser='json')
+        self.assertEqual(result, {'cursor': None, 'data': [{'id': 'foo'}]})
+
+    def test_no_request_timeout_by_default(self):
+        app = ApiApplication()
+        self.assertFalse('request_timeout' in app.settings)
+        self.assertEqual(app.route_timeouts, {})
+
     @inlineCallbacks
     def assert_collection_handlers_get_owner(self, app, collection_name,
                                               **handler_kw):
@@ -989,6 +2554,204 @@ class TestApiApplication(TestCase):
             app.factory_preprocessor,
             ApiApplication.factory_preprocessor)
 
+    def test_configure_compression(self):
+        app = ApiApplication()
+        self.assertEqual(
+            [t for t in app.transforms
+             if issubclass(t, CompressionTransform)], [])
+
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({'compression_min_size': 1024}, fp)
+        app = ApiApplication(tempfile)
+        [transform_cls] = [
+            t for t in app.transforms if issubclass(t, CompressionTransform)]
+        self.assertEqual(app.transforms[0], transform_cls)
+        self.assertEqual(transform_cls.min_size, 1024)
+        self.assertEqual(transform_cls.level, 6)
+
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump(
+                {'compression_min_size': 10, 'compression_level': 9}, fp)
+        app = ApiApplication(tempfile)
+        self.assertEqual(app.transforms[0].min_size, 10)
+        self.assertEqual(app.transforms[0].level, 9)
+
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump(
+                {'compression_min_size': 10, 'compression_level': 0}, fp)
+        app = ApiApplication(tempfile)
+        self.assertEqual(
+            [t for t in app.transforms
+             if issubclass(t, CompressionTransform)], [])
+
+    @inlineCallbacks
+    def test_configure_serialization_pool(self):
+        from twisted.internet import reactor
+        # Wait for the reactor to run, so the pool is started immediately.
+        yield deferLater(reactor, 0, lambda: None)
+        app = ApiApplication()
+        self.assertEqual(app.serialization_pool, None)
+        self.assertFalse('serialization_pool' in app.settings)
+        self.assertFalse('serialization_threshold' in app.settings)
+        app.stop_serialization_pool()
+
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({
+                'serialization_threads': 2,
+                'serialization_threshold': 10,
+            }, fp)
+        app = ApiApplication(tempfile)
+        self.addCleanup(app.stop_serialization_pool)
+        pool = app.serialization_pool
+        self.assertTrue(app.settings['serialization_pool'] is pool)
+        self.assertEqual(app.settings['serialization_threshold'], 10)
+        self.assertEqual(pool.max, 2)
+        self.assertEqual(pool.started, True)
+        app.stop_serialization_pool()
+        self.assertEqual(pool.started, False)
+
+    @inlineCallbacks
+    def test_serialization_metrics(self):
+        collection_data = {'foo': {'id': 'foo'}}
+        model_factory = self.get_collection_factory(collection_data)
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({
+                'serialization_threads': 1,
+                'serialization_threshold': 1,
+            }, fp)
+        app_helper = self.get_app_helper(
+            collections=(('/store', model_factory),),
+            preprocessor=None,
+            metrics_handler=MetricsHandler,
+            config=tempfile)
+        self.addCleanup(app_helper.app.stop_serialization_pool)
+        result = yield app_helper.get('/store/', parser='json')
+        self.assertEqual(result, {'cursor': None, 'data': [{'id': 'foo'}]})
+        phase_durations = app_helper.app.metrics.phase_durations
+        self.assertEqual(
+            phase_durations[('/store/', 'GET', 'threaded_serialization')]
+            .count, 1)
+        self.assertEqual(
+            phase_durations[('/store/', 'GET', 'serialization')].count, 1)
+
+    def test_configure_trie_routing(self):
+        app = ApiApplication()
+        self.assertEqual(app.trie_routing, False)
+
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({'trie_routing': True}, fp)
+        app = ApiApplication(tempfile)
+        self.assertEqual(app.trie_routing, True)
+
+    @inlineCallbacks
+    def test_trie_routing(self):
+        collection_data = {'foo': {'id': 'foo'}}
+        model_factory = self.get_collection_factory(collection_data)
+        app_helper = self.get_app_helper(
+            collections=(('/:owner_id/store', model_factory),),
+            models=(('/baz', DummyHandler, lambda _: {'dummy': 'get'}),),
+            preprocessor=None,
+            metrics_handler=MetricsHandler,
+            trie_routing=True)
+        app = app_helper.app
+
+        result = yield app_helper.get('/health/', parser='bytes')
+        self.assertEqual(result, 'OK')
+        result = yield app_helper.get('/owner-1/store/foo', parser='json')
+        self.assertEqual(result, {'id': 'foo'})
+        result = yield app_helper.get('/owner-1/store/', parser='json')
+        self.assertEqual(result, {'cursor': None, 'data': [{'id': 'foo'}]})
+        result = yield app_helper.get('/baz', parser='json')
+        self.assertEqual(result, {"dummy": "get"})
+        resp = yield app_helper.get('/nothing/here')
+        self.assertEqual(resp.code, 404)
+        yield resp.content()
+
+        # The routes were matched with a trie.
+        self.assertEqual(len(app._routers), 1)
+        [(handlers, router)] = app._routers.values()
+        self.assertTrue(handlers is app.handlers[0][1])
+        self.assertEqual(router.fallback, [])
+
+        self.assertEqual(app.metrics.requests, {
+            ('/health/', 'GET', 200): 1,
+            ('/:owner_id/store/:elem_id', 'GET', 200): 1,
+            ('/:owner_id/store/', 'GET', 200): 1,
+            ('/baz', 'GET', 200): 1,
+            ('unmatched', 'GET', 404): 1,
+        })
+
+    def test_trie_routing_add_handlers(self):
+        app = self.get_app_helper(trie_routing=True).app
+        app._get_router(app.handlers[0][1])
+        self.assertEqual(len(app._routers), 1)
+        app.add_handlers('example.com', [('/foo', DummyHandler)])
+        self.assertEqual(app._routers, {})
+
+    @inlineCallbacks
+    def assert_host_routing(self, trie_routing):
+        app_helper = self.get_app_helper(trie_routing=trie_routing)
+        app_helper.app.add_handlers(r'127\.0\.0\.1', [
+            ('/foo', DummyHandler, {'model_factory': lambda _: {'foo': 1}}),
+        ])
+
+        # As in cyclone, the routes of every matching host pattern are
+        # used, so the catch-all pattern's routes are still served.
+        result = yield app_helper.get('/foo', parser='json')
+        self.assertEqual(result, {'foo': 1})
+        result = yield app_helper.get('/health/', parser='bytes')
+        self.assertEqual(result, 'OK')
+
+        # Other hosts only see the catch-all pattern's routes.
+        resp = yield app_helper.get('/foo', headers={'Host': 'example.com'})
+        self.assertEqual(resp.code, 404)
+        yield resp.content()
+        result = yield app_helper.get(
+            '/health/', headers={'Host': 'example.com'}, parser='bytes')
+        self.assertEqual(result, 'OK')
+
+    def test_host_routing_merges_groups(self):
+        return self.assert_host_routing(trie_routing=False)
+
+    def test_trie_host_routing_merges_groups(self):
+        return self.assert_host_routing(trie_routing=True)
+
+    def test_configure_auth_pool(self):
+        app = ApiApplication()
+        pool = app._get_auth_pool({})
+        self.assertTrue(isinstance(pool, HTTPConnectionPool))
+        self.assertEqual(pool.persistent, True)
+        self.assertEqual(pool.maxPersistentPerHost, 10)
+        pool = app._get_auth_pool({'auth_max_connections': 3})
+        self.assertEqual(pool.maxPersistentPerHost, 3)
+
+    def test_configure_auth_cache(self):
+        config_dict = {
+            'auth_bouncer_url': 'http://example.com/',
+            'auth_cache': {
+                'ttl': 30,
+                'max_size': 100,
+                'negative_ttl': 2,
+                'per_uri': False,
+            },
+        }
+        app = ApiApplication()
+        kwargs = app._get_auth_cache_kwargs(config_dict)
+        cache = kwargs.pop('cache')
+        self.assertTrue(isinstance(cache, LRUCache))
+        self.assertEqual(cache.ttl, 30)
+        self.assertEqual(cache.max_size, 100)
+        self.assertEqual(kwargs, {'negative_ttl': 2, 'cache_per_uri': False})
+
+        kwargs = app._get_auth_cache_kwargs({'auth_cache': {}})
+        self.assertEqual(kwargs, {})
+        kwargs = app._get_auth_cache_kwargs({})
+        self.assertEqual(kwargs, {})
+
     def test_configure_static_owner_id(self):
         config_dict = {'static_owner_id': 'owner-foo'}
 
@@ -1010,6 +2773,30 @@ class TestApiApplication(TestCase):
             app.factory_preprocessor,
             ApiApplication.factory_preprocessor)
 
+    def test_configure_json_codec(self):
+        app = ApiApplication()
+        self.assertTrue(isinstance(app.settings['json_codec'], JsonCodec))
+        self.assertEqual(app.settings['json_codec'].name, 'json')
+
+        tempfile = self.mktemp()
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({'json_codec': 'json'}, fp)
+        app = ApiApplication(tempfile)
+        self.assertEqual(app.settings['json_codec'].name, 'json')
+
+        with open(tempfile, 'wb') as fp:
+            yaml.safe_dump({'json_codec': 'unknown'}, fp)
+        self.assertRaises(ValueError, ApiApplication, tempfile)
+
+    def test_json_codec_instance(self):
+        codec = stdlib_codec()
+
+        class MyApiApplication(ApiApplication):
+            json_codec = codec
+
+        app = MyApiApplication()
+        self.assertIdentical(app.settings['json_codec'], codec)
+
     def test_configure_url_path_prefix(self):
         config_dict = {'url_path_prefix': '/foo/bar'}
 
@@ -1079,6 +2866,7 @@ class TestApiApplication(TestCase):
 class TestAuthHandlers(TestCase):
     def setUp(self):
         self._cleanup_funcs = []
+        self.auth_requests = []
         self.dummy_helper = HandlerHelper(
             CollectionHandler,
             handler_kwargs={
@@ -1096,6 +2884,7 @@ class TestAuthHandlers(TestCase):
     @inlineCallbacks
     def start_fake_auth_server(self, owner_id=None, code=200):
         def auth_request(request):
+            self.auth_requests.append(request)
             if request.method != "GET":
                 request.setResponseCode(405)
                 return ""
@@ -1198,3 +2987,247 @@ class TestAuthHandlers(TestCase):
             headers={"Authorization": "Bearer foo"})
         err = yield self.assertFailure(preprocessor(handler), HTTPError)
         self.assertEqual(err.status_code, 403)
+
+    def mk_auth_handler(self, auth="Bearer foo", uri="/"):
+        handler = self.dummy_helper.mk_handler(
+            headers={"Authorization": auth})
+        handler.request.uri = uri
+        return handler
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_cached(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        clock = Clock()
+        cache = LRUCache(10, ttl=60, clock=clock)
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url, cache=cache)
+
+        owner_id = yield preprocessor(self.mk_auth_handler())
+        self.assertEqual(owner_id, "owner-1")
+        owner_id = yield preprocessor(self.mk_auth_handler())
+        self.assertEqual(owner_id, "owner-1")
+        self.assertEqual(len(self.auth_requests), 1)
+        self.assertEqual(cache.hits, 1)
+
+        # A different token isn't served from the cache.
+        yield preprocessor(self.mk_auth_handler(auth="Bearer bar"))
+        self.assertEqual(len(self.auth_requests), 2)
+
+        # Entries expire after the cache's ttl.
+        clock.advance(60)
+        yield preprocessor(self.mk_auth_handler())
+        self.assertEqual(len(self.auth_requests), 3)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_cached_per_uri(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        cache = LRUCache(10, clock=Clock())
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url, cache=cache)
+        yield preprocessor(self.mk_auth_handler(uri="/foo"))
+        yield preprocessor(self.mk_auth_handler(uri="/bar"))
+        yield preprocessor(self.mk_auth_handler(uri="/foo"))
+        self.assertEqual(len(self.auth_requests), 2)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_cached_per_uri_ignores_query(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        cache = LRUCache(10, clock=Clock())
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url, cache=cache)
+        yield preprocessor(self.mk_auth_handler(uri="/foo/?cursor=1"))
+        owner_id = yield preprocessor(
+            self.mk_auth_handler(uri="/foo/?cursor=2&fields=id"))
+        self.assertEqual(owner_id, "owner-1")
+        yield preprocessor(self.mk_auth_handler(uri="/foo/"))
+        self.assertEqual(len(self.auth_requests), 1)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_cached_not_per_uri(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        cache = LRUCache(10, clock=Clock())
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, cache=cache, cache_per_uri=False)
+        yield preprocessor(self.mk_auth_handler(uri="/foo"))
+        owner_id = yield preprocessor(self.mk_auth_handler(uri="/bar"))
+        self.assertEqual(owner_id, "owner-1")
+        self.assertEqual(len(self.auth_requests), 1)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_negative_cache(self):
+        auth_server = yield self.start_fake_auth_server(code=403)
+        clock = Clock()
+        cache = LRUCache(10, ttl=60, clock=clock)
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, cache=cache, negative_ttl=5)
+
+        for _ in range(2):
+            err = yield self.assertFailure(
+                preprocessor(self.mk_auth_handler()), HTTPError)
+            self.assertEqual(err.status_code, 403)
+        self.assertEqual(len(self.auth_requests), 1)
+
+        # Failures expire after the negative ttl.
+        clock.advance(5)
+        err = yield self.assertFailure(
+            preprocessor(self.mk_auth_handler()), HTTPError)
+        self.assertEqual(err.status_code, 403)
+        self.assertEqual(len(self.auth_requests), 2)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_no_negative_cache(self):
+        auth_server = yield self.start_fake_auth_server(code=401)
+        cache = LRUCache(10, clock=Clock())
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url, cache=cache)
+        for _ in range(2):
+            err = yield self.assertFailure(
+                preprocessor(self.mk_auth_handler()), HTTPError)
+            self.assertEqual(err.status_code, 401)
+        self.assertEqual(len(self.auth_requests), 2)
+        self.assertEqual(len(cache), 0)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_server_errors_not_cached(self):
+        auth_server = yield self.start_fake_auth_server(code=500)
+        cache = LRUCache(10, clock=Clock())
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, cache=cache, negative_ttl=5)
+        for _ in range(2):
+            err = yield self.assertFailure(
+                preprocessor(self.mk_auth_handler()), HTTPError)
+            self.assertEqual(err.status_code, 500)
+        self.assertEqual(len(self.auth_requests), 2)
+
+    def mk_pool(self):
+        from twisted.internet import reactor
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        self.add_cleanup(pool.closeCachedConnections)
+        return pool
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_with_pool(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        pool = self.mk_pool()
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url, pool=pool)
+        owner_id = yield preprocessor(self.mk_auth_handler(auth="Bearer foo"))
+        self.assertEqual(owner_id, "owner-1")
+        owner_id = yield preprocessor(self.mk_auth_handler(auth="Bearer bar"))
+        self.assertEqual(owner_id, "owner-1")
+        # Both requests were made over the same connection.
+        [req1, req2] = self.auth_requests
+        self.assertEqual(req1.getClientAddress(), req2.getClientAddress())
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_coalesced(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url)
+        d1 = preprocessor(self.mk_auth_handler())
+        d2 = preprocessor(self.mk_auth_handler())
+        d3 = preprocessor(self.mk_auth_handler(auth="Bearer bar"))
+        owner_ids = yield gatherResults([d1, d2, d3])
+        self.assertEqual(owner_ids, ["owner-1"] * 3)
+        self.assertEqual(len(self.auth_requests), 2)
+
+        # Once the in-flight request is done, new requests go to the server.
+        yield preprocessor(self.mk_auth_handler())
+        self.assertEqual(len(self.auth_requests), 3)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_coalesced_failure(self):
+        auth_server = yield self.start_fake_auth_server(code=403)
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url)
+        d1 = preprocessor(self.mk_auth_handler())
+        d2 = preprocessor(self.mk_auth_handler())
+        err1 = yield self.assertFailure(d1, HTTPError)
+        err2 = yield self.assertFailure(d2, HTTPError)
+        self.assertEqual(err1.status_code, 403)
+        self.assertEqual(err2.status_code, 403)
+        self.assertEqual(len(self.auth_requests), 1)
+
+    @inlineCallbacks
+    def start_hanging_auth_server(self):
+        """
+        Start a fake auth server that never responds. Returns the server and
+        a list that the failures of requests whose connections are lost are
+        added to.
+        """
+        lost = []
+
+        def auth_request(request):
+            self.auth_requests.append(request)
+            request.notifyFinish().addErrback(lost.append)
+            return NOT_DONE_YET
+        fake_server = MockHttpServer(auth_request)
+        yield fake_server.start()
+        self.add_cleanup(fake_server.stop)
+        returnValue((fake_server, lost))
+
+    @inlineCallbacks
+    def wait_for(self, predicate):
+        from twisted.internet import reactor
+        while not predicate():
+            yield deferLater(reactor, 0.001, lambda: None)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_cancelled(self):
+        auth_server, lost = yield self.start_hanging_auth_server()
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, coalesce=False)
+        d = preprocessor(self.mk_auth_handler())
+        yield self.wait_for(lambda: self.auth_requests)
+        d.cancel()
+        # The HTTP client wraps the CancelledError.
+        self.failureResultOf(d)
+        yield self.wait_for(lambda: lost)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_coalesced_cancelled(self):
+        auth_server, lost = yield self.start_hanging_auth_server()
+        preprocessor = owner_from_oauth2_bouncer(auth_server.url)
+        d1 = preprocessor(self.mk_auth_handler())
+        d2 = preprocessor(self.mk_auth_handler())
+        yield self.wait_for(lambda: self.auth_requests)
+
+        # The auth request is still needed for d2.
+        d1.cancel()
+        self.failureResultOf(d1, CancelledError)
+        self.assertNoResult(d2)
+        self.assertEqual(lost, [])
+
+        d2.cancel()
+        self.failureResultOf(d2, CancelledError)
+        yield self.wait_for(lambda: lost)
+        self.assertEqual(len(self.auth_requests), 1)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_max_connections(self):
+        from twisted.internet import reactor
+        auth_server, lost = yield self.start_hanging_auth_server()
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, coalesce=False, max_connections=1)
+        d1 = preprocessor(self.mk_auth_handler())
+        d2 = preprocessor(self.mk_auth_handler())
+        d3 = preprocessor(self.mk_auth_handler())
+        yield self.wait_for(lambda: self.auth_requests)
+        yield deferLater(reactor, 0.01, lambda: None)
+        self.assertEqual(len(self.auth_requests), 1)
+
+        # Calls that are still waiting are cancelled without being made.
+        d2.cancel()
+        self.failureResultOf(d2, CancelledError)
+
+        d1.cancel()
+        self.failureResultOf(d1)
+        yield self.wait_for(lambda: len(self.auth_requests) == 2)
+        d3.cancel()
+        self.failureResultOf(d3)
+        yield self.wait_for(lambda: len(lost) == 2)
+        self.assertEqual(len(self.auth_requests), 2)
+
+    @inlineCallbacks
+    def test_owner_from_bouncer_not_coalesced(self):
+        auth_server = yield self.start_fake_auth_server("owner-1")
+        preprocessor = owner_from_oauth2_bouncer(
+            auth_server.url, coalesce=False)
+        yield gatherResults([
+            preprocessor(self.mk_auth_handler()),
+            preprocessor(self.mk_auth_handler()),
+        ])
+        self.assertEqual(len(self.auth_requests), 2)
@@ -0,0 +1,100 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from cyclone.web import URLSpec
+
+from go_api.cyclone.helpers import AppHelper
+from go_api.cyclone.metrics import Histogram, MetricsHandler, MetricsRegistry
+
+
+class TestHistogram(TestCase):
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(2)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+
+    def test_samples(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(2)
+        self.assertEqual(histogram.samples(), [
+            ("_bucket", (("le", "0.1"),), 1),
+            ("_bucket", (("le", "1.0"),), 2),
+            ("_bucket", (("le", "+Inf"),), 3),
+            ("_sum", (), 2.55),
+            ("_count", (), 3),
+        ])
+
+
+class TestMetricsRegistry(TestCase):
+    def test_render_empty(self):
+        registry = MetricsRegistry()
+        self.assertEqual(registry.render(), "\n".join([
+            "# HELP go_api_requests_total Total number of requests handled.",
+            "# TYPE go_api_requests_total counter",
+            "# HELP go_api_request_duration_seconds Time taken to handle"
+            " requests.",
+            "# TYPE go_api_request_duration_seconds histogram",
+            "# HELP go_api_request_phase_duration_seconds Time spent in each"
+            " phase of handling requests.",
+            "# TYPE go_api_request_phase_duration_seconds histogram",
+        ]) + "\n")
+
+    def test_render(self):
+        registry = MetricsRegistry(prefix="test_", buckets=(1.0,))
+        registry.record_request("/store/", "GET", 200, 0.5, {
+            "collection": 0.25,
+        })
+        registry.record_request("/store/", "GET", 200, 2.0)
+        registry.record_request("/store/", "GET", 404, 0.5)
+        lines = registry.render().splitlines()
+        self.assertEqual([l for l in lines if not l.startswith("#")], [
+            'test_requests_total{route="/store/",method="GET",status="200"}'
+            ' 2',
+            'test_requests_total{route="/store/",method="GET",status="404"}'
+            ' 1',
+            'test_request_duration_seconds_bucket'
+            '{route="/store/",method="GET",le="1.0"} 2',
+            'test_request_duration_seconds_bucket'
+            '{route="/store/",method="GET",le="+Inf"} 3',
+            'test_request_duration_seconds_sum'
+            '{route="/store/",method="GET"} 3.0',
+            'test_request_duration_seconds_count'
+            '{route="/store/",method="GET"} 3',
+            'test_request_phase_duration_seconds_bucket'
+            '{route="/store/",method="GET",phase="collection",le="1.0"} 1',
+            'test_request_phase_duration_seconds_bucket'
+            '{route="/store/",method="GET",phase="collection",le="+Inf"} 1',
+            'test_request_phase_duration_seconds_sum'
+            '{route="/store/",method="GET",phase="collection"} 0.25',
+            'test_request_phase_duration_seconds_count'
+            '{route="/store/",method="GET",phase="collection"} 1',
+        ])
+
+    def test_render_escapes_labels(self):
+        registry = MetricsRegistry()
+        registry.record_request(u'/a"b\\c\n\xe9/', "GET", 200, 0.1)
+        self.assertTrue(
+            'route="/a\\"b\\\\c\\n\xc3\xa9/"' in registry.render())
+
+
+class TestMetricsHandler(TestCase):
+    @inlineCallbacks
+    def test_get(self):
+        registry = MetricsRegistry()
+        registry.record_request("/store/", "GET", 200, 0.5)
+        app_helper = AppHelper(urlspec=URLSpec(
+            '/metrics/', MetricsHandler, kwargs={'metrics': registry}))
+        resp = yield app_helper.get('/metrics/')
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(
+            resp.headers.getRawHeaders('Content-Type'),
+            ['text/plain; version=0.0.4; charset=utf-8'])
+        content = yield resp.content()
+        self.assertEqual(content, registry.render())
@@ -0,0 +1,165 @@
+from twisted.trial.unittest import TestCase
+
+from cyclone.web import URLSpec
+
+from go_api.cyclone.handlers import create_urlspec_regex
+from go_api.cyclone.router import RouteTrie, match_args, spec_segments
+
+
+def mk_spec(dfn, name=None):
+    return URLSpec(create_urlspec_regex(dfn), object, name=name)
+
+
+class TestSpecSegments(TestCase):
+    def test_literal(self):
+        self.assertEqual(
+            spec_segments(mk_spec('/foo/bar/')),
+            [('', None), ('foo', None), ('bar', None), ('', None)])
+
+    def test_vars(self):
+        self.assertEqual(
+            spec_segments(mk_spec('/:owner_id/store/:elem_id')),
+            [('', None), (None, 'owner_id'), ('store', None),
+             (None, 'elem_id')])
+
+    def test_regex(self):
+        self.assertEqual(spec_segments(URLSpec('/foo/(\\d+)', object)), None)
+        self.assertEqual(spec_segments(URLSpec('/foo.bar', object)), None)
+        self.assertEqual(spec_segments(URLSpec('/foo/.*', object)), None)
+
+    def test_var_not_whole_segment(self):
+        self.assertEqual(spec_segments(mk_spec('/foo/x:bar')), [
+            ('', None), ('foo', None), ('x:bar', None)])
+        self.assertEqual(spec_segments(URLSpec(
+            '/foo/x(?P<bar>[^/]*)', object)), None)
+
+
+class TestMatchArgs(TestCase):
+    def test_no_groups(self):
+        spec = URLSpec('/foo', object)
+        self.assertEqual(
+            match_args(spec, spec.regex.match('/foo')), ([], {}))
+
+    def test_named_groups(self):
+        spec = mk_spec('/:a/:b')
+        self.assertEqual(
+            match_args(spec, spec.regex.match('/x%20y/z')),
+            ([], {'a': 'x y', 'b': 'z'}))
+
+    def test_positional_groups(self):
+        spec = URLSpec('/foo/(\\d+)/(x)?', object)
+        self.assertEqual(
+            match_args(spec, spec.regex.match('/foo/12/')),
+            (['12', None], {}))
+
+
+class TestRouteTrie(TestCase):
+    def assert_match(self, trie, path, spec, kwargs=None, args=None):
+        self.assertEqual(
+            trie.match(path), (spec, args or [], kwargs or {}))
+
+    def test_literal(self):
+        health = URLSpec('/health/', object)
+        trie = RouteTrie([health])
+        self.assertEqual(trie.fallback, [])
+        self.assert_match(trie, '/health/', health)
+        self.assertEqual(trie.match('/health'), None)
+        self.assertEqual(trie.match('/health/x'), None)
+        self.assertEqual(trie.match('/'), None)
+
+    def test_vars(self):
+        coll = mk_spec('/:owner_id/store/')
+        elem = mk_spec('/:owner_id/store/:elem_id')
+        trie = RouteTrie([coll, elem])
+        self.assert_match(trie, '/owner-1/store/', coll, {
+            'owner_id': 'owner-1'})
+        self.assert_match(trie, '/owner-1/store/foo', elem, {
+            'owner_id': 'owner-1', 'elem_id': 'foo'})
+        self.assertEqual(trie.match('/owner-1/other/foo'), None)
+        self.assertEqual(trie.match('/owner-1/store/foo/'), None)
+
+    def test_vars_unquoted(self):
+        elem = mk_spec('/store/:elem_id')
+        trie = RouteTrie([elem])
+        self.assert_match(trie, '/store/a%2Fb%20c', elem, {
+            'elem_id': 'a/b c'})
+
+    def test_vars_match_empty_segment(self):
+        elem = mk_spec('/store/:elem_id')
+        trie = RouteTrie([elem])
+        self.assert_match(trie, '/store/', elem, {'elem_id': ''})
+
+    def test_first_match_wins(self):
+        elem = mk_spec('/store/:elem_id')
+        bulk = mk_spec('/store/_bulk')
+        self.assert_match(
+            RouteTrie([elem, bulk]), '/store/_bulk', elem,
+            {'elem_id': '_bulk'})
+        self.assert_match(RouteTrie([bulk, elem]), '/store/_bulk', bulk)
+
+    def test_first_match_wins_across_branches(self):
+        by_owner = mk_spec('/:owner_id/store')
+        literal = mk_spec('/owner-1/store')
+        self.assert_match(
+            RouteTrie([by_owner, literal]), '/owner-1/store', by_owner,
+            {'owner_id': 'owner-1'})
+        self.assert_match(
+            RouteTrie([literal, by_owner]), '/owner-1/store', literal)
+
+    def test_backtracks(self):
+        literal = mk_spec('/owner-1/foo')
+        by_owner = mk_spec('/:owner_id/bar')
+        trie = RouteTrie([literal, by_owner])
+        self.assert_match(trie, '/owner-1/bar', by_owner, {
+            'owner_id': 'owner-1'})
+
+    def test_same_shape(self):
+        first = mk_spec('/:a/store')
+        second = mk_spec('/:b/store')
+        trie = RouteTrie([first, second])
+        self.assert_match(trie, '/x/store', first, {'a': 'x'})
+
+    def test_fallback(self):
+        regex = URLSpec('/foo/(\\d+)', object)
+        elem = mk_spec('/foo/:elem_id')
+        trie = RouteTrie([regex, elem])
+        self.assertEqual(trie.fallback, [(0, regex)])
+        self.assert_match(trie, '/foo/12', regex, args=['12'])
+        self.assert_match(trie, '/foo/bar', elem, {'elem_id': 'bar'})
+
+    def test_fallback_after_trie_route(self):
+        elem = mk_spec('/foo/:elem_id')
+        regex = URLSpec('/foo/(\\d+)', object)
+        other = URLSpec('/bar/(\\d+)', object)
+        trie = RouteTrie([elem, regex, other])
+        self.assert_match(trie, '/foo/12', elem, {'elem_id': '12'})
+        self.assert_match(trie, '/bar/12', other, args=['12'])
+        self.assertEqual(trie.match('/baz/12'), None)
+
+    def test_empty(self):
+        self.assertEqual(RouteTrie([]).match('/'), None)
+
+    def test_matches_regexes(self):
+        specs = [
+            URLSpec('/health/', object),
+            mk_spec('/:owner_id/store/'),
+            mk_spec('/:owner_id/store/:elem_id'),
+            mk_spec('/:owner_id/store/_bulk/'),
+            mk_spec('/foo'),
+            URLSpec('/files/(.*)', object),
+        ]
+        trie = RouteTrie(specs)
+        paths = [
+            '/health/', '/health', '/o/store/', '/o/store/x',
+            '/o/store/_bulk/', '/o/store/_bulk', '//store/', '/foo', '/foo/',
+            '/files/a/b', '', '/', '/o/store/x/y',
+        ]
+        for path in paths:
+            expected = None
+            for spec in specs:
+                match = spec.regex.match(path)
+                if match is not None:
+                    args, kwargs = match_args(spec, match)
+                    expected = (spec, args, kwargs)
+                    break
+            self.assertEqual(trie.match(path), expected, path)
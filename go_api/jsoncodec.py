@@ -0,0 +1,121 @@
+"""
+Pluggable JSON encoding and decoding.
+"""
+
+import json
+
+
+class JsonCodec(object):
+    """
+    A JSON encoder and decoder pair.
+
+    :param str name:
+        The name of the codec.
+    :param func dumps:
+        A function that encodes an object as a JSON string.
+    :param func loads:
+        A function that decodes a JSON string. It must raise a
+        :class:`ValueError` (or a subclass) if the string isn't valid JSON.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return "<JsonCodec %r>" % (self.name,)
+
+
+def stdlib_codec():
+    """
+    Return a codec that uses the standard library's :mod:`json` module.
+    """
+    return JsonCodec("json", json.dumps, json.loads)
+
+
+# The largest ``double_precision`` values that versions of ujson accept.
+_UJSON_PRECISIONS = (17, 15)
+
+
+def _ujson_dumps_kwargs(ujson):
+    """
+    Return the keyword arguments that make ``ujson.dumps`` encode like the
+    standard library: forward slashes unescaped and floats at full
+    precision. Versions of ujson that don't accept ``double_precision``
+    always use the shortest representation that round-trips.
+    """
+    kw = {"escape_forward_slashes": False}
+    for precision in _UJSON_PRECISIONS:
+        try:
+            ujson.dumps(0.5, double_precision=precision, **kw)
+        except TypeError:
+            return kw
+        except ValueError:
+            continue
+        kw["double_precision"] = precision
+        return kw
+    return kw
+
+
+def ujson_codec():
+    """
+    Return a codec that uses :mod:`ujson`, configured to encode the same
+    values as the standard library would. Raises :class:`ImportError` if
+    :mod:`ujson` isn't installed.
+    """
+    import ujson
+    kw = _ujson_dumps_kwargs(ujson)
+
+    def dumps(obj):
+        return ujson.dumps(obj, **kw)
+
+    return JsonCodec("ujson", dumps, ujson.loads)
+
+
+CODECS = {
+    "json": stdlib_codec,
+    "ujson": ujson_codec,
+}
+
+# Codecs to try, in order, when the codec name is "auto".
+AUTO_CODECS = ("ujson", "json")
+
+
+def get_json_codec(name="json"):
+    """
+    Return the named :class:`JsonCodec`.
+
+    :param str name:
+        One of the names in :data:`CODECS`, or ``"auto"`` to use the fastest
+        codec that's installed, falling back to the standard library.
+        ``None`` means ``"json"``.
+
+    :raises ValueError: if the codec name is unknown.
+    :raises ImportError: if the named codec isn't installed.
+    """
+    if name is None:
+        name = "json"
+    if name == "auto":
+        for name in AUTO_CODECS:
+            try:
+                return CODECS[name]()
+            except ImportError:
+                continue
+    if name not in CODECS:
+        raise ValueError("Unknown JSON codec: %r" % (name,))
+    return CODECS[name]()
+
+
+_default_codec = None
+
+
+def default_json_codec():
+    """
+    Return the codec used when none is configured, which is the standard
+    library's. The codec is only looked up once.
+    """
+    global _default_codec
+    if _default_codec is None:
+        _default_codec = get_json_codec("json")
+    return _default_codec
@@ -2,9 +2,11 @@
 Package containing PausingDeferredQueue.
 """
 
-from .pausingdeferredqueue import PausingDeferredQueue, PausingQueueCloseMarker
+from .pausingdeferredqueue import (
+    PausingDeferredQueue, PausingQueueCancelled, PausingQueueCloseMarker)
 
 __all__ = [
     'PausingDeferredQueue',
+    'PausingQueueCancelled',
     'PausingQueueCloseMarker',
 ]
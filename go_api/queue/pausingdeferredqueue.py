@@ -1,11 +1,20 @@
+from collections import deque
+
 from twisted.internet.defer import (
-    QueueOverflow, QueueUnderflow, Deferred, succeed)
+    CancelledError, QueueOverflow, QueueUnderflow, Deferred, fail, succeed)
 
 
 class PausingQueueCloseMarker(object):
     "This is a marker for closing a L{PausingDeferredQueue}"
 
 
+class PausingQueueCancelled(Exception):
+    """
+    Raised when adding objects to a L{PausingDeferredQueue} that has been
+    cancelled by its consumer.
+    """
+
+
 class PausingDeferredQueue(object):
     """
     An event driven queue.
@@ -22,13 +31,27 @@ class PausingDeferredQueue(object):
     one time.  When an attempt is made to get an object which would
     exceed this limit, L{QueueUnderflow} is raised synchronously.  C{None}
     for no limit.
+
+    Objects may also be added and retrieved in batches using L{put_many}
+    and L{get_many}, which need only one L{Deferred} per batch.
+
+    A consumer that stops reading before the end of the queue (for example,
+    because its client disconnected) should call L{cancel}. Producers learn
+    of this when their pending L{put} fails with L{PausingQueueCancelled},
+    when their next L{put} raises it, or by checking L{cancelled}, and
+    should stop producing and release any resources they hold.
+
+    @ivar cancelled: C{True} once L{cancel} has been called.
     """
 
     def __init__(self, size=None, backlog=None):
-        self.waiting = []
-        self.pending = []
+        # Each waiting item is a (deferred, count) tuple. The count is None
+        # for get() and the maximum batch size for get_many().
+        self.waiting = deque()
+        self.pending = deque()
         self.size = size
         self.backlog = backlog
+        self.cancelled = False
         self._pending_put = None
 
     def _cancelGet(self, d):
@@ -43,54 +66,162 @@ class PausingDeferredQueue(object):
 
         @param d: The deferred that has been canceled.
         """
-        self.waiting.remove(d)
+        for waiter in self.waiting:
+            if waiter[0] is d:
+                self.waiting.remove(waiter)
+                return
+
+    def _wait(self, count):
+        if self.backlog is not None and len(self.waiting) >= self.backlog:
+            raise QueueUnderflow()
+        d = Deferred(canceller=self._cancelGet)
+        self.waiting.append((d, count))
+        return d
+
+    def _check_pending_put(self):
+        if self._pending_put is not None:
+            # We need to replace this deferred with None before firing it,
+            # because its callback may add a new item to the queue which
+            # would could replace self._pending_put and cause us to clear a
+            # pending deferred instead of a fired one.
+            pending_put = self._pending_put
+            self._pending_put = None
+            pending_put.callback(None)
+
+    def _after_put(self):
+        if len(self.pending) == self.size:
+            self._pending_put = Deferred()
+            return self._pending_put
+        # We still have space, so return an already-fired deferred.
+        return succeed(None)
+
+    def cancel(self):
+        """
+        Stop the queue because its consumer will read no more objects.
+        Objects in the queue are discarded, waiting gets are cancelled and a
+        pending put fails with L{PausingQueueCancelled}. Cancelling a queue
+        more than once has no further effect.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.pending.clear()
+        while self.waiting:
+            d, _ = self.waiting[0]
+            d.cancel()
+        if self._pending_put is not None:
+            pending_put = self._pending_put
+            self._pending_put = None
+            pending_put.errback(PausingQueueCancelled())
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise PausingQueueCancelled()
 
     def put(self, obj):
         """
         Add an object to this queue.
 
         @return: a L{Deferred} which fires with None when the queue is ready
-        to accept another object.
+        to accept another object, or fails with L{PausingQueueCancelled} if
+        the queue is cancelled first.
 
         @raise QueueOverflow: Too many objects are in this queue.
+
+        @raise PausingQueueCancelled: The queue has been cancelled.
         """
+        self._check_cancelled()
         if self.waiting:
-            self.waiting.pop(0).callback(obj)
+            d, count = self.waiting.popleft()
+            d.callback(obj if count is None else [obj])
             return succeed(None)
         elif self.size is None or len(self.pending) < self.size:
             self.pending.append(obj)
-            if len(self.pending) == self.size:
-                self._pending_put = Deferred()
-                return self._pending_put
-            # We still have space, so return an already-fired deferred.
-            return succeed(None)
+            return self._after_put()
         else:
             raise QueueOverflow()
 
+    def put_many(self, objs):
+        """
+        Add several objects to this queue. Objects are handed to waiting
+        gets first, and the rest are added to the queue.
+
+        @return: a L{Deferred} which fires with None when the queue is ready
+        to accept another object.
+
+        @raise QueueOverflow: The objects don't all fit in this queue. No
+        objects are added in this case.
+
+        @raise PausingQueueCancelled: The queue has been cancelled.
+        """
+        self._check_cancelled()
+        objs = list(objs)
+        if self.size is not None:
+            # Work out how many objects waiting gets will take before we
+            # hand any out, so that we don't partially add the objects.
+            taken = 0
+            for _, count in self.waiting:
+                if taken >= len(objs):
+                    break
+                taken += 1 if count is None else count
+            if len(self.pending) + len(objs) - taken > self.size:
+                raise QueueOverflow()
+        i = 0
+        while i < len(objs) and self.waiting:
+            d, count = self.waiting.popleft()
+            if count is None:
+                d.callback(objs[i])
+                i += 1
+            else:
+                d.callback(objs[i:i + count])
+                i += count
+        rest = objs[i:]
+        if not rest:
+            return succeed(None)
+        self.pending.extend(rest)
+        return self._after_put()
+
     def get(self):
         """
         Attempt to retrieve and remove an object from the queue.
 
         @return: a L{Deferred} which fires with the next object available in
-        the queue.
+        the queue, or fails with L{CancelledError} if the queue is
+        cancelled first.
 
         @raise QueueUnderflow: Too many (more than C{backlog})
         L{Deferred}s are already waiting for an object from this queue.
         """
+        if self.cancelled:
+            return fail(CancelledError())
         if self.pending:
-            result = self.pending.pop(0)
-            if self._pending_put is not None:
-                # We need to replace this deferred with None before firing it,
-                # because its callback may add a new item to the queue which
-                # would could replace self._pending_put and cause us to clear a
-                # pending deferred instead of a fired one.
-                pending_put = self._pending_put
-                self._pending_put = None
-                pending_put.callback(None)
+            result = self.pending.popleft()
+            self._check_pending_put()
             return succeed(result)
-        elif self.backlog is None or len(self.waiting) < self.backlog:
-            d = Deferred(canceller=self._cancelGet)
-            self.waiting.append(d)
-            return d
-        else:
-            raise QueueUnderflow()
+        return self._wait(None)
+
+    def get_many(self, count):
+        """
+        Attempt to retrieve and remove up to C{count} objects from the queue.
+
+        @return: a L{Deferred} which fires with a list of between one and
+        C{count} objects. If the queue isn't empty, the list contains all the
+        objects that are ready, up to C{count}. Otherwise it contains the
+        objects from the next L{put} or L{put_many}. If the list contains a
+        L{PausingQueueCloseMarker}, it is the last item. The L{Deferred}
+        fails with L{CancelledError} if the queue is cancelled first.
+
+        @raise QueueUnderflow: Too many (more than C{backlog})
+        L{Deferred}s are already waiting for an object from this queue.
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        if self.cancelled:
+            return fail(CancelledError())
+        if self.pending:
+            pending = self.pending
+            count = min(count, len(pending))
+            result = [pending.popleft() for _ in xrange(count)]
+            self._check_pending_put()
+            return succeed(result)
+        return self._wait(count)
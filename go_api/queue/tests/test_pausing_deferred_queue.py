@@ -1,7 +1,7 @@
 from twisted.internet import defer
 from twisted.trial import unittest
 
-from go_api.queue import PausingDeferredQueue
+from go_api.queue import PausingDeferredQueue, PausingQueueCancelled
 
 
 class ImmediateFailureMixin(object):
@@ -186,3 +186,138 @@ class TestPausingDeferredQueue(
         done = []
         d.addCallback(done.append)
         self.assertEqual(len(done), 1)
+
+    def test_put_many(self):
+        """
+        Putting several objects adds them all to the queue in order.
+        """
+        q = PausingDeferredQueue()
+        d = q.put_many([0, 1, 2])
+        self.assertEqual(self.successResultOf(d), None)
+        gotten = []
+        for i in range(3):
+            q.get().addCallback(gotten.append)
+        self.assertEqual(gotten, [0, 1, 2])
+
+    def test_put_many_fills_queue(self):
+        """
+        If putting several objects fills the queue, the returned deferred
+        only fires when an object is removed.
+        """
+        q = PausingDeferredQueue(size=3)
+        put_d = q.put_many([0, 1, 2])
+        self.assertNoResult(put_d)
+        self.assertEqual(self.successResultOf(q.get()), 0)
+        self.assertEqual(self.successResultOf(put_d), None)
+
+    def test_put_many_overflow(self):
+        """
+        If the objects don't fit, L{QueueOverflow} is raised and none of
+        them are added.
+        """
+        q = PausingDeferredQueue(size=3)
+        q.put(0)
+        self.assertRaises(defer.QueueOverflow, q.put_many, [1, 2, 3])
+        self.assertEqual(list(q.pending), [0])
+
+    def test_put_many_waiting(self):
+        """
+        Objects are handed to waiting gets before being added to the queue.
+        """
+        q = PausingDeferredQueue(size=1)
+        gotten = []
+        q.get().addCallback(gotten.append)
+        q.get_many(2).addCallback(gotten.append)
+        d = q.put_many([0, 1, 2, 3])
+        self.assertEqual(gotten, [0, [1, 2]])
+        self.assertNoResult(d)
+        self.assertEqual(list(q.pending), [3])
+
+    def test_get_many(self):
+        """
+        Getting several objects returns up to the requested number of ready
+        objects.
+        """
+        q = PausingDeferredQueue()
+        q.put_many([0, 1, 2])
+        self.assertEqual(self.successResultOf(q.get_many(2)), [0, 1])
+        self.assertEqual(self.successResultOf(q.get_many(2)), [2])
+
+    def test_get_many_waiting(self):
+        """
+        If the queue is empty, getting several objects waits for the next
+        put.
+        """
+        q = PausingDeferredQueue()
+        d = q.get_many(3)
+        self.assertNoResult(d)
+        q.put(0)
+        self.assertEqual(self.successResultOf(d), [0])
+
+    def test_get_many_unpauses_put(self):
+        """
+        Getting several objects from a full queue fires the pending put.
+        """
+        q = PausingDeferredQueue(size=2)
+        put_d = q.put_many([0, 1])
+        self.assertNoResult(put_d)
+        self.assertEqual(self.successResultOf(q.get_many(5)), [0, 1])
+        self.assertEqual(self.successResultOf(put_d), None)
+
+    def test_get_many_underflow(self):
+        q = PausingDeferredQueue(backlog=1)
+        q.get_many(2)
+        self.assertRaises(defer.QueueUnderflow, q.get_many, 2)
+        self.assertRaises(ValueError, q.get_many, 0)
+
+    def test_cancel_get_many(self):
+        """
+        Canceling a waiting L{get_many} removes it from the queue.
+        """
+        q = PausingDeferredQueue()
+        d = q.get_many(2)
+        d.cancel()
+        self.assertImmediateFailure(d, defer.CancelledError)
+        q.put(0)
+        self.assertEqual(list(q.pending), [0])
+
+    def test_cancel(self):
+        """
+        Cancelling a queue discards its objects, and later puts raise
+        L{PausingQueueCancelled}.
+        """
+        q = PausingDeferredQueue()
+        q.put_many([0, 1])
+        self.assertFalse(q.cancelled)
+        q.cancel()
+        self.assertTrue(q.cancelled)
+        self.assertEqual(list(q.pending), [])
+        self.assertRaises(PausingQueueCancelled, q.put, 2)
+        self.assertRaises(PausingQueueCancelled, q.put_many, [2])
+        self.assertImmediateFailure(q.get(), defer.CancelledError)
+        self.assertImmediateFailure(q.get_many(2), defer.CancelledError)
+        # Cancelling again does nothing.
+        q.cancel()
+
+    def test_cancel_waiting_gets(self):
+        """
+        Cancelling a queue cancels any waiting gets.
+        """
+        q = PausingDeferredQueue(backlog=2)
+        d1 = q.get()
+        d2 = q.get_many(2)
+        q.cancel()
+        self.assertImmediateFailure(d1, defer.CancelledError)
+        self.assertImmediateFailure(d2, defer.CancelledError)
+        self.assertEqual(len(q.waiting), 0)
+
+    def test_cancel_pending_put(self):
+        """
+        Cancelling a queue fails a put that is waiting for space with
+        L{PausingQueueCancelled}, so that the producer knows to stop.
+        """
+        q = PausingDeferredQueue(size=1)
+        d = q.put(0)
+        q.cancel()
+        self.assertImmediateFailure(d, PausingQueueCancelled)
+        self.assertEqual(q._pending_put, None)
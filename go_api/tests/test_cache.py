@@ -0,0 +1,90 @@
+"""
+Tests for go_api.cache.
+"""
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from go_api.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_invalid_max_size(self):
+        self.assertRaises(ValueError, LRUCache, 0, clock=Clock())
+
+    def test_get_missing(self):
+        cache = LRUCache(10, clock=Clock())
+        self.assertEqual(cache.get("foo"), None)
+        self.assertEqual(cache.get("foo", "default"), "default")
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 0)
+
+    def test_set_and_get(self):
+        cache = LRUCache(10, clock=Clock())
+        cache.set("foo", "bar")
+        self.assertEqual(cache.get("foo"), "bar")
+        self.assertEqual(len(cache), 1)
+        self.assertTrue("foo" in cache)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 0)
+
+    def test_set_replaces(self):
+        cache = LRUCache(10, clock=Clock())
+        cache.set("foo", "bar")
+        cache.set("foo", "baz")
+        self.assertEqual(cache.get("foo"), "baz")
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2, clock=Clock())
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Using "a" makes "b" the least recently used entry.
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_default_ttl(self):
+        clock = Clock()
+        cache = LRUCache(10, ttl=5, clock=clock)
+        cache.set("foo", "bar")
+        clock.advance(4.9)
+        self.assertEqual(cache.get("foo"), "bar")
+        clock.advance(0.1)
+        self.assertEqual(cache.get("foo"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl_per_entry(self):
+        clock = Clock()
+        cache = LRUCache(10, ttl=5, clock=clock)
+        cache.set("short", 1, ttl=1)
+        cache.set("long", 2)
+        clock.advance(1)
+        self.assertFalse("short" in cache)
+        self.assertTrue("long" in cache)
+
+    def test_no_ttl(self):
+        clock = Clock()
+        cache = LRUCache(10, clock=clock)
+        cache.set("foo", "bar")
+        clock.advance(10 ** 6)
+        self.assertEqual(cache.get("foo"), "bar")
+
+    def test_pop(self):
+        cache = LRUCache(10, clock=Clock())
+        cache.set("foo", "bar")
+        self.assertEqual(cache.pop("foo"), "bar")
+        self.assertEqual(cache.pop("foo", "default"), "default")
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = LRUCache(10, clock=Clock())
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get("a"), None)
@@ -0,0 +1,131 @@
+"""
+Tests for go_api JSON codecs.
+"""
+
+import sys
+
+from twisted.trial.unittest import SkipTest, TestCase
+
+from go_api import jsoncodec
+from go_api.jsoncodec import (
+    JsonCodec, default_json_codec, get_json_codec, stdlib_codec, ujson_codec)
+
+
+class TestJsonCodec(TestCase):
+    def patch_module(self, name, module):
+        """
+        Replace a module in ``sys.modules`` for the duration of the test.
+        Setting it to ``None`` makes importing it fail.
+        """
+        missing = object()
+        old = sys.modules.get(name, missing)
+        sys.modules[name] = module
+
+        def restore():
+            if old is missing:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = old
+        self.addCleanup(restore)
+
+    def test_stdlib_codec(self):
+        codec = stdlib_codec()
+        self.assertEqual(codec.name, "json")
+        self.assertEqual(codec.dumps({"a": 1}), '{"a": 1}')
+        self.assertEqual(codec.loads('{"a": 1}'), {"a": 1})
+        self.assertRaises(ValueError, codec.loads, "{")
+
+    def test_repr(self):
+        self.assertEqual(repr(stdlib_codec()), "<JsonCodec 'json'>")
+
+    def mk_fake_ujson(self, accepts_precision=True, max_precision=17):
+        """
+        Install a fake ujson module that records the keyword arguments
+        ``dumps`` is called with.
+        """
+        fake_ujson = type(sys)("ujson")
+        fake_ujson.calls = []
+
+        def dumps(obj, escape_forward_slashes=True, **kw):
+            if "double_precision" in kw:
+                if not accepts_precision:
+                    raise TypeError("'double_precision' is an invalid keyword")
+                if kw["double_precision"] > max_precision:
+                    raise ValueError("Invalid value for double_precision")
+            kw["escape_forward_slashes"] = escape_forward_slashes
+            fake_ujson.calls.append(kw)
+            return "fast"
+
+        fake_ujson.dumps = dumps
+        fake_ujson.loads = lambda data: "fast"
+        self.patch_module("ujson", fake_ujson)
+        return fake_ujson
+
+    def test_get_json_codec(self):
+        self.assertEqual(get_json_codec("json").name, "json")
+
+    def test_get_json_codec_default(self):
+        """
+        The standard library is used unless another codec is asked for,
+        even if ujson is installed.
+        """
+        self.mk_fake_ujson()
+        self.assertEqual(get_json_codec().name, "json")
+        self.assertEqual(get_json_codec(None).name, "json")
+
+    def test_get_json_codec_unknown(self):
+        self.assertRaises(ValueError, get_json_codec, "unknown")
+
+    def test_get_json_codec_auto_fallback(self):
+        """
+        If no faster codec is installed, the standard library is used.
+        """
+        self.patch_module("ujson", None)
+        self.assertEqual(get_json_codec("auto").name, "json")
+        self.assertRaises(ImportError, get_json_codec, "ujson")
+
+    def test_get_json_codec_auto_prefers_ujson(self):
+        self.mk_fake_ujson()
+        codec = get_json_codec("auto")
+        self.assertEqual(codec.name, "ujson")
+        self.assertEqual(codec.dumps({}), "fast")
+
+    def test_ujson_codec_options(self):
+        fake_ujson = self.mk_fake_ujson()
+        ujson_codec().dumps({})
+        self.assertEqual(fake_ujson.calls[-1], {
+            "escape_forward_slashes": False, "double_precision": 17})
+
+        fake_ujson = self.mk_fake_ujson(max_precision=15)
+        ujson_codec().dumps({})
+        self.assertEqual(fake_ujson.calls[-1], {
+            "escape_forward_slashes": False, "double_precision": 15})
+
+        fake_ujson = self.mk_fake_ujson(accepts_precision=False)
+        ujson_codec().dumps({})
+        self.assertEqual(fake_ujson.calls[-1], {
+            "escape_forward_slashes": False})
+
+    def test_ujson_matches_stdlib(self):
+        try:
+            codec = ujson_codec()
+        except ImportError:
+            raise SkipTest("ujson is not installed")
+        stdlib = stdlib_codec()
+        obj = {
+            "url": "http://example.com/a/b",
+            "text": u"caf\xe9 \u2603 \"quoted\"\n",
+            "floats": [1 / 3.0, 0.1, 2.5e-8, 1e300, -0.0],
+            "ints": [0, -1, 2 ** 62],
+            "other": [True, False, None, {}, []],
+        }
+        data = codec.dumps(obj)
+        self.assertEqual(stdlib.loads(data), stdlib.loads(stdlib.dumps(obj)))
+        self.assertTrue("http://example.com/a/b" in data)
+        self.assertRaises(ValueError, codec.loads, "{")
+
+    def test_default_json_codec_cached(self):
+        self.patch(jsoncodec, "_default_codec", None)
+        codec = default_json_codec()
+        self.assertTrue(isinstance(codec, JsonCodec))
+        self.assertIdentical(default_json_codec(), codec)
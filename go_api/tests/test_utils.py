@@ -6,7 +6,7 @@ from twisted.internet.defer import Deferred, inlineCallbacks, succeed
 from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
-from go_api.utils import defer_async, simulate_async
+from go_api.utils import BatchingScheduler, defer_async, simulate_async
 
 
 class DummyError(Exception):
@@ -89,3 +89,93 @@ class TestSimulateAsync(TestCase):
             ("foo", "bar"),
             {"baz": 3, "boop": "barp"},
         ))
+
+
+class TestBatchingScheduler(TestCase):
+    def test_batches_calls(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        calls = []
+        for i in range(3):
+            self.assertEqual(scheduler.callLater(0, calls.append, i), None)
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertEqual(calls, [])
+        clock.advance(0)
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_passes_arguments(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        calls = []
+        scheduler.callLater(0, lambda *a, **kw: calls.append((a, kw)), 1, b=2)
+        clock.advance(0)
+        self.assertEqual(calls, [((1,), {'b': 2})])
+
+    def test_calls_scheduled_during_batch(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        calls = []
+        batch_calls = []
+
+        def reschedule():
+            calls.append('first')
+            scheduler.callLater(0, calls.append, 'third')
+            batch_calls.append(list(clock.getDelayedCalls()))
+
+        scheduler.callLater(0, reschedule)
+        scheduler.callLater(0, calls.append, 'second')
+        clock.advance(0)
+        self.assertEqual(calls, ['first', 'second', 'third'])
+        # The call made during the batch was put in a new batch.
+        [[batch_call]] = batch_calls
+        self.assertEqual(batch_call.func, scheduler._run_batch)
+
+    def test_delayed_calls(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        calls = []
+        delayed_call = scheduler.callLater(5, calls.append, 'foo')
+        self.assertEqual(clock.getDelayedCalls(), [delayed_call])
+        clock.advance(0)
+        self.assertEqual(calls, [])
+        clock.advance(5)
+        self.assertEqual(calls, ['foo'])
+
+    def test_errors_logged(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        calls = []
+
+        def error():
+            raise DummyError()
+
+        scheduler.callLater(0, error)
+        scheduler.callLater(0, calls.append, 'foo')
+        clock.advance(0)
+        self.assertEqual(calls, ['foo'])
+        self.assertEqual(len(self.flushLoggedErrors(DummyError)), 1)
+
+    def test_defaults_to_reactor(self):
+        from twisted.internet import reactor
+        self.assertEqual(BatchingScheduler().reactor, reactor)
+
+    def test_defer_async(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        d = defer_async('foo', reactor=scheduler)
+        self.assertEqual(d.called, False)
+        clock.advance(0)
+        self.assertEqual(d.result, 'foo')
+
+    def test_simulate_async(self):
+        clock = Clock()
+        scheduler = BatchingScheduler(clock)
+        f = simulate_async(lambda x: x, reactor=scheduler)
+        results = []
+        for i in range(3):
+            f(i).addCallback(results.append)
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertEqual(results, [])
+        clock.advance(0)
+        self.assertEqual(results, [0, 1, 2])
@@ -2,9 +2,65 @@
 Small utilities for writing Vumi Go APIs.
 """
 
+from __future__ import absolute_import
+
+from collections import deque
 from functools import wraps
 
 from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python import log
+
+
+class BatchingScheduler(object):
+    """
+    Runs zero-delay calls in batches, using one reactor call per batch.
+
+    Pass an instance as the ``reactor`` argument of :func:`defer_async` or
+    :func:`simulate_async` to avoid scheduling a separate delayed call on
+    the reactor for every call::
+
+        scheduler = BatchingScheduler()
+        get = simulate_async(_get, reactor=scheduler)
+
+    Calls run in the order they were scheduled. As with
+    ``reactor.callLater(0, ...)``, calls scheduled while a batch is running
+    run in the next batch, after the reactor has had a chance to run.
+    Calls with a non-zero delay are passed to the reactor unchanged.
+
+    :param reactor:
+        The reactor to schedule batches on. Defaults to the global reactor.
+    """
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.pending = deque()
+        self._batch_call = None
+
+    def callLater(self, delay, f, *args, **kw):
+        """
+        Schedule ``f(*args, **kw)`` to be called after ``delay`` seconds.
+        Zero-delay calls are added to the next batch and ``None`` is
+        returned, so they can't be cancelled.
+        """
+        if delay > 0:
+            return self.reactor.callLater(delay, f, *args, **kw)
+        self.pending.append((f, args, kw))
+        if self._batch_call is None:
+            self._batch_call = self.reactor.callLater(0, self._run_batch)
+
+    def _run_batch(self):
+        self._batch_call = None
+        pending = self.pending
+        # Only run the calls that were scheduled before the batch started.
+        # Calls scheduled while it runs start a new batch.
+        for _ in xrange(len(pending)):
+            f, args, kw = pending.popleft()
+            try:
+                f(*args, **kw)
+            except Exception:
+                log.err(None, "Error running batched call %r" % (f,))
 
 
 def defer_async(value, reactor=None):
@@ -13,7 +69,8 @@ def defer_async(value, reactor=None):
     reactor has a chance to run.
 
     Useful when writing functions that need to mimic asynchronous behaviour
-    (usually for use in unit tests).
+    (usually for use in unit tests). ``reactor`` may be a
+    :class:`BatchingScheduler`.
     """
     if reactor is None:
         from twisted.internet import reactor
@@ -32,6 +89,9 @@ def simulate_async(f, reactor=None):
     already fired. :func:`simulate_async` supports that case
     by returning a new deferred that will only fire after the
     reactor has run.
+
+    ``reactor`` may be a :class:`BatchingScheduler`, to fire the
+    deferreds returned by many calls from a single reactor call.
     """
     if reactor is None:
         from twisted.internet import reactor
@@ -43,4 +103,6 @@ def simulate_async(f, reactor=None):
         reactor.callLater(0, lambda: d.chainDeferred(async_d))
         return async_d
 
+    # Let callers such as fields_kwargs() inspect the original signature.
+    async_f.__wrapped__ = f
     return async_f